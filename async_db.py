@@ -0,0 +1,142 @@
+"""Coroutine versions of the storage backend's operations.
+
+Handlers and the scheduler await these instead of calling the backend
+directly. For a blocking backend (SQLite) the I/O runs on worker threads
+and never blocks the event loop: every write goes through a single writer
+thread; reads share a small pool. A non-blocking backend (memory) is called
+inline.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import profiler
+import storage
+from config import DB_READ_THREADS, STORAGE_BACKEND
+
+_store   = storage.open_storage(STORAGE_BACKEND)
+
+_writer  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="db-reader")
+
+
+def _offload(executor, fn):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.DB_SECONDS.observe(elapsed, function=fn.__name__)
+            if profiler.tracing:
+                profiler.trace("query", fn.__name__, elapsed, f"args={args!r:.200}")
+
+    if not _store.blocking:
+        @functools.wraps(fn)
+        async def inline(*args, **kwargs):
+            return timed(*args, **kwargs)
+        return inline
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(timed, *args, **kwargs))
+    return wrapper
+
+
+def _read(name):
+    return _offload(_readers, getattr(_store, name))
+
+
+def _write(name):
+    return _offload(_writer, getattr(_store, name))
+
+
+# Called once at startup, before the event loop is busy
+init_db = _store.init_db
+
+
+# ── Channels ────────────────────────────────────────────────────────────────
+
+add_channel    = _write("add_channel")
+get_channels   = _read("get_channels")
+delete_channel = _write("delete_channel")
+
+# ── Posts ────────────────────────────────────────────────────────────────────
+
+save_post      = _write("save_post")
+get_posts      = _read("get_posts")
+get_posts_page = _read("get_posts_page")
+get_post       = _read("get_post")
+get_post_media = _read("get_post_media")
+delete_post    = _write("delete_post")
+
+# ── Scheduled Posts ──────────────────────────────────────────────────────────
+
+schedule_post          = _write("schedule_post")
+get_scheduled_posts    = _read("get_scheduled_posts")
+get_scheduled_page     = _read("get_scheduled_page")
+get_scheduled          = _read("get_scheduled")
+get_pending_scheduled  = _read("get_pending_scheduled")
+get_due_scheduled      = _read("get_due_scheduled")
+count_due_scheduled    = _read("count_due_scheduled")
+get_upcoming_scheduled = _read("get_upcoming_scheduled")
+claim_due_scheduled    = _write("claim_due_scheduled")
+retry_scheduled        = _write("retry_scheduled")
+retry_scheduled_many   = _write("retry_scheduled_many")
+mark_scheduled_sent    = _write("mark_scheduled_sent")
+mark_scheduled_failed  = _write("mark_scheduled_failed")
+mark_scheduled_many    = _write("mark_scheduled_many")
+delete_scheduled       = _write("delete_scheduled")
+
+# ── Delivery Outbox ──────────────────────────────────────────────────────────
+
+queue_deliveries   = _write("queue_deliveries")
+start_deliveries   = _write("start_deliveries")
+finish_deliveries  = _write("finish_deliveries")
+recover_deliveries = _write("recover_deliveries")
+prune_deliveries   = _write("prune_deliveries")
+
+# ── Event Log ────────────────────────────────────────────────────────────────
+
+get_events   = _read("get_events")
+clear_events = _write("clear_events")
+prune_events = _write("prune_events")
+
+
+async def log_event(*args, **kwargs):
+    # log_event only appends to an in-memory queue (or dict), so it is
+    # cheaper to call inline than to hop to the writer thread.
+    _store.log_event(*args, **kwargs)
+
+# ── Callback Tokens ──────────────────────────────────────────────────────────
+
+# Sync, like log_event: the callback token cache calls it from the event loop
+save_callback_token   = _store.save_callback_token
+get_callback_token    = _read("get_callback_token")
+prune_callback_tokens = _write("prune_callback_tokens")
+
+# ── User State ───────────────────────────────────────────────────────────────
+
+get_user_state   = _read("get_user_state")
+save_user_states = _write("save_user_states")
+
+# ── Maintenance ──────────────────────────────────────────────────────────────
+
+compact_db = _write("compact_db")
+
+# ── Settings ─────────────────────────────────────────────────────────────────
+
+# get_settings inserts the default row on first use, so it counts as a write.
+get_settings   = _write("get_settings")
+update_setting = _write("update_setting")
+
+
+def shutdown():
+    """Wait for queued writes to finish, stop the DB threads and close connections."""
+    _writer.shutdown(wait=True)
+    _readers.shutdown(wait=True)
+    _store.close_db()
@@ -0,0 +1,373 @@
+"""Time every public database.py function on large synthetic datasets.
+
+    python bench_db.py --scale large --output results.json
+    python bench_db.py --scale small --baseline results.json
+
+Builds a synthetic database at the chosen scale (cached between runs by
+size and seed), copies it to a scratch file and times each function
+against the copy, so every run starts from identical data. Results are
+written as JSON. With --baseline, p50 latencies are compared against an
+earlier results file, and the exit status is 1 if any function got slower
+than --threshold.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import database as db
+from config import EVENT_FLUSH_SIZE, EVENT_PRUNE_CHUNK, EVENT_RETENTION_DAYS, VACUUM_PAGES_PER_STEP
+
+SCALES = {
+    #          users    posts    events  pending schedules
+    "small":  (1_000,   20_000,  100_000,    10_000),
+    "medium": (10_000,  200_000, 1_000_000,  100_000),
+    "large":  (10_000,  1_000_000, 5_000_000, 500_000),
+}
+
+CHANNELS_PER_USER = 3
+TOKENS_PER_USER   = 5
+HISTORY_DAYS      = 60      # posts and events are spread over this many past days
+SCHEDULE_DAYS     = 30      # pending schedules are spread over this many coming days
+DUE_FRACTION      = 0.01    # of pending schedules already due
+EVENT_TYPES       = ("start", "post_created", "post_published", "multipost_sent",
+                     "post_scheduled", "channel_added", "scheduled_sent")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--posts", type=int)
+    parser.add_argument("--events", type=int)
+    parser.add_argument("--schedules", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=float, default=1.0,
+                        help="multiplier for each function's default number of calls")
+    parser.add_argument("--only", help="comma-separated function names to time")
+    parser.add_argument("--data-dir", default=tempfile.gettempdir(),
+                        help="where generated datasets are cached")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="p50 slowdown vs --baseline counted as a regression")
+    args = parser.parse_args()
+
+    defaults = dict(zip(("users", "posts", "events", "schedules"), SCALES[args.scale]))
+    for name, value in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    return args
+
+
+# ── Dataset ──────────────────────────────────────────────────────────────────
+
+def _stamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def build_dataset(path, args):
+    """Create the schema with database.init_db(), then bulk-load synthetic rows."""
+    rnd = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    history = HISTORY_DAYS * 86400
+
+    def past():
+        return _stamp(now - timedelta(seconds=rnd.randrange(history)))
+
+    db.DATABASE_PATH = path
+    db.init_db()
+    db.close_db()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    with conn:
+        conn.executemany(
+            "INSERT INTO settings (user_id) VALUES (?)",
+            ((user_id,) for user_id in range(1, args.users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO channels (user_id, channel_id, channel_name, added_at) VALUES (?,?,?,?)",
+            ((user_id, f"-100{user_id:07d}{n}", f"Channel {user_id}/{n}", past())
+             for user_id in range(1, args.users + 1) for n in range(CHANNELS_PER_USER))
+        )
+        conn.executemany(
+            """INSERT INTO posts (user_id, title, content, status, created_at, updated_at)
+               VALUES (?,?,?,?,?,?)""",
+            ((user_id, f"Post {n}", f"Synthetic post {n} " * 8,
+              "draft" if n % 4 else "published", created, created)
+             for n in range(1, args.posts + 1)
+             for user_id, created in [(rnd.randint(1, args.users), past())])
+        )
+        conn.executemany(
+            """INSERT INTO scheduled_posts
+               (user_id, post_id, channel_id, channel_name, scheduled_at, requested_at,
+                scheduled_time, content)
+               VALUES (?,?,?,?,?,?,strftime('%Y-%m-%d %H:%M', ?, 'unixepoch'),?)""",
+            ((user_id, rnd.randint(1, args.posts), f"-100{user_id:07d}0", f"Channel {user_id}/0",
+              at, at, at, f"Scheduled post {n}")
+             for n in range(args.schedules)
+             for user_id, at in [(rnd.randint(1, args.users), _schedule_time(rnd, now))])
+        )
+        conn.executemany(
+            """INSERT INTO event_log (user_id, event_type, description, post_id, created_at)
+               VALUES (?,?,?,?,?)""",
+            ((rnd.randint(1, args.users), event_type, f"Synthetic {event_type} event",
+              rnd.randint(1, args.posts), past())
+             for n in range(args.events) for event_type in [rnd.choice(EVENT_TYPES)])
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO callback_tokens (token, payload, created_at) VALUES (?,?,?)",
+            ((f"tok{n:09d}", json.dumps([n]), int(now.timestamp()) - rnd.randrange(history))
+             for n in range(args.users * TOKENS_PER_USER))
+        )
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def _schedule_time(rnd, now):
+    start = int(now.timestamp())
+    if rnd.random() < DUE_FRACTION:
+        return start - rnd.randrange(3600)
+    return start + rnd.randrange(SCHEDULE_DAYS * 86400)
+
+
+def dataset_path(args):
+    name = f"telebot-bench-u{args.users}-p{args.posts}-e{args.events}-s{args.schedules}-{args.seed}.db"
+    return os.path.join(args.data_dir, name)
+
+
+# ── Cases ────────────────────────────────────────────────────────────────────
+#
+# (name, calls, prepare[, rows]): prepare() runs untimed right before each call
+# and returns the arguments. Bulk cases give the rows each call handles, and
+# also report rows/s. Cases run in order on one scratch copy, so the ones that
+# delete rows or pages come last.
+
+def cases(args, scratch):
+    rnd = random.Random(args.seed + 1)
+    now = int(time.time())
+    cutoff = _stamp(datetime.now(timezone.utc) - timedelta(days=EVENT_RETENTION_DAYS))
+    lookup = sqlite3.connect(scratch)
+
+    def user():
+        return rnd.randint(1, args.users)
+
+    def post():
+        return rnd.randint(1, args.posts)
+
+    def sched():
+        return rnd.randint(1, args.schedules)
+
+    def owned(table, row_id):
+        row = lookup.execute(f"SELECT user_id FROM {table} WHERE id=?", (row_id,)).fetchone()
+        return row_id, row[0] if row else 0
+
+    def token():
+        return f"tok{rnd.randrange(args.users * TOKENS_PER_USER):09d}"
+
+    def second_page():
+        owner = user()
+        rows, _, _ = db.get_posts_page(owner)
+        return owner, rows[-1]["id"] if rows else None, "next"
+
+    def deliveries():
+        # Ten of the outbox jobs queue_deliveries has added so far
+        last = lookup.execute("SELECT coalesce(max(id), 0) FROM deliveries").fetchone()[0]
+        first = rnd.randint(1, max(1, last - 9))
+        return list(range(first, first + 10))
+
+    def queue_events():
+        for _ in range(EVENT_FLUSH_SIZE):
+            db.log_event(user(), "bench", "Queued by bench_db.py")
+        return ()
+
+    return [
+        # Reads
+        ("get_channels",           2000, lambda: (user(),)),
+        ("get_posts",               200, lambda: (user(),)),
+        ("get_posts_page",         2000, lambda: (user(),)),
+        ("get_posts_page:next",    2000, second_page),
+        ("get_post",               5000, lambda: (post(),)),
+        ("get_post_media",         2000, lambda: ([post() for _ in range(20)],)),
+        ("get_scheduled_posts",     500, lambda: (user(),)),
+        ("get_scheduled_page",     2000, lambda: (user(),)),
+        ("get_scheduled",          5000, lambda: (sched(),)),
+        ("get_pending_scheduled",     3, lambda: ()),
+        ("get_due_scheduled",       200, lambda: (now, 100)),
+        ("get_upcoming_scheduled",  200, lambda: (1000,)),
+        ("count_due_scheduled",     200, lambda: (now,)),
+        ("get_events",             1000, lambda: (user(),)),
+        ("get_callback_token",     5000, lambda: (token(),)),
+        ("get_user_state",         5000, lambda: (user(),)),
+
+        # Writes
+        ("init_db",                  20, lambda: ()),
+        ("get_settings",           2000, lambda: (user(),)),
+        ("update_setting",         2000, lambda: (user(), "notifications", rnd.randint(0, 1))),
+        ("add_channel",            2000, lambda: (user(), f"-100{rnd.randrange(10**9)}", "Bench channel")),
+        ("save_post",              2000, lambda: (user(), "Bench post", "Saved by bench_db.py")),
+        ("save_post:album",        2000, lambda: (user(), "Bench album", "Saved by bench_db.py", None,
+                                                  "album", [("photo", f"bench{i}") for i in range(4)])),
+        ("schedule_post",          2000, lambda: (user(), "-1001", "Bench channel", now + 86400,
+                                                  "Scheduled by bench_db.py")),
+        ("claim_due_scheduled",     200, lambda: ("bench", now, 300, 100)),
+        ("retry_scheduled",        2000, lambda: (sched(), now + 60, "Timed out")),
+        ("mark_scheduled_sent",    2000, lambda: (sched(),)),
+        ("mark_scheduled_failed",  2000, lambda: (sched(),)),
+        ("retry_scheduled_many",    200, lambda: ([(sched(), now + 60, "Timed out", True)
+                                                   for _ in range(100)],), 100),
+        ("mark_scheduled_many",     200, lambda: ([(sched(), rnd.choice(("sent", "failed")))
+                                                   for _ in range(100)],), 100),
+        ("queue_deliveries",       2000, lambda: ([("multipost", user(), post(), None, "-1001")
+                                                   for _ in range(10)],)),
+        ("start_deliveries",       2000, lambda: (deliveries(),)),
+        ("finish_deliveries",      2000, lambda: ([(job_id, "sent", 1, None) for job_id in deliveries()],)),
+        ("recover_deliveries",       50, lambda: (now - 300,)),
+        ("log_event",             20000, lambda: (user(), "bench", "Logged by bench_db.py")),
+        ("save_callback_token",   20000, lambda: (f"bench{rnd.randrange(10**9)}", "[1]", now)),
+        ("flush_writes",            100, queue_events),
+        ("save_user_states",        200, lambda: ([(user(), '{"flow": ["create_post", 1]}')
+                                                   for _ in range(100)],)),
+
+        # Deletes and maintenance
+        ("delete_channel",         2000, lambda: (user(), f"-100{user():07d}1")),
+        ("delete_post",            2000, lambda: owned("posts", post())),
+        ("delete_scheduled",       2000, lambda: owned("scheduled_posts", sched())),
+        ("clear_events",            500, lambda: (user(),)),
+        ("prune_events",             50, lambda: (cutoff, EVENT_PRUNE_CHUNK)),
+        ("prune_deliveries",         50, lambda: (now + 1, EVENT_PRUNE_CHUNK)),
+        ("prune_callback_tokens",    50, lambda: (now - 30 * 86400, EVENT_PRUNE_CHUNK)),
+        ("compact_db",               20, lambda: (VACUUM_PAGES_PER_STEP,)),
+    ]
+
+
+def run_case(fn, calls, prepare, rows=1):
+    samples = []
+    for _ in range(calls):
+        call_args = prepare()
+        started = time.perf_counter()
+        fn(*call_args)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+
+    def pct(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 4)
+
+    total = sum(samples)
+    return {
+        "calls":     calls,
+        "mean_ms":   round(total / calls * 1000, 4),
+        "p50_ms":    pct(0.50),
+        "p95_ms":    pct(0.95),
+        "p99_ms":    pct(0.99),
+        "max_ms":    round(samples[-1] * 1000, 4),
+        "ops_per_s": round(calls / total, 1) if total else None,
+        "rows_per_s": round(calls * rows / total, 1) if total and rows > 1 else None,
+    }
+
+
+def public_functions():
+    return {
+        name for name, obj in inspect.getmembers(db, inspect.isfunction)
+        if not name.startswith("_") and obj.__module__ == db.__name__
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print p50 changes against a baseline file; return the regressed function names."""
+    with open(baseline_path) as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    regressed = []
+    print(f"\n{'function':<26}{'base p50':>12}{'p50':>12}{'change':>9}", file=sys.stderr)
+    for result in results:
+        old = before.get(result["name"])
+        if not old or not old["p50_ms"]:
+            continue
+        change = result["p50_ms"] / old["p50_ms"] - 1
+        flag = "  REGRESSED" if change > threshold else ""
+        if flag:
+            regressed.append(result["name"])
+        print(f"{result['name']:<26}{old['p50_ms']:>12.4f}{result['p50_ms']:>12.4f}{change:>+9.0%}{flag}",
+              file=sys.stderr)
+    return regressed
+
+
+def main():
+    args = parse_args()
+    source = dataset_path(args)
+    if not os.path.exists(source):
+        print(f"Generating {source} …", file=sys.stderr)
+        started = time.perf_counter()
+        build_dataset(source + ".tmp", args)
+        os.replace(source + ".tmp", source)
+        print(f"  done in {time.perf_counter() - started:.0f} s", file=sys.stderr)
+
+    scratch = os.path.join(tempfile.mkdtemp(), "bench.db")
+    shutil.copyfile(source, scratch)
+    db.DATABASE_PATH = scratch
+    db.init_db()    # bring datasets cached by an older schema up to date
+
+    only = set(args.only.split(",")) if args.only else None
+    results = []
+    for name, calls, prepare, *rows in cases(args, scratch):
+        fn = getattr(db, name.split(":")[0])
+        if only and name.split(":")[0] not in only:
+            continue
+        result = {"name": name, **run_case(fn, max(1, int(calls * args.iterations)), prepare, *rows)}
+        results.append(result)
+        print(f"{name:<26}{result['p50_ms']:>10.4f} ms p50{result['p99_ms']:>10.4f} ms p99"
+              f"{result['ops_per_s'] or 0:>12.0f} ops/s"
+              + (f"{result['rows_per_s']:>12.0f} rows/s" if result["rows_per_s"] else ""), file=sys.stderr)
+    db.close_db()
+    shutil.rmtree(os.path.dirname(scratch))
+
+    timed = {r["name"].split(":")[0] for r in results}
+    report = {
+        "meta": {
+            "timestamp":   datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit":      _git_commit(),
+            "python":      platform.python_version(),
+            "sqlite":      sqlite3.sqlite_version,
+            "platform":    platform.platform(),
+            "scale":       {"users": args.users, "posts": args.posts,
+                            "events": args.events, "schedules": args.schedules},
+            "seed":        args.seed,
+            "schema":      len(db.MIGRATIONS),
+            "not_timed":   sorted(public_functions() - timed - {"close_db"}) if not only else [],
+        },
+        "results": results,
+    }
+    if report["meta"]["not_timed"]:
+        print(f"Not timed: {', '.join(report['meta']['not_timed'])}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
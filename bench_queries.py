@@ -0,0 +1,57 @@
+"""Queries per second of the /start pair (get_settings + log_event) in database.py.
+
+    python bench_queries.py --seconds 5
+    git worktree add /tmp/telebot-before 83e2864~1
+    python bench_queries.py --repo /tmp/telebot-before
+
+Alternates get_settings and log_event for --users users on a fresh
+database file for --seconds, then closes the database (writing out any
+buffered events) before stopping the clock. Both functions exist in every
+revision, so --repo can time an older checkout's database.py, e.g. the one
+before connection pooling (83e2864~1), which opened a connection per call.
+Later revisions also buffer log_event, so compare adjacent commits to see
+one change.
+"""
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repo", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="checkout whose database.py is timed (default: this one)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # config reads the environment at import
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_queries.db")
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    sys.path.insert(0, os.path.abspath(args.repo))
+    db = importlib.import_module("database")
+    db.init_db()
+
+    queries = 0
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    while time.perf_counter() < deadline:
+        for user_id in range(1, args.users + 1):
+            db.get_settings(user_id)
+            db.log_event(user_id, "start", "User started bot")
+        queries += 2 * args.users
+    if hasattr(db, "close_db"):
+        db.close_db()
+    elapsed = time.perf_counter() - started
+
+    print(f"{db.__file__}: {queries} queries in {elapsed:.1f} s, {queries / elapsed:,.0f} queries/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Time the router's dispatch: parsing an update's route key and resolving it.
+
+    python bench_router.py --iterations 5000
+
+Builds the app's router with main.build_router() and makes one update per
+route it knows (callback-data prefixes, commands, plain text and media).
+Each update is resolved outside any flow, if it routes there, and in every
+flow state that handles its key. Times Router.check_update plus
+Router.resolve, which is all the router costs before a handler runs, and
+prints ns per dispatch by kind of update.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+from telegram import Update
+
+from main import build_router
+from router import FLOW_KEY, MEDIA, TEXT
+
+USER = {"id": 100000, "is_bot": False, "first_name": "Bench"}
+CHAT = {"id": 100000, "type": "private"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000,
+                        help="dispatches timed per (update, flow state) case")
+    return parser.parse_args()
+
+
+def make_update(key):
+    """An update that routes on `key`, and its kind."""
+    if key == TEXT:
+        kind, payload = "text", {"message": _message(text="Some text")}
+    elif key == MEDIA:
+        photo = [{"file_id": "p", "file_unique_id": "p", "width": 1280, "height": 720}]
+        kind, payload = "media", {"message": _message(photo=photo)}
+    elif key.startswith("/"):
+        entities = [{"type": "bot_command", "offset": 0, "length": len(key)}]
+        kind, payload = "command", {"message": _message(text=f"{key} arg", entities=entities)}
+    else:
+        kind, payload = "callback", {"callback_query": {
+            "id": "1", "from": USER, "chat_instance": "1", "data": f"{key}:Ab3dE6gH",
+            "message": _message(text="Menu"),
+        }}
+    return kind, Update.de_json({"update_id": 1, **payload}, None)
+
+
+def _message(**content):
+    return {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, **content}
+
+
+def cases(router):
+    """(kind, key, update, user_data) for every route: outside any flow for
+    global routes and flow entry points, and in each flow state handling it."""
+    for key in sorted(router.keys):
+        kind, update = make_update(key)
+        if key in router.globals or key in router.entries:
+            yield kind, key, update, {}
+        for flow in router.flows.values():
+            for state, routes in flow.states.items():
+                if key in routes or key in flow.fallbacks:
+                    yield kind, key, update, {FLOW_KEY: (flow.name, state)}
+
+
+def main():
+    args   = parse_args()
+    router = build_router()
+    timings = defaultdict(list)         # kind -> ns per dispatch, one per case
+
+    for kind, key, update, user_data in cases(router):
+        if router.resolve(router.check_update(update), user_data)[1] is None:
+            sys.exit(f"{key!r} does not route (flow state {user_data.get(FLOW_KEY)})")
+        check, resolve = router.check_update, router.resolve
+        started = time.perf_counter_ns()
+        for _ in range(args.iterations):
+            resolve(check(update), user_data)
+        timings[kind].append((time.perf_counter_ns() - started) / args.iterations)
+
+    everything = [ns for samples in timings.values() for ns in samples]
+    print(f"{len(router.keys)} routes, {len(everything)} cases, "
+          f"{args.iterations} dispatches each\n")
+    print(f"{'kind':<10}{'cases':>8}{'mean ns':>10}{'max ns':>10}")
+    for kind, samples in [*sorted(timings.items()), ("all", everything)]:
+        print(f"{kind:<10}{len(samples):>8}{sum(samples) / len(samples):>10.0f}{max(samples):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
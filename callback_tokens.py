@@ -0,0 +1,60 @@
+import base64
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import async_db
+from config import CALLBACK_CACHE_SIZE, CALLBACK_TOKEN_TTL
+
+
+class ExpiredCallback(Exception):
+    """The button's token is unknown or older than CALLBACK_TOKEN_TTL."""
+
+
+# token -> (payload, created_at), least recently used first
+_cache = OrderedDict()
+
+
+def encode(prefix, *payload):
+    """Return "prefix:token" callback data standing for `payload`.
+
+    The token is a hash of the payload, so it is always 8 characters and
+    re-rendering the same button reuses it. New tokens are queued for the
+    DB, which is the fallback once they fall out of the cache.
+    """
+    raw = json.dumps(payload, separators=(",", ":"))
+    digest = hashlib.blake2b(raw.encode(), digest_size=6).digest()
+    token = base64.urlsafe_b64encode(digest).decode()
+
+    now = int(time.time())
+    entry = _cache.get(token)
+    if entry is None or now - entry[1] > CALLBACK_TOKEN_TTL // 2:
+        entry = (list(payload), now)
+        async_db.save_callback_token(token, raw, now)
+    _remember(token, entry)
+    return f"{prefix}:{token}"
+
+
+async def decode(data):
+    """Return the payload list behind "prefix:token" callback data."""
+    token = data.split(":", 1)[1]
+    entry = _cache.get(token)
+    if entry is None:
+        row = await async_db.get_callback_token(token)
+        if row is None:
+            raise ExpiredCallback(token)
+        entry = (json.loads(row["payload"]), row["created_at"])
+
+    if time.time() - entry[1] > CALLBACK_TOKEN_TTL:
+        _cache.pop(token, None)
+        raise ExpiredCallback(token)
+    _remember(token, entry)
+    return entry[0]
+
+
+def _remember(token, entry):
+    _cache[token] = entry
+    _cache.move_to_end(token)
+    if len(_cache) > CALLBACK_CACHE_SIZE:
+        _cache.popitem(last=False)
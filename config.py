@@ -1,5 +1,97 @@
 import os
+import socket
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
-DATABASE_PATH = "telebot.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "telebot.db")
+# "sqlite" (DATABASE_PATH) or "memory" (nothing persisted; tests and load tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
 TIMEZONE = "UTC"
+
+# Bot API server; point it at a local fake_bot_api.FakeBotAPI for load tests
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org")
+
+# How updates arrive: "polling" (default) or "webhook". In webhook mode a local
+# HTTP server receives them; WEBHOOK_URL is the public HTTPS address Telegram
+# posts to (usually a reverse proxy in front of WEBHOOK_LISTEN:WEBHOOK_PORT).
+UPDATE_MODE             = os.getenv("UPDATE_MODE", "polling")
+WEBHOOK_URL             = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET          = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN          = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT            = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH            = "telegram"
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Prometheus metrics endpoint (http://METRICS_LISTEN:METRICS_PORT/metrics); 0 turns it off
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT   = int(os.getenv("METRICS_PORT", "9464"))
+
+# Profiling: PROFILE=1 logs every handler or DB call slower than PROFILE_SLOW_MS from
+# startup (admins can also toggle it with /profile trace on|off). /profile [seconds]
+# captures a cProfile of the event loop into PROFILE_DIR.
+ADMIN_IDS       = {int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
+PROFILE         = os.getenv("PROFILE", "") == "1"
+PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", "250"))
+PROFILE_SECONDS = 30
+PROFILE_DIR     = os.getenv("PROFILE_DIR", "profiles")
+
+# Threads (and pooled read connections) serving reads; writes use one thread
+DB_READ_THREADS = 4
+
+# SQLite tuning for the pooled connections in database.py
+DB_CACHE_SIZE_KB   = 16384              # page cache per connection
+DB_MMAP_SIZE       = 256 * 1024 * 1024  # bytes of the DB file to memory-map
+DB_STATEMENT_CACHE = 256                # prepared statements kept per connection
+
+# Scheduler: due rows fetched per query, pending jobs kept in the wake-up queue,
+# and scheduled posts delivered in parallel (1 sends them one at a time)
+SCHEDULER_BATCH_SIZE  = 100
+SCHEDULER_WINDOW      = 1000
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "16"))
+
+# Several bot processes may share one DB: each claims due rows under its worker
+# id for SCHEDULER_LEASE_SECONDS (a crashed worker's rows are re-claimed after
+# that), and re-reads upcoming jobs every SCHEDULER_RESYNC_INTERVAL s to pick up
+# ones scheduled through another process
+SCHEDULER_WORKER_ID       = os.getenv("SCHEDULER_WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+SCHEDULER_LEASE_SECONDS   = 300
+SCHEDULER_RESYNC_INTERVAL = 60
+
+# Scheduled sends that fail transiently (connection failures, Telegram 5xx) are retried
+# with exponential backoff and jitter: up to SCHEDULER_RETRY_BASE * 2**attempt s,
+# capped at SCHEDULER_RETRY_MAX, and fail for good after SCHEDULER_MAX_ATTEMPTS
+# tries. Flood waits are retried after the retry_after Telegram asks for and do
+# not count towards the limit. A timeout or broken connection after the request
+# went out is not retried: the post may already be in the channel.
+SCHEDULER_MAX_ATTEMPTS = 8
+SCHEDULER_RETRY_BASE   = 15
+SCHEDULER_RETRY_MAX    = 3600
+
+# Outbox jobs (publish/multipost sends) untouched this long were left behind by a
+# dead process; recovery takes them over at startup and every this many seconds
+OUTBOX_STALE_SECONDS = 300
+
+# Channels a multipost sends to at once; progress is reported after each batch
+MULTIPOST_CONCURRENCY = 10
+
+# Event log batching: flush once this many events are queued, or this often (s)
+EVENT_FLUSH_SIZE     = 200
+EVENT_FLUSH_INTERVAL = 1.0
+
+# Event log retention: older events are rolled up into daily counts and deleted
+# in chunks, then freed pages are returned in steps. 0 keeps events forever.
+EVENT_RETENTION_DAYS   = 30
+EVENT_PRUNE_CHUNK      = 500
+VACUUM_PAGES_PER_STEP  = 1000
+MAINTENANCE_INTERVAL   = 3600
+
+# Users' conversation state (ctx.user_data) is written to the DB in one batch this
+# often (s); a crash loses at most this much flow progress
+USER_STATE_FLUSH_INTERVAL = 5.0
+
+# Rows per page in the post and schedule pickers
+PAGE_SIZE = 8
+
+# Inline-button callback tokens: how many stay cached in memory, and how long
+# (s) a button keeps working before it expires
+CALLBACK_CACHE_SIZE = 10000
+CALLBACK_TOKEN_TTL  = 30 * 24 * 3600
@@ -1,17 +1,177 @@
+import json
+import logging
+import queue
 import sqlite3
-from config import DATABASE_PATH
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
+from config import (DATABASE_PATH, DB_READ_THREADS, DB_CACHE_SIZE_KB,
+                    DB_MMAP_SIZE, DB_STATEMENT_CACHE,
+                    EVENT_FLUSH_SIZE, EVENT_FLUSH_INTERVAL, PAGE_SIZE)
 
-def get_conn():
-    conn = sqlite3.connect(DATABASE_PATH)
+logger = logging.getLogger(__name__)
+
+
+# ── Connections ──────────────────────────────────────────────────────────────
+#
+# One long-lived writer connection guarded by a lock, plus a small pool of
+# read-only connections. WAL lets the readers run while the writer commits.
+
+_write_lock = threading.Lock()
+_writer = None
+_readers = queue.LifoQueue(maxsize=DB_READ_THREADS)
+
+
+def _connect(readonly=False):
+    if readonly:
+        target, uri = f"file:{DATABASE_PATH}?mode=ro", True
+    else:
+        target, uri = DATABASE_PATH, False
+    conn = sqlite3.connect(target, uri=uri, check_same_thread=False,
+                           cached_statements=DB_STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
     return conn
 
 
-def init_db():
-    conn = get_conn()
-    c = conn.cursor()
+@contextmanager
+def _write_conn():
+    global _writer
+    with _write_lock:
+        if _writer is None:
+            _writer = _connect()
+            _writer.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield _writer
+            _writer.commit()
+        except BaseException:
+            _writer.rollback()
+            raise
 
+
+@contextmanager
+def _read_conn():
+    try:
+        conn = _readers.get_nowait()
+    except queue.Empty:
+        conn = _connect(readonly=True)
+    try:
+        yield conn
+    finally:
+        try:
+            _readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_db():
+    global _writer
+    flush_writes()
+    with _write_lock:
+        if _writer is not None:
+            _writer.execute("PRAGMA optimize")
+            _writer.close()
+            _writer = None
+    while True:
+        try:
+            _readers.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def _page(conn, query, keyset, params, cursor, direction, limit, descending):
+    """Run one page of a keyset-paginated query; return (rows, has_prev, has_next).
+
+    `query` contains {keyset} and {order} placeholders, and `keyset` compares
+    the sort key with that of the cursor row using an {op} placeholder.
+    `direction` "next" continues after the cursor row, "prev" returns the
+    page before it. Rows always come back in display order.
+    """
+    backwards = direction == "prev"
+    op, order = ("<", "DESC") if descending != backwards else (">", "ASC")
+    sql = query.format(keyset=f" AND {keyset.format(op=op)}" if cursor else "", order=order)
+    args = (*params, cursor, limit + 1) if cursor else (*params, limit + 1)
+
+    rows = conn.execute(sql, args).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        return rows, more, True
+    return rows, cursor is not None, more
+
+
+# ── Write-behind queue ───────────────────────────────────────────────────────
+#
+# log_event and save_callback_token only queue their rows. A background
+# thread writes the queue with executemany, one transaction per batch, once
+# EVENT_FLUSH_SIZE rows are waiting or every EVENT_FLUSH_INTERVAL seconds.
+# Reads of that data flush first so they see everything queued so far;
+# close_db() flushes on shutdown.
+
+_queued = {}            # INSERT statement -> rows waiting to be written
+_queued_rows = 0
+_queue_lock = threading.Lock()
+_queue_full = threading.Event()
+_flusher = None
+
+
+def _enqueue(sql, row):
+    global _queued_rows, _flusher
+    with _queue_lock:
+        _queued.setdefault(sql, []).append(row)
+        _queued_rows += 1
+        if _queued_rows >= EVENT_FLUSH_SIZE:
+            _queue_full.set()
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="db-flusher", daemon=True)
+            _flusher.start()
+
+
+def flush_writes():
+    global _queued, _queued_rows
+    with _queue_lock:
+        batch, _queued, _queued_rows = _queued, {}, 0
+    if not batch:
+        return
+    with _write_conn() as conn:
+        for sql, rows in batch.items():
+            conn.executemany(sql, rows)
+
+
+def _flush_loop():
+    while True:
+        _queue_full.wait(EVENT_FLUSH_INTERVAL)
+        _queue_full.clear()
+        try:
+            flush_writes()
+        except Exception as e:
+            logger.error(f"Write-behind flush failed: {e}")
+
+
+# ── Schema ───────────────────────────────────────────────────────────────────
+
+def init_db():
+    """Bring the schema up to date, applying each pending migration in its own transaction."""
+    with _write_conn() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Lets compact_db() return space to the OS. On an existing file the
+            # setting only takes effect after a full VACUUM, run once here.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version={target}")
+            conn.commit()
+
+
+def _create_tables(c):
     c.execute("""
         CREATE TABLE IF NOT EXISTS channels (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -75,201 +235,672 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
+
+def _add_hot_path_indexes(c):
+    # Each index matches the WHERE + ORDER BY of a query below, so none of
+    # them needs a table scan or a temp B-tree for sorting.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_channels_user_added "
+              "ON channels (user_id, added_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_created "
+              "ON posts (user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_status_created "
+              "ON posts (user_id, status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sched_status_time "
+              "ON scheduled_posts (status, scheduled_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sched_user_status_time "
+              "ON scheduled_posts (user_id, status, scheduled_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_user_created "
+              "ON event_log (user_id, created_at)")
+
+
+def _add_scheduled_at(c):
+    # Epoch seconds (UTC) replace string comparison of scheduled_time, which
+    # is kept only as a display label.
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN scheduled_at INTEGER")
+    c.execute("UPDATE scheduled_posts "
+              "SET scheduled_at = CAST(strftime('%s', scheduled_time) AS INTEGER)")
+    c.execute("DROP INDEX IF EXISTS idx_sched_status_time")
+    c.execute("DROP INDEX IF EXISTS idx_sched_user_status_time")
+    c.execute("CREATE INDEX idx_sched_status_at "
+              "ON scheduled_posts (status, scheduled_at)")
+    c.execute("CREATE INDEX idx_sched_user_status_at "
+              "ON scheduled_posts (user_id, status, scheduled_at)")
+
+
+def _add_event_rollups(c):
+    # Daily per-user/per-type counts of events pruned from event_log.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS event_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, event_type)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_created ON event_log (created_at)")
+
+
+def _add_callback_tokens(c):
+    # Payloads behind the short tokens in inline-button callback data.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS callback_tokens (
+            token TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_callback_tokens_created "
+              "ON callback_tokens (created_at)")
+
+
+def _add_user_state(c):
+    # JSON snapshot of each user's ctx.user_data, so half-finished flows
+    # survive restarts. Rows exist only for users with non-empty state.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+
+
+def _add_schedule_leases(c):
+    # A scheduler process claims due rows by leasing them until lease_until;
+    # rows whose lease ran out (the claimer died) can be claimed again.
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN leased_by TEXT")
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN lease_until INTEGER")
+
+
+def _add_post_media(c):
+    # The items of album posts (posts.media_type = 'album'), in send order.
+    # Single-media posts keep using posts.media_file_id.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_media (
+            post_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (post_id, position)
+        ) WITHOUT ROWID
+    """)
+
+
+def _add_delivery_attempts(c):
+    # Failed sends that will be retried: how many count towards
+    # SCHEDULER_MAX_ATTEMPTS (flood waits don't) and the last error.
+    # A retry moves scheduled_at to the next attempt; scheduled_time keeps the
+    # time the user asked for.
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN last_error TEXT")
+
+
+def _add_deliveries(c):
+    # The outbox: one job per post sent to a channel (publish, multipost or a
+    # scheduled post's single job across all its attempts), moving
+    # queued -> in_flight -> sent/failed, and back to queued for a retry.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            post_id INTEGER,
+            sched_id INTEGER UNIQUE,
+            channel_id TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            message_id INTEGER,
+            error TEXT,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_state_updated "
+              "ON deliveries (state, updated_at)")
+
+
+def _add_requested_at(c):
+    # The time the user asked for, in epoch seconds. Retries move
+    # scheduled_at, and scheduled_time is only a minute-precision label.
+    c.execute("ALTER TABLE scheduled_posts ADD COLUMN requested_at INTEGER")
+    c.execute("""UPDATE scheduled_posts SET requested_at = CASE
+                     WHEN attempts = 0 AND last_error IS NULL THEN scheduled_at
+                     ELSE CAST(strftime('%s', scheduled_time) AS INTEGER) END""")
+
+
+# Schema version N is reached by applying MIGRATIONS[N-1]; PRAGMA user_version
+# records the current version. Only ever append to this list.
+MIGRATIONS = [
+    _create_tables,
+    _add_hot_path_indexes,
+    _add_scheduled_at,
+    _add_event_rollups,
+    _add_callback_tokens,
+    _add_user_state,
+    _add_schedule_leases,
+    _add_post_media,
+    _add_delivery_attempts,
+    _add_deliveries,
+    _add_requested_at,
+]
 
 
 # ── Channels ────────────────────────────────────────────────────────────────
 
 def add_channel(user_id, channel_id, channel_name):
-    conn = get_conn()
     try:
-        conn.execute(
-            "INSERT OR IGNORE INTO channels (user_id, channel_id, channel_name) VALUES (?,?,?)",
-            (user_id, channel_id, channel_name)
-        )
-        conn.commit()
+        with _write_conn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO channels (user_id, channel_id, channel_name) VALUES (?,?,?)",
+                (user_id, channel_id, channel_name)
+            )
         return True
     except Exception:
         return False
-    finally:
-        conn.close()
 
 
 def get_channels(user_id):
-    conn = get_conn()
-    rows = conn.execute(
-        "SELECT * FROM channels WHERE user_id=? ORDER BY added_at DESC", (user_id,)
-    ).fetchall()
-    conn.close()
-    return rows
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM channels WHERE user_id=? ORDER BY added_at DESC", (user_id,)
+        ).fetchall()
 
 
 def delete_channel(user_id, channel_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM channels WHERE user_id=? AND channel_id=?", (user_id, channel_id))
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        conn.execute("DELETE FROM channels WHERE user_id=? AND channel_id=?", (user_id, channel_id))
 
 
 # ── Posts ────────────────────────────────────────────────────────────────────
 
-def save_post(user_id, title, content, media_file_id=None, media_type=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        """INSERT INTO posts (user_id, title, content, media_file_id, media_type)
-           VALUES (?,?,?,?,?)""",
-        (user_id, title, content, media_file_id, media_type)
-    )
-    post_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return post_id
+def save_post(user_id, title, content, media_file_id=None, media_type=None, media=None):
+    """Store a draft; `media` is the (media_type, file_id) items of an album post."""
+    with _write_conn() as conn:
+        c = conn.execute(
+            """INSERT INTO posts (user_id, title, content, media_file_id, media_type)
+               VALUES (?,?,?,?,?)""",
+            (user_id, title, content, media_file_id, media_type)
+        )
+        if media:
+            conn.executemany(
+                "INSERT INTO post_media (post_id, position, media_type, file_id) VALUES (?,?,?,?)",
+                [(c.lastrowid, position, kind, file_id)
+                 for position, (kind, file_id) in enumerate(media)]
+            )
+        return c.lastrowid
 
 
 def get_posts(user_id, status=None):
-    conn = get_conn()
-    if status:
-        rows = conn.execute(
-            "SELECT * FROM posts WHERE user_id=? AND status=? ORDER BY created_at DESC",
-            (user_id, status)
-        ).fetchall()
-    else:
-        rows = conn.execute(
+    with _read_conn() as conn:
+        if status:
+            return conn.execute(
+                "SELECT * FROM posts WHERE user_id=? AND status=? ORDER BY created_at DESC",
+                (user_id, status)
+            ).fetchall()
+        return conn.execute(
             "SELECT * FROM posts WHERE user_id=? ORDER BY created_at DESC", (user_id,)
         ).fetchall()
-    conn.close()
-    return rows
+
+
+def get_posts_page(user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+    """Newest-first page of a user's posts with just the columns a picker label needs."""
+    with _read_conn() as conn:
+        return _page(
+            conn,
+            """SELECT id, title, substr(content, 1, 40) AS content FROM posts
+               WHERE user_id=?{keyset} ORDER BY created_at {order}, id {order} LIMIT ?""",
+            "(created_at, id) {op} (SELECT created_at, id FROM posts WHERE id=?)",
+            (user_id,), cursor, direction, limit, descending=True
+        )
 
 
 def get_post(post_id):
-    conn = get_conn()
-    row = conn.execute("SELECT * FROM posts WHERE id=?", (post_id,)).fetchone()
-    conn.close()
-    return row
+    with _read_conn() as conn:
+        return conn.execute("SELECT * FROM posts WHERE id=?", (post_id,)).fetchone()
+
+
+def get_post_media(post_ids):
+    """Album items of the given posts as {post_id: [(media_type, file_id), ...]}."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return {}
+    with _read_conn() as conn:
+        rows = conn.execute(
+            f"""SELECT post_id, media_type, file_id FROM post_media
+                WHERE post_id IN ({",".join("?" * len(post_ids))}) ORDER BY post_id, position""",
+            post_ids
+        ).fetchall()
+    media = {}
+    for row in rows:
+        media.setdefault(row["post_id"], []).append((row["media_type"], row["file_id"]))
+    return media
 
 
 def delete_post(post_id, user_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM posts WHERE id=? AND user_id=?", (post_id, user_id))
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        c = conn.execute("DELETE FROM posts WHERE id=? AND user_id=?", (post_id, user_id))
+        if c.rowcount:
+            _delete_orphaned_media(conn, [post_id])
+
+
+def _delete_orphaned_media(conn, post_ids):
+    """Delete the album items of those of `post_ids` whose post is gone.
+
+    Pending scheduled copies of an album still send from its items, so
+    they are kept until the last one is sent, fails or is deleted.
+    """
+    post_ids = list({post_id for post_id in post_ids if post_id is not None})
+    if not post_ids:
+        return
+    conn.execute(
+        f"""DELETE FROM post_media WHERE post_id IN ({",".join("?" * len(post_ids))})
+            AND NOT EXISTS (SELECT 1 FROM posts WHERE id=post_media.post_id)
+            AND NOT EXISTS (SELECT 1 FROM scheduled_posts
+                            WHERE post_id=post_media.post_id AND status='pending')""",
+        post_ids
+    )
 
 
 # ── Scheduled Posts ──────────────────────────────────────────────────────────
 
-def schedule_post(user_id, channel_id, channel_name, scheduled_time, content,
+def schedule_post(user_id, channel_id, channel_name, scheduled_at, content,
                   media_file_id=None, media_type=None, post_id=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute(
-        """INSERT INTO scheduled_posts
-           (user_id, post_id, channel_id, channel_name, scheduled_time, content, media_file_id, media_type)
-           VALUES (?,?,?,?,?,?,?,?)""",
-        (user_id, post_id, channel_id, channel_name, scheduled_time, content, media_file_id, media_type)
-    )
-    sid = c.lastrowid
-    conn.commit()
-    conn.close()
-    return sid
+    with _write_conn() as conn:
+        c = conn.execute(
+            """INSERT INTO scheduled_posts
+               (user_id, post_id, channel_id, channel_name, scheduled_at, requested_at,
+                scheduled_time, content, media_file_id, media_type)
+               VALUES (?,?,?,?,?,?,strftime('%Y-%m-%d %H:%M', ?, 'unixepoch'),?,?,?)""",
+            (user_id, post_id, channel_id, channel_name, scheduled_at, scheduled_at, scheduled_at,
+             content, media_file_id, media_type)
+        )
+        return c.lastrowid
 
 
 def get_scheduled_posts(user_id):
-    conn = get_conn()
-    rows = conn.execute(
-        "SELECT * FROM scheduled_posts WHERE user_id=? AND status='pending' ORDER BY scheduled_time ASC",
-        (user_id,)
-    ).fetchall()
-    conn.close()
-    return rows
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM scheduled_posts WHERE user_id=? AND status='pending' ORDER BY scheduled_at ASC",
+            (user_id,)
+        ).fetchall()
+
+
+def get_scheduled_page(user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+    """Soonest-first page of a user's pending schedules with just the label columns."""
+    with _read_conn() as conn:
+        return _page(
+            conn,
+            """SELECT id, scheduled_time, channel_id, channel_name FROM scheduled_posts
+               WHERE user_id=? AND status='pending'{keyset}
+               ORDER BY scheduled_at {order}, id {order} LIMIT ?""",
+            "(scheduled_at, id) {op} (SELECT scheduled_at, id FROM scheduled_posts WHERE id=?)",
+            (user_id,), cursor, direction, limit, descending=False
+        )
+
+
+def get_scheduled(sched_id):
+    with _read_conn() as conn:
+        return conn.execute("SELECT * FROM scheduled_posts WHERE id=?", (sched_id,)).fetchone()
 
 
 def get_pending_scheduled():
-    conn = get_conn()
-    rows = conn.execute(
-        "SELECT * FROM scheduled_posts WHERE status='pending' ORDER BY scheduled_time ASC"
-    ).fetchall()
-    conn.close()
-    return rows
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM scheduled_posts WHERE status='pending' ORDER BY scheduled_at ASC"
+        ).fetchall()
+
+
+def get_due_scheduled(now, limit=100):
+    """Oldest pending rows with scheduled_at <= now (epoch seconds), at most `limit`."""
+    with _read_conn() as conn:
+        return conn.execute(
+            """SELECT * FROM scheduled_posts
+               WHERE status='pending' AND scheduled_at<=?
+               ORDER BY scheduled_at ASC LIMIT ?""",
+            (now, limit)
+        ).fetchall()
+
+
+def claim_due_scheduled(worker, now, lease_seconds, limit=100):
+    """Lease up to `limit` due pending rows to `worker` for `lease_seconds`; return them.
+
+    Rows leased to another worker are skipped until their lease expires. The
+    claim is a single UPDATE, so processes sharing the DB never get the same row.
+    """
+    with _write_conn() as conn:
+        rows = conn.execute(
+            """UPDATE scheduled_posts SET leased_by=?, lease_until=?
+               WHERE id IN (
+                   SELECT id FROM scheduled_posts
+                   WHERE status='pending' AND scheduled_at<=?
+                     AND (lease_until IS NULL OR lease_until<=?)
+                   ORDER BY scheduled_at ASC LIMIT ?)
+               RETURNING *""",
+            (worker, now + lease_seconds, now, now, limit)
+        ).fetchall()
+    return sorted(rows, key=lambda row: (row["scheduled_at"], row["id"]))
+
+
+def count_due_scheduled(now):
+    """How many pending rows have scheduled_at <= now (epoch s), leased or not."""
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT count(*) FROM scheduled_posts WHERE status='pending' AND scheduled_at<=?",
+            (now,)
+        ).fetchone()[0]
+
+
+def get_upcoming_scheduled(limit):
+    """(id, wake_at) of the next `limit` pending rows, for the scheduler's wake-up queue.
+
+    wake_at is when the row can next be claimed: its scheduled_at, or the end
+    of its lease if another worker (or an earlier, failed try) still holds it.
+    """
+    with _read_conn() as conn:
+        return conn.execute(
+            """SELECT id, max(scheduled_at, coalesce(lease_until, 0)) AS wake_at FROM scheduled_posts
+               WHERE status='pending' ORDER BY scheduled_at ASC LIMIT ?""",
+            (limit,)
+        ).fetchall()
+
+
+def retry_scheduled(sched_id, retry_at, error, counted=True):
+    """Release a claimed pending row to be claimed again at `retry_at` (epoch s).
+
+    `counted` adds one to the row's attempts, which SCHEDULER_MAX_ATTEMPTS
+    limits. Flood waits, and rows put off because their channel is
+    flood-limited, are not counted.
+    """
+    retry_scheduled_many([(sched_id, retry_at, error, counted)])
+
+
+def retry_scheduled_many(retries):
+    """retry_scheduled() for (sched_id, retry_at, error, counted) tuples, in one transaction."""
+    if not retries:
+        return
+    with _write_conn() as conn:
+        conn.executemany(
+            """UPDATE scheduled_posts
+               SET scheduled_at=?, attempts=attempts+?, last_error=?, leased_by=NULL, lease_until=NULL
+               WHERE id=? AND status='pending'""",
+            [(retry_at, int(counted), error, sched_id)
+             for sched_id, retry_at, error, counted in retries]
+        )
 
 
 def mark_scheduled_sent(sched_id):
-    conn = get_conn()
-    conn.execute(
-        "UPDATE scheduled_posts SET status='sent' WHERE id=?", (sched_id,)
-    )
-    conn.commit()
-    conn.close()
+    mark_scheduled_many([(sched_id, "sent")])
 
 
 def mark_scheduled_failed(sched_id):
-    conn = get_conn()
-    conn.execute(
-        "UPDATE scheduled_posts SET status='failed' WHERE id=?", (sched_id,)
-    )
-    conn.commit()
-    conn.close()
+    mark_scheduled_many([(sched_id, "failed")])
+
+
+def mark_scheduled_many(outcomes):
+    """Set the status of each (sched_id, "sent" | "failed") pair in one transaction."""
+    if not outcomes:
+        return
+    sched_ids = [sched_id for sched_id, _ in outcomes]
+    with _write_conn() as conn:
+        conn.executemany(
+            "UPDATE scheduled_posts SET status=? WHERE id=?",
+            [(status, sched_id) for sched_id, status in outcomes]
+        )
+        albums = conn.execute(
+            f"""SELECT post_id FROM scheduled_posts
+                WHERE id IN ({",".join("?" * len(sched_ids))}) AND media_type='album'""",
+            sched_ids
+        ).fetchall()
+        _delete_orphaned_media(conn, [row["post_id"] for row in albums])
 
 
 def delete_scheduled(sched_id, user_id):
-    conn = get_conn()
-    conn.execute(
-        "DELETE FROM scheduled_posts WHERE id=? AND user_id=? AND status='pending'",
-        (sched_id, user_id)
-    )
-    conn.commit()
-    conn.close()
+    with _write_conn() as conn:
+        deleted = conn.execute(
+            """DELETE FROM scheduled_posts WHERE id=? AND user_id=? AND status='pending'
+               RETURNING post_id, media_type""",
+            (sched_id, user_id)
+        ).fetchone()
+        if deleted and deleted["media_type"] == "album":
+            _delete_orphaned_media(conn, [deleted["post_id"]])
+        return deleted is not None
+
+
+# ── Delivery Outbox ──────────────────────────────────────────────────────────
+
+def queue_deliveries(jobs):
+    """Add queued outbox jobs; `jobs` is (kind, user_id, post_id, sched_id, channel_id) tuples.
+
+    Returns the job ids in order. Queuing a scheduled post that already has
+    a job returns that job unchanged.
+    """
+    now = int(datetime.now(timezone.utc).timestamp())
+    with _write_conn() as conn:
+        return [
+            conn.execute(
+                """INSERT INTO deliveries (kind, user_id, post_id, sched_id, channel_id, updated_at)
+                   VALUES (?,?,?,?,?,?)
+                   ON CONFLICT (sched_id) DO UPDATE SET sched_id=excluded.sched_id
+                   RETURNING id""",
+                (*job, now)
+            ).fetchone()[0]
+            for job in jobs
+        ]
+
+
+def start_deliveries(job_ids):
+    """Move the queued ones of `job_ids` to in_flight in one transaction.
+
+    Returns {job_id: state before}. Only jobs that were queued have been
+    started; the caller sends those and leaves the rest alone. The state
+    check is part of the UPDATE, so when processes race for a job only one
+    of them sees it as queued.
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+    now = int(datetime.now(timezone.utc).timestamp())
+    marks = ",".join("?" * len(job_ids))
+    with _write_conn() as conn:
+        before = {
+            row["id"]: "queued"
+            for row in conn.execute(
+                f"""UPDATE deliveries SET state='in_flight', updated_at=?
+                    WHERE id IN ({marks}) AND state='queued' RETURNING id""",
+                (now, *job_ids)
+            )
+        }
+        # Read inside the same transaction, under the write lock the UPDATE took
+        for row in conn.execute(f"SELECT id, state FROM deliveries WHERE id IN ({marks})", job_ids):
+            before.setdefault(row["id"], row["state"])
+    return before
+
+
+def finish_deliveries(outcomes):
+    """Record (job_id, state, message_id, error) outcomes in one transaction."""
+    now = int(datetime.now(timezone.utc).timestamp())
+    with _write_conn() as conn:
+        conn.executemany(
+            "UPDATE deliveries SET state=?, message_id=?, error=?, updated_at=? WHERE id=?",
+            [(state, message_id, error, now, job_id)
+             for job_id, state, message_id, error in outcomes]
+        )
+
+
+def recover_deliveries(stale_before):
+    """Take over publish/multipost jobs untouched since `stale_before` (epoch s).
+
+    Such jobs were left by a process that died. Jobs left in_flight may or
+    may not have been sent, so they are failed and never sent again. Returns
+    (those interrupted jobs, the stale queued jobs, which are still safe to
+    send). Scheduled posts' jobs are settled when the scheduler claims the
+    post again.
+    """
+    now = int(datetime.now(timezone.utc).timestamp())
+    with _write_conn() as conn:
+        interrupted = conn.execute(
+            """UPDATE deliveries SET state='failed', error='interrupted', updated_at=?
+               WHERE state='in_flight' AND updated_at<? AND kind!='scheduled'
+               RETURNING *""",
+            (now, stale_before)
+        ).fetchall()
+        queued = conn.execute(
+            """SELECT * FROM deliveries
+               WHERE state='queued' AND updated_at<? AND kind!='scheduled'
+               ORDER BY updated_at, id""",
+            (stale_before,)
+        ).fetchall()
+    return interrupted, queued
+
+
+def prune_deliveries(cutoff, limit):
+    """Delete at most `limit` sent/failed jobs last updated before `cutoff` (epoch s); return how many.
+
+    Failed jobs go first, then sent ones, each oldest first: the order of
+    idx_deliveries_state_updated, so the pick needs no sort.
+    """
+    with _write_conn() as conn:
+        c = conn.execute(
+            """DELETE FROM deliveries WHERE id IN (
+                   SELECT id FROM deliveries
+                   WHERE state IN ('sent', 'failed') AND updated_at<?
+                   ORDER BY state, updated_at, id LIMIT ?)""",
+            (cutoff, limit)
+        )
+        return c.rowcount
 
 
 # ── Event Log ────────────────────────────────────────────────────────────────
 
 def log_event(user_id, event_type, description, channel_id=None, post_id=None):
-    conn = get_conn()
-    conn.execute(
-        """INSERT INTO event_log (user_id, event_type, description, channel_id, post_id)
-           VALUES (?,?,?,?,?)""",
-        (user_id, event_type, description, channel_id, post_id)
+    created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    _enqueue(
+        """INSERT INTO event_log (user_id, event_type, description, channel_id, post_id, created_at)
+           VALUES (?,?,?,?,?,?)""",
+        (user_id, event_type, description, channel_id, post_id, created_at)
     )
-    conn.commit()
-    conn.close()
 
 
 def get_events(user_id, limit=30):
-    conn = get_conn()
-    rows = conn.execute(
-        "SELECT * FROM event_log WHERE user_id=? ORDER BY created_at DESC LIMIT ?",
-        (user_id, limit)
-    ).fetchall()
-    conn.close()
-    return rows
+    flush_writes()
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM event_log WHERE user_id=? ORDER BY created_at DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
 
 
 def clear_events(user_id):
-    conn = get_conn()
-    conn.execute("DELETE FROM event_log WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    flush_writes()
+    with _write_conn() as conn:
+        conn.execute("DELETE FROM event_log WHERE user_id=?", (user_id,))
+
+
+def prune_events(cutoff, limit):
+    """Roll up and delete at most `limit` events created before `cutoff`; return how many.
+
+    Each call is one short transaction, so callers loop to prune more
+    without holding the write lock for long.
+    """
+    with _write_conn() as conn:
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM event_log WHERE created_at < ? ORDER BY created_at LIMIT ?",
+            (cutoff, limit)
+        )]
+        if not ids:
+            return 0
+        ids_json = json.dumps(ids)
+        conn.execute(
+            """INSERT INTO event_daily (user_id, day, event_type, count)
+               SELECT user_id, date(created_at), event_type, count(*) FROM event_log
+               WHERE id IN (SELECT value FROM json_each(?))
+               GROUP BY user_id, date(created_at), event_type
+               ON CONFLICT (user_id, day, event_type) DO UPDATE SET count = count + excluded.count""",
+            (ids_json,)
+        )
+        conn.execute("DELETE FROM event_log WHERE id IN (SELECT value FROM json_each(?))", (ids_json,))
+        return len(ids)
+
+
+# ── Callback Tokens ──────────────────────────────────────────────────────────
+
+def save_callback_token(token, payload, created_at):
+    _enqueue(
+        "INSERT OR REPLACE INTO callback_tokens (token, payload, created_at) VALUES (?,?,?)",
+        (token, payload, created_at)
+    )
+
+
+def get_callback_token(token):
+    flush_writes()
+    with _read_conn() as conn:
+        return conn.execute(
+            "SELECT payload, created_at FROM callback_tokens WHERE token=?", (token,)
+        ).fetchone()
+
+
+def prune_callback_tokens(cutoff, limit):
+    """Delete at most `limit` tokens created before `cutoff` (epoch seconds); return how many."""
+    with _write_conn() as conn:
+        c = conn.execute(
+            """DELETE FROM callback_tokens WHERE token IN (
+                   SELECT token FROM callback_tokens WHERE created_at < ? LIMIT ?)""",
+            (cutoff, limit)
+        )
+        return c.rowcount
+
+
+# ── User State ───────────────────────────────────────────────────────────────
+
+def get_user_state(user_id):
+    """The user's saved ctx.user_data as a JSON string, or None."""
+    with _read_conn() as conn:
+        row = conn.execute("SELECT data FROM user_state WHERE user_id=?", (user_id,)).fetchone()
+        return row["data"] if row else None
+
+
+def save_user_states(states):
+    """Write many users' state in one transaction; `states` is (user_id, json or None) pairs.
+
+    None deletes the user's row.
+    """
+    now = int(datetime.now(timezone.utc).timestamp())
+    with _write_conn() as conn:
+        conn.executemany(
+            """INSERT INTO user_state (user_id, data, updated_at) VALUES (?,?,?)
+               ON CONFLICT (user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at""",
+            [(user_id, data, now) for user_id, data in states if data is not None]
+        )
+        conn.executemany(
+            "DELETE FROM user_state WHERE user_id=?",
+            [(user_id,) for user_id, data in states if data is None]
+        )
+
+
+# ── Maintenance ──────────────────────────────────────────────────────────────
+
+def compact_db(pages):
+    """Release up to `pages` free pages back to the OS; return how many remain free."""
+    with _write_conn() as conn:
+        # execute() steps the pragma once, which frees a single page;
+        # executescript() runs it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
 
 
 # ── Settings ─────────────────────────────────────────────────────────────────
 
 def get_settings(user_id):
-    conn = get_conn()
-    row = conn.execute("SELECT * FROM settings WHERE user_id=?", (user_id,)).fetchone()
-    if not row:
-        conn.execute("INSERT OR IGNORE INTO settings (user_id) VALUES (?)", (user_id,))
-        conn.commit()
+    with _write_conn() as conn:
         row = conn.execute("SELECT * FROM settings WHERE user_id=?", (user_id,)).fetchone()
-    conn.close()
-    return row
+        if not row:
+            conn.execute("INSERT OR IGNORE INTO settings (user_id) VALUES (?)", (user_id,))
+            row = conn.execute("SELECT * FROM settings WHERE user_id=?", (user_id,)).fetchone()
+        return row
 
 
 def update_setting(user_id, key, value):
-    conn = get_conn()
-    conn.execute(f"UPDATE settings SET {key}=? WHERE user_id=?", (value, user_id))
-    if conn.execute("SELECT changes()").fetchone()[0] == 0:
-        conn.execute("INSERT INTO settings (user_id) VALUES (?)", (user_id,))
+    with _write_conn() as conn:
         conn.execute(f"UPDATE settings SET {key}=? WHERE user_id=?", (value, user_id))
-    conn.commit()
-    conn.close()
+        if conn.execute("SELECT changes()").fetchone()[0] == 0:
+            conn.execute("INSERT INTO settings (user_id) VALUES (?)", (user_id,))
+            conn.execute(f"UPDATE settings SET {key}=? WHERE user_id=?", (value, user_id))
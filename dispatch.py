@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from telegram import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+logger = logging.getLogger(__name__)
+
+
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+
+async def send_post(transport, chat_id, content, media_file_id=None, media_type=None, media=None):
+    """Send a post's text, single media item or album to chat_id and return the sent message(s).
+
+    Publish, multipost and the scheduler all send through here. `transport`
+    is anything with the Bot send_* coroutines: the real telegram.Bot, or a
+    MemoryTransport in tests and benchmarks. An album (media_type "album",
+    its (media_type, file_id) items in `media`) goes out in one
+    send_media_group call, captioned on its first item.
+    """
+    try:
+        if media_type == "album" and media:
+            items = [
+                INPUT_MEDIA[kind](file_id, caption=content if position == 0 else None)
+                for position, (kind, file_id) in enumerate(media)
+            ]
+            return await transport.send_media_group(chat_id=chat_id, media=items)
+        if media_file_id and media_type == "photo":
+            return await transport.send_photo(chat_id=chat_id, photo=media_file_id, caption=content)
+        if media_file_id and media_type == "video":
+            return await transport.send_video(chat_id=chat_id, video=media_file_id, caption=content)
+        if media_file_id and media_type == "document":
+            return await transport.send_document(chat_id=chat_id, document=media_file_id, caption=content)
+        return await transport.send_message(chat_id=chat_id, text=content)
+    except Exception as e:
+        logger.warning(f"Send to {chat_id} failed: {e}")
+        raise
+
+
+class MemoryTransport:
+    """Stand-in for telegram.Bot that records sends instead of calling the API."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def _record(self, method, chat_id, **payload):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((method, chat_id, payload))
+        return SimpleNamespace(message_id=len(self.sent), chat_id=chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._record("sendMessage", chat_id, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._record("sendPhoto", chat_id, photo=photo, **kwargs)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._record("sendVideo", chat_id, video=video, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self._record("sendDocument", chat_id, document=document, **kwargs)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return (await self._record("sendMediaGroup", chat_id, media=media, **kwargs),)
@@ -0,0 +1,344 @@
+"""A local stand-in for the Telegram Bot API, for load tests.
+
+FakeBotAPI serves the calls Telebot makes over HTTP on localhost, so the
+real bot (httpx, PTB, handlers, SQLite) can run against it by setting
+BOT_API_BASE_URL. Sends and edits can be slowed down or made to fail with
+errors or 429 flood waits. Simulated users push updates with send_text /
+click and await the bot's answer with wait_for. See loadtest.py.
+"""
+import asyncio
+import html
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Telebot", "username": "telebot_fake_bot"}
+
+# Calls that latency, error_rate and flood_rate apply to
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendMediaGroup",
+                "editMessageText", "answerCallbackQuery", "getChat"}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class FakeBotAPI:
+
+    def __init__(self, latency=0.0, error_rate=0.0, flood_rate=0.0, retry_after=1):
+        self.latency     = latency
+        self.error_rate  = error_rate
+        self.flood_rate  = flood_rate
+        self.retry_after = retry_after
+
+        self.calls  = Counter()               # Bot API method -> requests served
+        self.chat_calls = Counter()           # (method, chat_id) -> requests served
+        self.outbox = defaultdict(list)       # chat_id -> messages the bot sent or edited
+        self.webhook = None                   # setWebhook parameters, until deleteWebhook
+
+        self._server      = None
+        self._updates     = deque()
+        self._update_ids  = itertools.count(1)
+        self._new_update  = asyncio.Event()
+        self._changed     = {}                # chat_id -> Event set on its next outbox entry
+        self._messages    = {}                # (chat_id, message_id) -> message
+        self._message_ids = defaultdict(lambda: itertools.count(1))
+        self._channels    = {}                # "@username" -> chat id
+        self._query_ids   = itertools.count(1)
+        self._group_ids   = itertools.count(1)
+
+        self._methods = {
+            "getMe":               self._get_me,
+            "setWebhook":          self._set_webhook,
+            "deleteWebhook":       self._delete_webhook,
+            "getUpdates":          self._get_updates,
+            "sendMessage":         self._send_message,
+            "sendPhoto":           self._send_photo,
+            "sendVideo":           self._send_video,
+            "sendDocument":        self._send_document,
+            "sendMediaGroup":      self._send_media_group,
+            "editMessageText":     self._edit_message_text,
+            "answerCallbackQuery": self._answer_callback_query,
+            "getChat":             self._get_chat,
+        }
+
+    # ── Server ───────────────────────────────────────────────────────────────
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving and return the base URL to use as BOT_API_BASE_URL."""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        # HTTP/1.1 with keep-alive, which is all httpx needs from us
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = request_line.split(" ")[1]
+                status, payload = await self._call(path, headers.get("content-type", ""), body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # A long-poll cut short by shutdown; re-raising would only make
+            # asyncio log the cancelled connection task as an error.
+            pass
+        finally:
+            writer.close()
+
+    async def _call(self, path, content_type, body):
+        path, _, query = path.partition("?")
+        method = path.rsplit("/", 1)[-1]
+        params = _parse_params(query, content_type, body)
+        self.calls[method] += 1
+        if "chat_id" in params:
+            self.chat_calls[method, params["chat_id"]] += 1
+
+        handler = self._methods.get(method)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+        if method in SEND_METHODS:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            roll = random.random()
+            if roll < self.flood_rate:
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            if roll < self.flood_rate + self.error_rate:
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+
+        try:
+            return 200, {"ok": True, "result": await handler(params)}
+        except ApiError as e:
+            return 400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"}
+
+    # ── Bot API methods ──────────────────────────────────────────────────────
+
+    async def _get_me(self, params):
+        return BOT_USER
+
+    async def _set_webhook(self, params):
+        self.webhook = params
+        return True
+
+    async def _delete_webhook(self, params):
+        self.webhook = None
+        return True
+
+    async def _get_updates(self, params):
+        offset = params.get("offset", 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+
+        if not self._updates and params.get("timeout"):
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), params["timeout"])
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, params.get("limit", 100)))
+
+    async def _send_message(self, params):
+        return self._new_message(params["chat_id"], params, text=_text(params, "text"))
+
+    async def _send_photo(self, params):
+        photo = [{"file_id": params["photo"], "file_unique_id": params["photo"],
+                  "width": 1280, "height": 720}]
+        return self._new_message(params["chat_id"], params, photo=photo,
+                                 caption=_text(params, "caption"))
+
+    async def _send_video(self, params):
+        video = {"file_id": params["video"], "file_unique_id": params["video"],
+                 "width": 1280, "height": 720, "duration": 10}
+        return self._new_message(params["chat_id"], params, video=video,
+                                 caption=_text(params, "caption"))
+
+    async def _send_document(self, params):
+        document = {"file_id": params["document"], "file_unique_id": params["document"]}
+        return self._new_message(params["chat_id"], params, document=document,
+                                 caption=_text(params, "caption"))
+
+    async def _send_media_group(self, params):
+        items = params["media"]
+        if not 2 <= len(items) <= 10:
+            raise ApiError("wrong number of media items in the group")
+        group_id = str(next(self._group_ids))
+        messages = []
+        for item in items:
+            content = await self._methods[f"send{item['type'].title()}"](
+                {**item, "chat_id": params["chat_id"], item["type"]: item["media"]})
+            content["media_group_id"] = group_id
+            messages.append(content)
+        return messages
+
+    async def _edit_message_text(self, params):
+        chat_id = params["chat_id"]
+        message = self._messages.get((chat_id, params["message_id"]))
+        if message is None:
+            raise ApiError("message to edit not found")
+        text   = _text(params, "text")
+        markup = params.get("reply_markup")
+        if message.get("text") == text and message.get("reply_markup") == markup:
+            raise ApiError("message is not modified")
+
+        message = {**message, "text": text, "edit_date": int(time.time())}
+        message.pop("reply_markup", None)
+        if markup:
+            message["reply_markup"] = markup
+        self._store(chat_id, message)
+        return message
+
+    async def _answer_callback_query(self, params):
+        return True
+
+    async def _get_chat(self, params):
+        chat_id = params["chat_id"]
+        username = None
+        if isinstance(chat_id, str):
+            username = chat_id.lstrip("@")
+            chat_id = self._channels.setdefault(username, -1001000000000 - len(self._channels))
+        return {"id": chat_id, "type": "channel", "title": username or f"Channel {chat_id}",
+                "username": username, "accent_color_id": 0, "max_reaction_count": 11}
+
+    def _new_message(self, chat_id, params, **content):
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"
+        message = {
+            "message_id": next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": chat_type},
+            "from": BOT_USER,
+            **{k: v for k, v in content.items() if v is not None},
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        self._store(chat_id, message)
+        return message
+
+    def _store(self, chat_id, message):
+        self._messages[(chat_id, message["message_id"])] = message
+        self.outbox[chat_id].append(message)
+        changed = self._changed.pop(chat_id, None)
+        if changed is not None:
+            changed.set()
+
+    # ── Simulated users ──────────────────────────────────────────────────────
+
+    def send_text(self, user_id, text):
+        """Queue a private-chat message from user_id."""
+        message = self._user_message(user_id, text=text)
+        if text.startswith("/"):
+            command = text.split(maxsplit=1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._push({"message": message})
+
+    def send_photo(self, user_id, file_id, media_group_id=None):
+        """Queue a photo from user_id; photos sharing a media_group_id form an album."""
+        photo = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+        message = self._user_message(user_id, photo=photo)
+        if media_group_id is not None:
+            message["media_group_id"] = str(media_group_id)
+        self._push({"message": message})
+
+    def click(self, user_id, message, callback_data):
+        """Queue a tap on the inline button carrying callback_data under message."""
+        self._push({"callback_query": {
+            "id": str(next(self._query_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": callback_data,
+        }})
+
+    async def wait_for(self, chat_id, start=0, match=None, timeout=10.0):
+        """Return the first message the bot sent or edited in chat_id from
+        outbox index `start` on that satisfies `match`."""
+        async def scan():
+            index = start
+            while True:
+                box = self.outbox[chat_id]
+                for message in box[index:]:
+                    if match is None or match(message):
+                        return message
+                index = len(box)
+                await self._changed.setdefault(chat_id, asyncio.Event()).wait()
+        return await asyncio.wait_for(scan(), timeout)
+
+    def take_updates(self):
+        """Remove and return the queued updates, e.g. to post them to a webhook."""
+        updates = list(self._updates)
+        self._updates.clear()
+        return updates
+
+    def _user_message(self, user_id, **content):
+        return {
+            "message_id": next(self._message_ids[user_id]),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            **content,
+        }
+
+    def _push(self, update):
+        update["update_id"] = next(self._update_ids)
+        self._updates.append(update)
+        self._new_update.set()
+
+
+class ApiError(Exception):
+    """A request the real API would reject with 400 Bad Request."""
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def _text(params, field):
+    """The text or caption as a client sees it, with HTML markup applied."""
+    text = params.get(field)
+    if text is not None and params.get("parse_mode") == "HTML":
+        text = html.unescape(re.sub(r"<[^>]+>", "", text))
+    return text
+
+
+def _parse_params(query, content_type, body):
+    """Bot API parameters from the query string and a form or JSON body.
+
+    PTB posts form fields with nested objects (reply_markup) JSON-encoded
+    and numbers as plain digits.
+    """
+    if content_type.startswith("application/json"):
+        return {**dict(parse_qsl(query)), **json.loads(body or b"{}")}
+
+    params = {}
+    for name, value in parse_qsl(query) + parse_qsl(body.decode()):
+        if value[:1] in ("{", "["):
+            value = json.loads(value)
+        elif value.lstrip("-").isdigit():
+            value = int(value)
+        elif value in ("true", "false"):
+            value = value == "true"
+        params[name] = value
+    return params
@@ -0,0 +1,41 @@
+import html
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import profiler
+from config import ADMIN_IDS, PROFILE_SECONDS, PROFILE_SLOW_MS
+
+
+async def cmd_profile(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """/profile [seconds] captures a profile; /profile trace on|off toggles slow-op logging."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    args = update.message.text.split()[1:]
+
+    if args[:1] == ["trace"]:
+        profiler.tracing = args[1:2] != ["off"]
+        await update.message.reply_text(
+            f"🐢 Slow-operation tracing is {'on' if profiler.tracing else 'off'} "
+            f"(threshold {PROFILE_SLOW_MS} ms)."
+        )
+        return
+
+    if profiler.capturing:
+        await update.message.reply_text("⚠️ A profile capture is already running.")
+        return
+
+    seconds = int(args[0]) if args and args[0].isdigit() else PROFILE_SECONDS
+    await update.message.reply_text(f"⏱ Profiling for {seconds} s…")
+    # Capture in the background: this handler returning lets the updates
+    # being profiled keep flowing.
+    ctx.application.create_task(_capture(update.message, seconds))
+
+
+async def _capture(message, seconds):
+    path, top = await profiler.capture(seconds)
+    await message.reply_text(
+        f"⏱ Profile saved to <code>{html.escape(path)}</code>\n\n"
+        f"<pre>{html.escape(chr(10).join(top))}</pre>",
+        parse_mode="HTML"
+    )
@@ -1,8 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
+import async_db as db
 from keyboards import main_menu, channel_list_keyboard
+from router import Flow, TEXT
 
 # Conversation states
 WAIT_CHANNEL_ID = 1
@@ -44,9 +45,9 @@ async def recv_channel_id(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     channel_id   = str(chat.id)
     channel_name = chat.title or chat.username or channel_id
 
-    ok = db.add_channel(user_id, channel_id, channel_name)
+    ok = await db.add_channel(user_id, channel_id, channel_name)
     if ok:
-        db.log_event(user_id, "channel_added", f"Added channel {channel_name}", channel_id=channel_id)
+        await db.log_event(user_id, "channel_added", f"Added channel {channel_name}", channel_id=channel_id)
         await update.message.reply_text(
             f"✅ Channel <b>{channel_name}</b> added!",
             parse_mode="HTML", reply_markup=main_menu()
@@ -65,12 +66,12 @@ async def cmd_cancel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
-def add_channel_conv():
-    return ConversationHandler(
-        entry_points=[CallbackQueryHandler(cb_add_channel, pattern="^add_channel$")],
+def add_channel_flow():
+    return Flow(
+        "add_channel",
+        entry_points={"add_channel": cb_add_channel},
         states={
-            WAIT_CHANNEL_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, recv_channel_id)],
+            WAIT_CHANNEL_ID: {TEXT: recv_channel_id},
         },
-        fallbacks=[CommandHandler("cancel", cmd_cancel)],
-        per_message=False
+        fallbacks={"/cancel": cmd_cancel},
     )
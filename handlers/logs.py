@@ -1,7 +1,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-import database as db
+import async_db as db
 from keyboards import back_button, main_menu
 
 EVENT_ICONS = {
@@ -23,7 +23,7 @@ async def cb_event_log(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id = q.from_user.id
-    events  = db.get_events(user_id, limit=30)
+    events  = await db.get_events(user_id, limit=30)
 
     if not events:
         await q.edit_message_text(
@@ -58,5 +58,5 @@ async def cb_event_log(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_clear_log(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    db.clear_events(q.from_user.id)
+    await db.clear_events(q.from_user.id)
     await q.edit_message_text("🗑 Event log cleared.", reply_markup=main_menu())
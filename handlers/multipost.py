@@ -1,8 +1,12 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
-from keyboards import main_menu, post_list_keyboard, back_button
+import async_db as db
+import outbox
+from callback_tokens import encode, decode
+from config import MULTIPOST_CONCURRENCY
+from keyboards import main_menu, post_list_keyboard, back_button, page_cursor
+from router import Flow
 
 # States
 SELECT_POST, SELECT_CHANNELS, CONFIRM = range(3)
@@ -12,7 +16,8 @@ async def cb_multipost(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id = q.from_user.id
-    posts   = db.get_posts(user_id)
+    cursor, direction = await page_cursor(q.data)
+    posts, has_prev, has_next = await db.get_posts_page(user_id, cursor, direction)
 
     if not posts:
         await q.edit_message_text(
@@ -24,7 +29,7 @@ async def cb_multipost(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(
         "📤 <b>Multipost</b>\n\nStep 1: Select the post you want to send:",
         parse_mode="HTML",
-        reply_markup=post_list_keyboard(posts, "mp_post")
+        reply_markup=post_list_keyboard(posts, "mp_post", has_prev, has_next)
     )
     return SELECT_POST
 
@@ -32,12 +37,12 @@ async def cb_multipost(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_mp_select_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    post_id = int(q.data.split(":")[1])
+    [post_id] = await decode(q.data)
     ctx.user_data["mp_post_id"]     = post_id
     ctx.user_data["mp_selected_ch"] = []
 
     user_id  = q.from_user.id
-    channels = db.get_channels(user_id)
+    channels = await db.get_channels(user_id)
 
     if not channels:
         await q.edit_message_text(
@@ -53,7 +58,7 @@ async def cb_mp_select_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_mp_toggle_channel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    channel_id = q.data.split(":")[1]
+    [channel_id] = await decode(q.data)
     selected   = ctx.user_data.get("mp_selected_ch", [])
 
     if channel_id in selected:
@@ -63,7 +68,7 @@ async def cb_mp_toggle_channel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ctx.user_data["mp_selected_ch"] = selected
 
     user_id  = q.from_user.id
-    channels = db.get_channels(user_id)
+    channels = await db.get_channels(user_id)
     await _show_channel_picker(q, ctx, channels)
     return SELECT_CHANNELS
 
@@ -75,7 +80,7 @@ async def _show_channel_picker(q, ctx, channels):
         chk = "✅" if ch["channel_id"] in selected else "⬜"
         rows.append([InlineKeyboardButton(
             f"{chk} {ch['channel_name'] or ch['channel_id']}",
-            callback_data=f"mp_toggle:{ch['channel_id']}"
+            callback_data=encode("mp_toggle", ch["channel_id"])
         )])
     rows.append([InlineKeyboardButton(
         f"📤 Send to {len(selected)} channel(s)",
@@ -96,7 +101,7 @@ async def cb_mp_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
     post_id    = ctx.user_data.get("mp_post_id")
     selected   = ctx.user_data.get("mp_selected_ch", [])
-    post       = db.get_post(post_id)
+    post       = await db.get_post(post_id)
 
     if not selected:
         await q.answer("⚠️ Select at least one channel!", show_alert=True)
@@ -106,48 +111,65 @@ async def cb_mp_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("❌ Post not found.", reply_markup=main_menu())
         return ConversationHandler.END
 
+    await q.edit_message_text(
+        f"📤 <b>Multipost</b>\n\nSending to {len(selected)} channel(s)…",
+        parse_mode="HTML"
+    )
+    media = None
+    if post["media_type"] == "album":
+        media = (await db.get_post_media([post_id])).get(post_id)
+    jobs = list(zip(await outbox.queue("multipost", user_id, post_id, selected), selected))
+    # Fan out in the background so this handler (and the user's other taps)
+    # are not held up while every channel is sent to.
+    ctx.application.create_task(_fan_out(ctx.bot, q.message, user_id, post, media, jobs))
+    return ConversationHandler.END
+
+
+async def _fan_out(bot, message, user_id, post, media, jobs):
+    """Send to the (job_id, channel_id) jobs, MULTIPOST_CONCURRENCY at a time."""
     results = []
-    for channel_id in selected:
-        try:
-            if post["media_file_id"] and post["media_type"] == "photo":
-                await ctx.bot.send_photo(channel_id, photo=post["media_file_id"],
-                                         caption=post["content"])
-            elif post["media_file_id"] and post["media_type"] == "video":
-                await ctx.bot.send_video(channel_id, video=post["media_file_id"],
-                                         caption=post["content"])
-            elif post["media_file_id"] and post["media_type"] == "document":
-                await ctx.bot.send_document(channel_id, document=post["media_file_id"],
-                                            caption=post["content"])
+    for start in range(0, len(jobs), MULTIPOST_CONCURRENCY):
+        batch  = jobs[start:start + MULTIPOST_CONCURRENCY]
+        errors = await outbox.send(bot, post, media, batch)
+        for job_id, channel_id in batch:
+            if job_id not in errors:
+                # Outbox recovery took the job over and sends it itself
+                results.append(f"⏳ {channel_id}: sent separately")
+            elif errors[job_id] is None:
+                await db.log_event(user_id, "multipost_sent",
+                                   f"Post #{post['id']} sent to {channel_id}",
+                                   channel_id=channel_id, post_id=post["id"])
+                results.append(f"✅ {channel_id}")
             else:
-                await ctx.bot.send_message(channel_id, text=post["content"])
-
-            db.log_event(user_id, "multipost_sent",
-                         f"Post #{post_id} sent to {channel_id}",
-                         channel_id=channel_id, post_id=post_id)
-            results.append(f"✅ {channel_id}")
-        except Exception as e:
-            results.append(f"❌ {channel_id}: {e}")
+                results.append(f"❌ {channel_id}: {errors[job_id]}")
+        if len(results) < len(jobs):
+            try:
+                await message.edit_text(
+                    f"📤 <b>Multipost</b>\n\nSent {len(results)}/{len(jobs)} channel(s)…",
+                    parse_mode="HTML"
+                )
+            except Exception:
+                pass
 
     summary = "\n".join(results)
-    await q.edit_message_text(
+    await message.edit_text(
         f"📤 <b>Multipost Results</b>\n\n{summary}",
         parse_mode="HTML", reply_markup=main_menu()
     )
-    return ConversationHandler.END
 
 
-def multipost_conv():
-    return ConversationHandler(
-        entry_points=[CallbackQueryHandler(cb_multipost, pattern="^multipost$")],
+def multipost_flow():
+    return Flow(
+        "multipost",
+        entry_points={"multipost": cb_multipost},
         states={
-            SELECT_POST: [
-                CallbackQueryHandler(cb_mp_select_post, pattern="^mp_post:"),
-            ],
-            SELECT_CHANNELS: [
-                CallbackQueryHandler(cb_mp_toggle_channel, pattern="^mp_toggle:"),
-                CallbackQueryHandler(cb_mp_confirm, pattern="^mp_confirm$"),
-            ],
+            SELECT_POST: {
+                "mp_post":    cb_mp_select_post,
+                "mp_post_pg": cb_multipost,
+            },
+            SELECT_CHANNELS: {
+                "mp_toggle":  cb_mp_toggle_channel,
+                "mp_confirm": cb_mp_confirm,
+            },
         },
-        fallbacks=[CallbackQueryHandler(lambda u, c: ConversationHandler.END, pattern="^main_menu$")],
-        per_message=False
     )
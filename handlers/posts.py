@@ -1,13 +1,18 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (ContextTypes, ConversationHandler, CommandHandler,
-                           MessageHandler, filters, CallbackQueryHandler)
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
-from keyboards import main_menu, post_list_keyboard, back_button
+import async_db as db
+import outbox
+from callback_tokens import encode, decode
+from keyboards import main_menu, post_list_keyboard, back_button, page_cursor
+from router import Flow, TEXT, MEDIA, end_flow
 
 # States
 WAIT_POST_TITLE, WAIT_POST_CONTENT, WAIT_POST_MEDIA, WAIT_PUBLISH_CHANNEL = range(4)
 
+# Telegram's limit on items in one media group
+ALBUM_MAX_ITEMS = 10
+
 
 # ── Create Post ──────────────────────────────────────────────────────────────
 
@@ -41,7 +46,8 @@ async def skip_post_title(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def recv_post_content(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     ctx.user_data["new_post"]["content"] = update.message.text.strip()
     await update.message.reply_text(
-        "🖼 Optionally attach a <b>photo, video, or document</b>, or /skip to save as text only.",
+        "🖼 Optionally attach a <b>photo, video, or document</b> (or an album of them), "
+        "or /skip to save as text only.",
         parse_mode="HTML"
     )
     return WAIT_POST_MEDIA
@@ -52,16 +58,39 @@ async def recv_post_media(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     post = ctx.user_data["new_post"]
 
     if msg.photo:
-        post["media_file_id"] = msg.photo[-1].file_id
-        post["media_type"]    = "photo"
+        item = ["photo", msg.photo[-1].file_id]
     elif msg.video:
-        post["media_file_id"] = msg.video.file_id
-        post["media_type"]    = "video"
-    elif msg.document:
-        post["media_file_id"] = msg.document.file_id
-        post["media_type"]    = "document"
-
-    return await _save_post_and_offer(update, ctx)
+        item = ["video", msg.video.file_id]
+    else:
+        item = ["document", msg.document.file_id]
+
+    if msg.media_group_id is None and not post.get("media"):
+        post["media_type"], post["media_file_id"] = item
+        return await _save_post_and_offer(update, ctx)
+
+    # An album arrives as one message per item; collect them until /done
+    media = post.setdefault("media", [])
+    if len(media) >= ALBUM_MAX_ITEMS:
+        if not post.get("album_full"):
+            post["album_full"] = True
+            await msg.reply_text(
+                f"⚠️ An album holds at most {ALBUM_MAX_ITEMS} items; the ones after the "
+                f"{ALBUM_MAX_ITEMS}th were not added. Send /done to save it."
+            )
+        return WAIT_POST_MEDIA
+    # sendMediaGroup takes documents only with other documents
+    if media and (item[0] == "document") != (media[0][0] == "document"):
+        await msg.reply_text(
+            "⚠️ An album is either all documents or all photos and videos; "
+            "that item was not added."
+        )
+        return WAIT_POST_MEDIA
+    media.append(item)
+    if len(media) == 1:
+        await msg.reply_text(
+            f"🖼 Album started. Send more items (up to {ALBUM_MAX_ITEMS}), then /done to save."
+        )
+    return WAIT_POST_MEDIA
 
 
 async def skip_post_media(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -75,17 +104,22 @@ async def _save_post_and_offer(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     content  = post.get("content", "")
     mfid     = post.get("media_file_id")
     mtype    = post.get("media_type")
+    media    = post.get("media")
+    if media and len(media) == 1:
+        (mtype, mfid), media = media[0], None
+    elif media:
+        mtype = "album"
 
-    post_id = db.save_post(user_id, title, content, mfid, mtype)
-    db.log_event(user_id, "post_created", f"Post '{title or 'Untitled'}' saved as draft", post_id=post_id)
+    post_id = await db.save_post(user_id, title, content, mfid, mtype, media)
+    await db.log_event(user_id, "post_created", f"Post '{title or 'Untitled'}' saved as draft", post_id=post_id)
 
-    channels = db.get_channels(user_id)
+    channels = await db.get_channels(user_id)
 
     keyboard = []
     for ch in channels:
         keyboard.append([InlineKeyboardButton(
             f"📢 Publish to {ch['channel_name'] or ch['channel_id']}",
-            callback_data=f"publish:{post_id}:{ch['channel_id']}"
+            callback_data=encode("publish", post_id, ch["channel_id"])
         )])
     keyboard.append([InlineKeyboardButton("💾 Save as Draft", callback_data="main_menu")])
 
@@ -101,38 +135,31 @@ async def _save_post_and_offer(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_publish_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    _, post_id, channel_id = q.data.split(":", 2)
-    post_id = int(post_id)
+    post_id, channel_id = await decode(q.data)
     user_id = q.from_user.id
 
-    post = db.get_post(post_id)
+    post = await db.get_post(post_id)
     if not post:
         await q.edit_message_text("❌ Post not found.", reply_markup=main_menu())
         return
 
-    try:
-        if post["media_file_id"] and post["media_type"] == "photo":
-            await ctx.bot.send_photo(chat_id=channel_id, photo=post["media_file_id"],
-                                     caption=post["content"])
-        elif post["media_file_id"] and post["media_type"] == "video":
-            await ctx.bot.send_video(chat_id=channel_id, video=post["media_file_id"],
-                                     caption=post["content"])
-        elif post["media_file_id"] and post["media_type"] == "document":
-            await ctx.bot.send_document(chat_id=channel_id, document=post["media_file_id"],
-                                        caption=post["content"])
-        else:
-            await ctx.bot.send_message(chat_id=channel_id, text=post["content"])
-
-        db.log_event(user_id, "post_published",
-                     f"Post #{post_id} published to {channel_id}",
-                     channel_id=channel_id, post_id=post_id)
-        await q.edit_message_text("✅ Post published!", reply_markup=main_menu())
-
-    except Exception as e:
+    media = None
+    if post["media_type"] == "album":
+        media = (await db.get_post_media([post_id])).get(post_id)
+    [job_id] = await outbox.queue("publish", user_id, post_id, [channel_id])
+    errors = await outbox.send(ctx.bot, post, media, [(job_id, channel_id)])
+
+    if errors[job_id] is not None:
         await q.edit_message_text(
-            f"❌ Failed to publish:\n<code>{e}</code>",
+            f"❌ Failed to publish:\n<code>{errors[job_id]}</code>",
             parse_mode="HTML", reply_markup=main_menu()
         )
+        return
+
+    await db.log_event(user_id, "post_published",
+                       f"Post #{post_id} published to {channel_id}",
+                       channel_id=channel_id, post_id=post_id)
+    await q.edit_message_text("✅ Post published!", reply_markup=main_menu())
 
 
 # ── My Posts (Draft Manager) ─────────────────────────────────────────────────
@@ -141,7 +168,8 @@ async def cb_my_posts(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id = q.from_user.id
-    posts   = db.get_posts(user_id)
+    cursor, direction = await page_cursor(q.data)
+    posts, has_prev, has_next = await db.get_posts_page(user_id, cursor, direction)
 
     if not posts:
         await q.edit_message_text("📂 You have no posts yet.",
@@ -151,15 +179,15 @@ async def cb_my_posts(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(
         "📂 <b>My Posts</b>\n\nSelect a post to view or delete:",
         parse_mode="HTML",
-        reply_markup=post_list_keyboard(posts, "view_post")
+        reply_markup=post_list_keyboard(posts, "view_post", has_prev, has_next)
     )
 
 
 async def cb_view_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    post_id = int(q.data.split(":")[1])
-    post    = db.get_post(post_id)
+    [post_id] = await decode(q.data)
+    post    = await db.get_post(post_id)
     user_id = q.from_user.id
 
     if not post or post["user_id"] != user_id:
@@ -172,16 +200,16 @@ async def cb_view_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         f"<i>Status: {post['status']} | Created: {post['created_at']}</i>"
     )
 
-    channels  = db.get_channels(user_id)
+    channels  = await db.get_channels(user_id)
     kbd_rows  = [
         [InlineKeyboardButton(
             f"📢 Publish to {ch['channel_name'] or ch['channel_id']}",
-            callback_data=f"publish:{post_id}:{ch['channel_id']}"
+            callback_data=encode("publish", post_id, ch["channel_id"])
         )]
         for ch in channels
     ]
     kbd_rows.append([
-        InlineKeyboardButton("🗑 Delete", callback_data=f"delete_post:{post_id}"),
+        InlineKeyboardButton("🗑 Delete", callback_data=encode("delete_post", post_id)),
         InlineKeyboardButton("« Back",  callback_data="my_posts"),
     ])
 
@@ -192,32 +220,33 @@ async def cb_view_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_delete_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    post_id = int(q.data.split(":")[1])
+    [post_id] = await decode(q.data)
     user_id = q.from_user.id
-    db.delete_post(post_id, user_id)
-    db.log_event(user_id, "post_deleted", f"Post #{post_id} deleted", post_id=post_id)
+    await db.delete_post(post_id, user_id)
+    await db.log_event(user_id, "post_deleted", f"Post #{post_id} deleted", post_id=post_id)
     await q.edit_message_text("🗑 Post deleted.", reply_markup=back_button("my_posts"))
 
 
-# ── Conversation handler ─────────────────────────────────────────────────────
+# ── Conversation flow ────────────────────────────────────────────────────────
 
-def create_post_conv():
-    return ConversationHandler(
-        entry_points=[CallbackQueryHandler(cb_create_post, pattern="^create_post$")],
+def create_post_flow():
+    return Flow(
+        "create_post",
+        entry_points={"create_post": cb_create_post},
         states={
-            WAIT_POST_TITLE: [
-                CommandHandler("skip", skip_post_title),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, recv_post_title),
-            ],
-            WAIT_POST_CONTENT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, recv_post_content),
-            ],
-            WAIT_POST_MEDIA: [
-                CommandHandler("skip", skip_post_media),
-                MessageHandler(filters.PHOTO | filters.VIDEO | filters.Document.ALL, recv_post_media),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, skip_post_media),
-            ],
+            WAIT_POST_TITLE: {
+                "/skip": skip_post_title,
+                TEXT:    recv_post_title,
+            },
+            WAIT_POST_CONTENT: {
+                TEXT: recv_post_content,
+            },
+            WAIT_POST_MEDIA: {
+                "/skip": skip_post_media,
+                "/done": skip_post_media,
+                MEDIA:   recv_post_media,
+                TEXT:    skip_post_media,
+            },
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
-        per_message=False
+        fallbacks={"/cancel": end_flow},
     )
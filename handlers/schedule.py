@@ -1,9 +1,12 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import (ContextTypes, ConversationHandler, CommandHandler,
-                           MessageHandler, filters, CallbackQueryHandler)
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
-from keyboards import main_menu, post_list_keyboard, scheduled_list_keyboard, back_button
+import async_db as db
+from callback_tokens import encode, decode
+import scheduler
+from keyboards import (main_menu, post_list_keyboard, scheduled_list_keyboard, back_button,
+                       page_cursor)
+from router import Flow, TEXT
 
 # States
 SEL_POST, SEL_CHANNEL, WAIT_DATETIME = range(3)
@@ -15,7 +18,8 @@ async def cb_schedule_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id = q.from_user.id
-    posts   = db.get_posts(user_id)
+    cursor, direction = await page_cursor(q.data)
+    posts, has_prev, has_next = await db.get_posts_page(user_id, cursor, direction)
 
     if not posts:
         await q.edit_message_text(
@@ -27,7 +31,7 @@ async def cb_schedule_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(
         "⏰ <b>Schedule Post</b>\n\nStep 1: Pick the post to schedule:",
         parse_mode="HTML",
-        reply_markup=post_list_keyboard(posts, "sched_post")
+        reply_markup=post_list_keyboard(posts, "sched_post", has_prev, has_next)
     )
     return SEL_POST
 
@@ -35,11 +39,11 @@ async def cb_schedule_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_sched_select_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    post_id = int(q.data.split(":")[1])
+    [post_id] = await decode(q.data)
     ctx.user_data["sched_post_id"] = post_id
 
     user_id  = q.from_user.id
-    channels = db.get_channels(user_id)
+    channels = await db.get_channels(user_id)
 
     if not channels:
         await q.edit_message_text("❌ No channels. Add one first.", reply_markup=back_button())
@@ -48,7 +52,7 @@ async def cb_sched_select_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     rows = [
         [InlineKeyboardButton(
             f"📢 {ch['channel_name'] or ch['channel_id']}",
-            callback_data=f"sched_ch:{ch['channel_id']}:{ch['channel_name'] or ''}"
+            callback_data=encode("sched_ch", ch["channel_id"], ch["channel_name"])
         )]
         for ch in channels
     ]
@@ -65,9 +69,9 @@ async def cb_sched_select_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_sched_select_channel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    parts = q.data.split(":", 2)
-    ctx.user_data["sched_channel_id"]   = parts[1]
-    ctx.user_data["sched_channel_name"] = parts[2] if len(parts) > 2 else parts[1]
+    channel_id, channel_name = await decode(q.data)
+    ctx.user_data["sched_channel_id"]   = channel_id
+    ctx.user_data["sched_channel_name"] = channel_name or channel_id
 
     await q.edit_message_text(
         "⏰ <b>Schedule Post</b>\n\n"
@@ -87,8 +91,8 @@ async def recv_schedule_time(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     try:
-        dt = datetime.strptime(text, "%Y-%m-%d %H:%M")
-        if dt < datetime.utcnow():
+        dt = datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+        if dt < datetime.now(timezone.utc):
             await update.message.reply_text(
                 "❌ That time is in the past! Try again or /cancel."
             )
@@ -103,20 +107,22 @@ async def recv_schedule_time(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     post_id      = ctx.user_data["sched_post_id"]
     channel_id   = ctx.user_data["sched_channel_id"]
     channel_name = ctx.user_data["sched_channel_name"]
-    post         = db.get_post(post_id)
+    post         = await db.get_post(post_id)
+    scheduled_at = int(dt.timestamp())
 
-    sched_id = db.schedule_post(
+    sched_id = await db.schedule_post(
         user_id, channel_id, channel_name,
-        scheduled_time=text,
+        scheduled_at=scheduled_at,
         content=post["content"],
         media_file_id=post["media_file_id"],
         media_type=post["media_type"],
         post_id=post_id
     )
+    scheduler.add_job(sched_id, scheduled_at)
 
-    db.log_event(user_id, "post_scheduled",
-                 f"Post #{post_id} scheduled for {text} → {channel_name}",
-                 channel_id=channel_id, post_id=post_id)
+    await db.log_event(user_id, "post_scheduled",
+                       f"Post #{post_id} scheduled for {text} → {channel_name}",
+                       channel_id=channel_id, post_id=post_id)
 
     await update.message.reply_text(
         f"✅ Post scheduled for <b>{text} UTC</b> → <b>{channel_name}</b>",
@@ -130,22 +136,23 @@ async def cmd_cancel_sched(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
-def schedule_conv():
-    return ConversationHandler(
-        entry_points=[CallbackQueryHandler(cb_schedule_post, pattern="^schedule_post$")],
+def schedule_flow():
+    return Flow(
+        "schedule",
+        entry_points={"schedule_post": cb_schedule_post},
         states={
-            SEL_POST: [
-                CallbackQueryHandler(cb_sched_select_post, pattern="^sched_post:"),
-            ],
-            SEL_CHANNEL: [
-                CallbackQueryHandler(cb_sched_select_channel, pattern="^sched_ch:"),
-            ],
-            WAIT_DATETIME: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, recv_schedule_time),
-            ],
+            SEL_POST: {
+                "sched_post":    cb_sched_select_post,
+                "sched_post_pg": cb_schedule_post,
+            },
+            SEL_CHANNEL: {
+                "sched_ch": cb_sched_select_channel,
+            },
+            WAIT_DATETIME: {
+                TEXT: recv_schedule_time,
+            },
         },
-        fallbacks=[CommandHandler("cancel", cmd_cancel_sched)],
-        per_message=False
+        fallbacks={"/cancel": cmd_cancel_sched},
     )
 
 
@@ -155,7 +162,8 @@ async def cb_delete_scheduled(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id   = q.from_user.id
-    scheduled = db.get_scheduled_posts(user_id)
+    cursor, direction = await page_cursor(q.data)
+    scheduled, has_prev, has_next = await db.get_scheduled_page(user_id, cursor, direction)
 
     if not scheduled:
         await q.edit_message_text(
@@ -166,18 +174,19 @@ async def cb_delete_scheduled(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(
         "🗑 <b>Delete Scheduled Post</b>\n\nTap a post to remove it:",
         parse_mode="HTML",
-        reply_markup=scheduled_list_keyboard(scheduled)
+        reply_markup=scheduled_list_keyboard(scheduled, has_prev, has_next)
     )
 
 
 async def cb_del_sched_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    sched_id = int(q.data.split(":")[1])
+    [sched_id] = await decode(q.data)
     user_id  = q.from_user.id
 
-    db.delete_scheduled(sched_id, user_id)
-    db.log_event(user_id, "scheduled_deleted", f"Deleted scheduled post #{sched_id}")
+    if await db.delete_scheduled(sched_id, user_id):
+        scheduler.remove_job(sched_id)
+    await db.log_event(user_id, "scheduled_deleted", f"Deleted scheduled post #{sched_id}")
 
     await q.edit_message_text(
         "🗑 Scheduled post removed.",
@@ -1,8 +1,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
+import async_db as db
+from callback_tokens import encode, decode
 from keyboards import main_menu, back_button
+from router import Flow, TEXT, end_flow
 
 WAIT_TIMEZONE = 1
 
@@ -18,7 +20,7 @@ async def cb_settings(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id  = q.from_user.id
-    settings = db.get_settings(user_id)
+    settings = await db.get_settings(user_id)
 
     text = (
         "⚙ <b>Settings</b>\n\n"
@@ -40,11 +42,11 @@ async def cb_toggle_notif(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id  = q.from_user.id
-    settings = db.get_settings(user_id)
+    settings = await db.get_settings(user_id)
     new_val  = 0 if settings["notifications"] else 1
-    db.update_setting(user_id, "notifications", new_val)
-    db.log_event(user_id, "settings_changed",
-                 f"Notifications {'enabled' if new_val else 'disabled'}")
+    await db.update_setting(user_id, "notifications", new_val)
+    await db.log_event(user_id, "settings_changed",
+                       f"Notifications {'enabled' if new_val else 'disabled'}")
     # re-render
     await cb_settings(update, ctx)
 
@@ -54,7 +56,7 @@ async def cb_set_timezone(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     rows = [
-        [InlineKeyboardButton(tz, callback_data=f"tz:{tz}")]
+        [InlineKeyboardButton(tz, callback_data=encode("tz", tz))]
         for tz in COMMON_TIMEZONES
     ]
     rows.append([InlineKeyboardButton("✏️ Enter manually", callback_data="tz_manual")])
@@ -71,10 +73,10 @@ async def cb_set_timezone(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def cb_tz_pick(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    tz      = q.data.split(":", 1)[1]
+    [tz]    = await decode(q.data)
     user_id = q.from_user.id
-    db.update_setting(user_id, "timezone", tz)
-    db.log_event(user_id, "settings_changed", f"Timezone set to {tz}")
+    await db.update_setting(user_id, "timezone", tz)
+    await db.log_event(user_id, "settings_changed", f"Timezone set to {tz}")
     await q.edit_message_text(f"✅ Timezone set to <b>{tz}</b>",
                               parse_mode="HTML", reply_markup=main_menu())
 
@@ -93,8 +95,8 @@ async def cb_tz_manual(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def recv_timezone(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     tz      = update.message.text.strip()
     user_id = update.effective_user.id
-    db.update_setting(user_id, "timezone", tz)
-    db.log_event(user_id, "settings_changed", f"Timezone set to {tz}")
+    await db.update_setting(user_id, "timezone", tz)
+    await db.log_event(user_id, "settings_changed", f"Timezone set to {tz}")
     await update.message.reply_text(
         f"✅ Timezone set to <b>{tz}</b>",
         parse_mode="HTML", reply_markup=main_menu()
@@ -102,12 +104,12 @@ async def recv_timezone(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
-def settings_tz_conv():
-    return ConversationHandler(
-        entry_points=[CallbackQueryHandler(cb_tz_manual, pattern="^tz_manual$")],
+def settings_tz_flow():
+    return Flow(
+        "settings_tz",
+        entry_points={"tz_manual": cb_tz_manual},
         states={
-            WAIT_TIMEZONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, recv_timezone)],
+            WAIT_TIMEZONE: {TEXT: recv_timezone},
         },
-        fallbacks=[CommandHandler("cancel", lambda u, c: ConversationHandler.END)],
-        per_message=False
+        fallbacks={"/cancel": end_flow},
     )
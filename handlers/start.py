@@ -1,7 +1,7 @@
 from telegram import Update
-from telegram.ext import ContextTypes
+from telegram.ext import ContextTypes, ConversationHandler
 
-import database as db
+import async_db as db
 from keyboards import main_menu
 
 
@@ -14,10 +14,11 @@ WELCOME_TEXT = (
 
 async def cmd_start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db.get_settings(user.id)          # ensure settings row exists
-    db.log_event(user.id, "start", "User started bot")
+    await db.get_settings(user.id)          # ensure settings row exists
+    await db.log_event(user.id, "start", "User started bot")
     await update.message.reply_text(WELCOME_TEXT, parse_mode="HTML",
                                     reply_markup=main_menu())
+    return ConversationHandler.END    # going home abandons any half-finished flow
 
 
 async def cb_main_menu(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -25,9 +26,11 @@ async def cb_main_menu(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     await q.edit_message_text(WELCOME_TEXT, parse_mode="HTML",
                               reply_markup=main_menu())
+    return ConversationHandler.END
 
 
 async def cb_exit(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     await q.edit_message_text("👋 Goodbye! Type /start to return.", parse_mode="HTML")
+    return ConversationHandler.END
@@ -1,5 +1,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from callback_tokens import encode, decode
+
 
 def main_menu() -> InlineKeyboardMarkup:
     rows = [
@@ -22,14 +24,37 @@ def back_button(target: str = "main_menu") -> InlineKeyboardMarkup:
     ])
 
 
-def post_list_keyboard(posts, prefix: str) -> InlineKeyboardMarkup:
+async def page_cursor(data: str):
+    """Return (cursor, direction) for a "<prefix>_pg" page button.
+
+    Any other callback data (the button that opened the list) means the
+    first page: (None, "next").
+    """
+    if not data.partition(":")[0].endswith("_pg"):
+        return None, "next"
+    direction, cursor = await decode(data)
+    return cursor, direction
+
+
+def _page_nav_row(items, prefix: str, has_prev: bool, has_next: bool):
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("‹ Prev", callback_data=encode(f"{prefix}_pg", "prev", items[0]["id"])))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ›", callback_data=encode(f"{prefix}_pg", "next", items[-1]["id"])))
+    return [nav] if nav else []
+
+
+def post_list_keyboard(posts, prefix: str, has_prev: bool = False,
+                       has_next: bool = False) -> InlineKeyboardMarkup:
     rows = []
     for post in posts:
         title = (post["title"] or post["content"] or "Untitled").strip()
         label = title[:32] + "…" if len(title) > 32 else title
         rows.append([
-            InlineKeyboardButton(f"📝 #{post['id']} {label}", callback_data=f"{prefix}:{post['id']}")
+            InlineKeyboardButton(f"📝 #{post['id']} {label}", callback_data=encode(prefix, post["id"]))
         ])
+    rows += _page_nav_row(posts, prefix, has_prev, has_next)
     rows.append([InlineKeyboardButton("« Back", callback_data="main_menu")])
     return InlineKeyboardMarkup(rows)
 
@@ -38,7 +63,7 @@ def channel_list_keyboard(channels, prefix: str = "channel") -> InlineKeyboardMa
     rows = [
         [InlineKeyboardButton(
             f"📢 {ch['channel_name'] or ch['channel_id']}",
-            callback_data=f"{prefix}:{ch['channel_id']}"
+            callback_data=encode(prefix, ch["channel_id"])
         )]
         for ch in channels
     ]
@@ -46,7 +71,8 @@ def channel_list_keyboard(channels, prefix: str = "channel") -> InlineKeyboardMa
     return InlineKeyboardMarkup(rows)
 
 
-def scheduled_list_keyboard(scheduled_posts) -> InlineKeyboardMarkup:
+def scheduled_list_keyboard(scheduled_posts, has_prev: bool = False,
+                            has_next: bool = False) -> InlineKeyboardMarkup:
     rows = []
     for item in scheduled_posts:
         when = str(item["scheduled_time"])[:16]
@@ -54,8 +80,9 @@ def scheduled_list_keyboard(scheduled_posts) -> InlineKeyboardMarkup:
         rows.append([
             InlineKeyboardButton(
                 f"🗑 #{item['id']} {when} → {name}",
-                callback_data=f"del_sched:{item['id']}"
+                callback_data=encode("del_sched", item["id"])
             )
         ])
+    rows += _page_nav_row(scheduled_posts, "del_sched", has_prev, has_next)
     rows.append([InlineKeyboardButton("« Back", callback_data="main_menu")])
     return InlineKeyboardMarkup(rows)
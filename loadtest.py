@@ -0,0 +1,245 @@
+"""Drive Telebot with simulated users against a local fake Bot API.
+
+    python loadtest.py --users 2000 --concurrency 200 --latency 0.02
+
+Starts a FakeBotAPI, points the real bot at it (with a throwaway database
+unless DATABASE_PATH is set) and has every user add a channel, create and
+publish a post, multipost it and schedule it. Prints handler latency
+percentiles per step (from the update being queued to the bot's reply in
+that chat) and Bot API calls per user action.
+
+    python loadtest.py --users 2000 --scheduled 20000
+
+also makes that many scheduled posts due while the users run, so the
+scheduler claims, sends and marks them in bulk alongside the handlers;
+compare the handler p99 with a run without it.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from fake_bot_api import FakeBotAPI
+
+# Calls the bot makes on its own schedule rather than in answer to a user
+BACKGROUND_METHODS = {"getMe", "deleteWebhook", "getUpdates"}
+
+# Owner and channels of the --scheduled posts, apart from the simulated users'
+SCHEDULED_OWNER    = 1
+SCHEDULED_CHANNELS = [-1002000000000 - i for i in range(100)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100,
+                        help="users clicking through their flows at once")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the fake API waits before answering a send or edit")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of sends and edits answered with a 500")
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="fraction of sends and edits answered with a 429 flood wait")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--scheduled", type=int, default=0,
+                        help="scheduled posts made due in bulk while the users run")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="seconds to wait for the bot to answer one action")
+    return parser.parse_args()
+
+
+class SimulatedUser:
+
+    def __init__(self, api, user_id, timings, timeout):
+        self.api      = api
+        self.user_id  = user_id
+        self.timings  = timings
+        self.timeout  = timeout
+        self.screen   = None    # the last message the bot sent or edited for us
+
+    async def say(self, step, text, match=None):
+        return await self._act(step, lambda: self.api.send_text(self.user_id, text), match)
+
+    async def tap(self, step, prefix, match=None):
+        data    = _button(self.screen, prefix)
+        message = self.screen
+        return await self._act(step, lambda: self.api.click(self.user_id, message, data), match)
+
+    async def _act(self, step, push, match):
+        seen    = len(self.api.outbox[self.user_id])
+        started = time.perf_counter()
+        push()
+        self.screen = await self.api.wait_for(self.user_id, seen, match, self.timeout)
+        self.timings[step].append(time.perf_counter() - started)
+
+
+async def run_user(user):
+    when = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d %H:%M")
+
+    await user.say("start", "/start")
+
+    await user.tap("add_channel", "add_channel")
+    await user.say("channel_id", f"@loadtest{user.user_id}")
+
+    await user.tap("create_post", "create_post")
+    await user.say("post_title", f"Load test post {user.user_id}")
+    await user.say("post_content", "Posted by loadtest.py")
+    await user.say("post_media", "/skip")
+    await user.tap("publish", "publish")
+
+    await user.tap("multipost", "multipost")
+    await user.tap("mp_post", "mp_post")
+    await user.tap("mp_toggle", "mp_toggle")
+    await user.tap("mp_confirm", "mp_confirm",
+                   match=lambda m: m.get("text", "").startswith("📤 Multipost Results"))
+
+    await user.tap("schedule_post", "schedule_post")
+    await user.tap("sched_post", "sched_post")
+    await user.tap("sched_ch", "sched_ch")
+    await user.say("sched_time", when)
+
+
+def _button(message, prefix):
+    """The callback data of the first inline button routed under prefix."""
+    for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+        for button in row:
+            data = button.get("callback_data", "")
+            if data.partition(":")[0] == prefix:
+                return data
+    raise LookupError(f"no {prefix!r} button in {message.get('text', '')[:40]!r}")
+
+
+async def schedule_due_posts(db, scheduler, count, batch):
+    """Schedule `count` posts due now, `batch` writes at a time, and wake the
+    scheduler for each; return when they are all written."""
+    now = int(time.time())
+    for start in range(0, count, batch):
+        ids = await asyncio.gather(*(
+            db.schedule_post(SCHEDULED_OWNER, SCHEDULED_CHANNELS[n % len(SCHEDULED_CHANNELS)],
+                             f"Load test channel {n % len(SCHEDULED_CHANNELS)}",
+                             now, f"Scheduled post {n}")
+            for n in range(start, min(count, start + batch))
+        ))
+        for sched_id in ids:
+            scheduler.add_job(sched_id, now)
+
+
+async def wait_scheduled_sent(api, count, timeout):
+    """Wait until `count` --scheduled posts are in their channels or `timeout` s pass."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and scheduled_sent(api) < count:
+        await asyncio.sleep(0.05)
+
+
+def scheduled_sent(api):
+    return sum(len(api.outbox[channel_id]) for channel_id in SCHEDULED_CHANNELS)
+
+
+def scheduled_calls(api):
+    """Bot API calls per method made for the --scheduled posts: the channel
+    sends and the owner's notifications."""
+    chats = {SCHEDULED_OWNER, *SCHEDULED_CHANNELS}
+    calls = Counter()
+    for (method, chat_id), count in api.chat_calls.items():
+        if chat_id in chats:
+            calls[method] += count
+    return calls
+
+
+def _percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def report(api, timings, failures, users, elapsed, scheduled=0, drained=None):
+    actions = sum(len(samples) for samples in timings.values())
+    print(f"\n{users} users ({sum(failures.values())} failed), {actions} actions "
+          f"in {elapsed:.1f} s ({actions / elapsed:.0f} actions/s)")
+    for reason, count in failures.most_common():
+        print(f"  {count:>6}  {reason}")
+    if scheduled:
+        print(f"{scheduled_sent(api)}/{scheduled} scheduled posts sent, "
+              f"the last {drained:.1f} s after the start ({scheduled_sent(api) / drained:.0f} posts/s)")
+
+    print(f"\n{'step':<15}{'n':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    everything = []
+    for step, samples in [*timings.items(), ("all", everything)]:
+        if step != "all":
+            everything += samples
+        samples.sort()
+        if samples:
+            print(f"{step:<15}{len(samples):>8}"
+                  + "".join(f"{_percentile(samples, q) * 1000:>10.1f}" for q in (0.5, 0.9, 0.99))
+                  + f"{samples[-1] * 1000:>10.1f}")
+
+    background = scheduled_calls(api)
+    answered = Counter({m: n for m, n in api.calls.items() if m not in BACKGROUND_METHODS})
+    answered.subtract(background)
+    print(f"\nBot API calls per user action: {answered.total() / max(actions, 1):.2f}")
+    for method, count in answered.most_common():
+        if count:
+            print(f"  {method:<22}{count:>8}  ({count / max(actions, 1):.2f}/action)")
+    print(f"  {'getUpdates':<22}{api.calls['getUpdates']:>8}")
+    if background:
+        print(f"Bot API calls for the scheduled posts: {background.total()} "
+              f"({background.total() / max(scheduled, 1):.2f}/post)")
+        for method, count in background.most_common():
+            print(f"  {method:<22}{count:>8}")
+
+
+async def run(args):
+    api = FakeBotAPI(latency=args.latency, error_rate=args.error_rate,
+                     flood_rate=args.flood_rate, retry_after=args.retry_after)
+    os.environ["BOT_API_BASE_URL"] = await api.start()
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    if "DATABASE_PATH" not in os.environ:
+        os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "loadtest.db")
+
+    # config reads the environment at import, so the bot is imported late
+    import async_db
+    import main as bot
+    import scheduler
+    from config import SCHEDULER_BATCH_SIZE
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app      = bot.build_app()
+    timings  = defaultdict(list)
+    failures = Counter()
+    slots    = asyncio.Semaphore(args.concurrency)
+
+    async def one(user_id):
+        async with slots:
+            try:
+                await run_user(SimulatedUser(api, user_id, timings, args.timeout))
+            except asyncio.TimeoutError:
+                failures["no reply within --timeout"] += 1
+            except LookupError as e:
+                failures[str(e)] += 1
+
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        # As in production: idle unless --scheduled (users schedule a day ahead)
+        scheduler_task = asyncio.create_task(scheduler.run_scheduler(app))
+        started = time.perf_counter()
+        await asyncio.gather(
+            schedule_due_posts(async_db, scheduler, args.scheduled, SCHEDULER_BATCH_SIZE),
+            *(one(100000 + i) for i in range(args.users)),
+        )
+        elapsed = time.perf_counter() - started
+        await wait_scheduled_sent(api, args.scheduled, args.timeout)
+        drained = time.perf_counter() - started
+        scheduler_task.cancel()
+        await app.updater.stop()
+        await app.stop()
+
+    async_db.shutdown()
+    await api.stop()
+    report(api, timings, failures, args.users, elapsed, args.scheduled, drained)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -1,24 +1,32 @@
 import asyncio
 import logging
 
-from telegram.ext import (
-    Application, CommandHandler, CallbackQueryHandler
-)
+from telegram import Update
+from telegram.ext import Application, ContextTypes
 
-import database as db
+import async_db
+import maintenance
+import metrics
+import outbox
 import scheduler as sched
-from config import BOT_TOKEN
+import user_state
+from callback_tokens import ExpiredCallback
+from config import (BOT_TOKEN, BOT_API_BASE_URL, UPDATE_MODE, WEBHOOK_URL, WEBHOOK_SECRET,
+                    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_MAX_CONNECTIONS)
+from keyboards import main_menu
+from router import Router
 
 from handlers.start    import cmd_start, cb_main_menu, cb_exit
-from handlers.channel  import add_channel_conv
-from handlers.posts    import (create_post_conv, cb_my_posts, cb_view_post,
+from handlers.admin    import cmd_profile
+from handlers.channel  import add_channel_flow
+from handlers.posts    import (create_post_flow, cb_my_posts, cb_view_post,
                                 cb_delete_post, cb_publish_post)
-from handlers.multipost import multipost_conv
-from handlers.schedule  import (schedule_conv, cb_delete_scheduled,
+from handlers.multipost import multipost_flow
+from handlers.schedule  import (schedule_flow, cb_delete_scheduled,
                                   cb_del_sched_confirm)
 from handlers.logs      import cb_event_log, cb_clear_log
 from handlers.settings  import (cb_settings, cb_toggle_notif, cb_set_timezone,
-                                  cb_tz_pick, settings_tz_conv)
+                                  cb_tz_pick, settings_tz_flow)
 
 logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
@@ -27,46 +35,99 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def build_app():
-    db.init_db()
-
-    app = Application.builder().token(BOT_TOKEN).build()
+async def on_error(update: object, ctx: ContextTypes.DEFAULT_TYPE):
+    if isinstance(ctx.error, ExpiredCallback) and isinstance(update, Update) and update.callback_query:
+        await update.callback_query.edit_message_text(
+            "⌛ This menu has expired. Pick again from the main menu.",
+            reply_markup=main_menu()
+        )
+        return
+    logger.error("Unhandled error while processing an update", exc_info=ctx.error)
+
+
+def build_router():
+    return Router(
+        callbacks={
+            "main_menu":        cb_main_menu,
+            "exit":             cb_exit,
+
+            # Posts
+            "my_posts":         cb_my_posts,
+            "view_post_pg":     cb_my_posts,
+            "view_post":        cb_view_post,
+            "delete_post":      cb_delete_post,
+            "publish":          cb_publish_post,
+
+            # Schedule
+            "delete_scheduled": cb_delete_scheduled,
+            "del_sched_pg":     cb_delete_scheduled,
+            "del_sched":        cb_del_sched_confirm,
+
+            # Event log
+            "event_log":        cb_event_log,
+            "clear_log":        cb_clear_log,
+
+            # Settings
+            "settings":         cb_settings,
+            "toggle_notif":     cb_toggle_notif,
+            "set_timezone":     cb_set_timezone,
+            "tz":               cb_tz_pick,
+        },
+        commands={
+            "/start": cmd_start,
+            "/profile": cmd_profile,
+        },
+        flows=[
+            add_channel_flow(),
+            create_post_flow(),
+            multipost_flow(),
+            schedule_flow(),
+            settings_tz_flow(),
+        ],
+    )
 
-    # ── Commands ─────────────────────────────────────────────────────────────
-    app.add_handler(CommandHandler("start", cmd_start))
 
-    # ── Conversation handlers (must come before plain CallbackQueryHandlers) ─
-    app.add_handler(add_channel_conv())
-    app.add_handler(create_post_conv())
-    app.add_handler(multipost_conv())
-    app.add_handler(schedule_conv())
-    app.add_handler(settings_tz_conv())
+def build_app():
+    async_db.init_db()
 
-    # ── Plain callback handlers ───────────────────────────────────────────────
-    app.add_handler(CallbackQueryHandler(cb_main_menu,        pattern="^main_menu$"))
-    app.add_handler(CallbackQueryHandler(cb_exit,             pattern="^exit$"))
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{BOT_API_BASE_URL}/bot")
+        .base_file_url(f"{BOT_API_BASE_URL}/file/bot")
+        # Same pool size as PTB's default request, plus latency/error metrics
+        .request(metrics.MeteredRequest(connection_pool_size=256))
+        .build()
+    )
 
-    # Posts
-    app.add_handler(CallbackQueryHandler(cb_my_posts,         pattern="^my_posts$"))
-    app.add_handler(CallbackQueryHandler(cb_view_post,        pattern="^view_post:"))
-    app.add_handler(CallbackQueryHandler(cb_delete_post,      pattern="^delete_post:"))
-    app.add_handler(CallbackQueryHandler(cb_publish_post,     pattern="^publish:"))
+    # Every update goes through one Router: the callback-data prefix or
+    # command is parsed once and looked up in a dict.
+    app.add_handler(build_router())
 
-    # Schedule
-    app.add_handler(CallbackQueryHandler(cb_delete_scheduled, pattern="^delete_scheduled$"))
-    app.add_handler(CallbackQueryHandler(cb_del_sched_confirm,pattern="^del_sched:"))
+    app.add_error_handler(on_error)
 
-    # Event log
-    app.add_handler(CallbackQueryHandler(cb_event_log,        pattern="^event_log$"))
-    app.add_handler(CallbackQueryHandler(cb_clear_log,        pattern="^clear_log$"))
+    return app
 
-    # Settings
-    app.add_handler(CallbackQueryHandler(cb_settings,         pattern="^settings$"))
-    app.add_handler(CallbackQueryHandler(cb_toggle_notif,     pattern="^toggle_notif$"))
-    app.add_handler(CallbackQueryHandler(cb_set_timezone,     pattern="^set_timezone$"))
-    app.add_handler(CallbackQueryHandler(cb_tz_pick,          pattern="^tz:"))
 
-    return app
+async def start_updates(app):
+    if UPDATE_MODE == "webhook":
+        # Without a secret, anyone who can reach the server could post
+        # updates as any user; without a URL, Telegram never sends any.
+        if not (WEBHOOK_URL and WEBHOOK_SECRET):
+            raise RuntimeError("UPDATE_MODE=webhook needs both WEBHOOK_URL and WEBHOOK_SECRET")
+        # PTB's webhook server rejects requests whose
+        # X-Telegram-Bot-Api-Secret-Token header does not match secret_token.
+        await app.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=True,
+        )
+    else:
+        await app.updater.start_polling(drop_pending_updates=True)
 
 
 async def main():
@@ -74,17 +135,30 @@ async def main():
 
     async with app:
         await app.start()
-        await app.updater.start_polling(drop_pending_updates=True)
-        logger.info("🤖 Telebot is running …")
+        await start_updates(app)
+        logger.info(f"🤖 Telebot is running ({UPDATE_MODE}) …")
+        metrics_server = await metrics.serve()
 
-        # Start background scheduler
-        asyncio.create_task(sched.run_scheduler(app))
+        # Start background scheduler, outbox recovery and DB maintenance
+        scheduler_task = asyncio.create_task(sched.run_scheduler(app))
+        outbox_task = asyncio.create_task(outbox.run_recovery(app))
+        maintenance_task = asyncio.create_task(maintenance.run_maintenance())
+        user_state_task = asyncio.create_task(user_state.run_flusher(app))
 
         # Run until interrupted
-        await asyncio.Event().wait()
-
-        await app.updater.stop()
-        await app.stop()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            scheduler_task.cancel()
+            outbox_task.cancel()
+            maintenance_task.cancel()
+            user_state_task.cancel()
+            if metrics_server is not None:
+                metrics_server.close()
+            await app.updater.stop()
+            await app.stop()
+            await user_state.flush(app)
+            async_db.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import async_db as db
+from config import (EVENT_RETENTION_DAYS, EVENT_PRUNE_CHUNK,
+                    VACUUM_PAGES_PER_STEP, MAINTENANCE_INTERVAL, CALLBACK_TOKEN_TTL)
+
+logger = logging.getLogger(__name__)
+
+
+async def run_maintenance():
+    """Background task: every MAINTENANCE_INTERVAL s apply retention and compact the DB."""
+    while True:
+        try:
+            if EVENT_RETENTION_DAYS:
+                await _prune_event_log()
+                await _prune_deliveries()
+            await _prune_callback_tokens()
+        except Exception as e:
+            logger.error(f"Maintenance error: {e}")
+
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+async def _prune_event_log():
+    cutoff = datetime.now(timezone.utc) - timedelta(days=EVENT_RETENTION_DAYS)
+    cutoff = cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Each chunk and each vacuum step is its own writer job, so handler
+    # writes queued in between are never stuck behind the whole cleanup.
+    removed = 0
+    while True:
+        n = await db.prune_events(cutoff, EVENT_PRUNE_CHUNK)
+        removed += n
+        if n < EVENT_PRUNE_CHUNK:
+            break
+
+    if removed:
+        while await db.compact_db(VACUUM_PAGES_PER_STEP):
+            pass
+        logger.info(f"Pruned {removed} events older than {cutoff}")
+
+
+async def _prune_deliveries():
+    # Finished outbox jobs are kept as long as the events that mention them
+    cutoff = int(time.time()) - EVENT_RETENTION_DAYS * 86400
+    while await db.prune_deliveries(cutoff, EVENT_PRUNE_CHUNK) == EVENT_PRUNE_CHUNK:
+        pass
+
+
+async def _prune_callback_tokens():
+    cutoff = int(time.time()) - CALLBACK_TOKEN_TTL
+    while await db.prune_callback_tokens(cutoff, EVENT_PRUNE_CHUNK) == EVENT_PRUNE_CHUNK:
+        pass
@@ -0,0 +1,421 @@
+import heapq
+import itertools
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+from config import PAGE_SIZE
+from storage import Storage
+
+
+def _stamp(epoch=None):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def _text(value):
+    # The SQLite columns holding chat ids are TEXT, so ids come back as strings
+    return None if value is None else str(value)
+
+
+def _discard(keys, key):
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+def _page(keys, cursor_key, cursor, direction, limit, descending):
+    """database._page over a sorted list of (sort key, id) instead of a query.
+
+    Returns (ids, has_prev, has_next). A cursor whose row is gone matches
+    nothing, as the SQL keyset comparison against NULL does.
+    """
+    backwards = direction == "prev"
+    if cursor is not None and cursor_key is None:
+        return [], not backwards, backwards
+    if descending != backwards:
+        end = bisect_left(keys, cursor_key) if cursor is not None else len(keys)
+        indexes = range(end - 1, -1, -1)
+    else:
+        start = bisect_right(keys, cursor_key) if cursor is not None else 0
+        indexes = range(start, len(keys))
+
+    ids = [keys[i][-1] for i in itertools.islice(indexes, limit + 1)]
+    more = len(ids) > limit
+    ids = ids[:limit]
+    if backwards:
+        ids.reverse()
+        return ids, more, True
+    return ids, cursor is not None, more
+
+
+class MemoryStorage(Storage):
+    """Storage kept in process memory: dicts by id plus sorted per-user and
+    due-time indexes, so every lookup the app makes avoids a full scan.
+
+    Nothing is persisted; meant for tests, benchmarks and load tests.
+    """
+
+    def __init__(self):
+        self._ids = {table: itertools.count(1)
+                     for table in ("channels", "posts", "scheduled_posts", "deliveries", "event_log")}
+
+        self._channels = {}             # user_id -> {channel_id: row}, oldest first
+
+        self._posts = {}                # id -> row
+        self._user_posts = {}           # user_id -> sorted [(created_at, id)]
+        self._post_media = {}           # post_id -> [(media_type, file_id)] of an album
+
+        self._sched = {}                # id -> row
+        self._pending = []              # sorted [(scheduled_at, id)] of pending rows
+        self._user_pending = {}         # user_id -> sorted [(scheduled_at, id)]
+
+        self._deliveries = {}           # id -> outbox job row
+        self._sched_jobs = {}           # sched_id -> job id
+
+        self._events = {}               # id -> row
+        self._event_order = deque()     # ids oldest first; cleared ones are skipped
+        self._user_events = {}          # user_id -> {id: None}, oldest first
+        self._event_daily = {}          # (user_id, day, event_type) -> count
+
+        self._tokens = {}               # token -> row
+        self._token_ages = []           # heap of (created_at, token); stale ones skipped
+
+        self._user_state = {}           # user_id -> JSON
+        self._settings = {}             # user_id -> row
+
+    # ── Lifecycle ────────────────────────────────────────────────────────────
+
+    def init_db(self):
+        pass
+
+    def close_db(self):
+        pass
+
+    def flush_writes(self):
+        pass
+
+    # ── Channels ─────────────────────────────────────────────────────────────
+
+    def add_channel(self, user_id, channel_id, channel_name):
+        channels = self._channels.setdefault(user_id, {})
+        channel_id = _text(channel_id)
+        row_id = next(self._ids["channels"])    # SQLite spends an id even on an ignored insert
+        if channel_id not in channels:
+            channels[channel_id] = {
+                "id": row_id, "user_id": user_id, "channel_id": channel_id,
+                "channel_name": channel_name, "added_at": _stamp(),
+            }
+        return True
+
+    def get_channels(self, user_id):
+        return [dict(row) for row in reversed(self._channels.get(user_id, {}).values())]
+
+    def delete_channel(self, user_id, channel_id):
+        self._channels.get(user_id, {}).pop(_text(channel_id), None)
+
+    # ── Posts ────────────────────────────────────────────────────────────────
+
+    def save_post(self, user_id, title, content, media_file_id=None, media_type=None, media=None):
+        post_id = next(self._ids["posts"])
+        now = _stamp()
+        self._posts[post_id] = {
+            "id": post_id, "user_id": user_id, "title": title, "content": content,
+            "media_file_id": media_file_id, "media_type": media_type, "status": "draft",
+            "created_at": now, "updated_at": now,
+        }
+        insort(self._user_posts.setdefault(user_id, []), (now, post_id))
+        if media:
+            self._post_media[post_id] = [tuple(item) for item in media]
+        return post_id
+
+    def get_posts(self, user_id, status=None):
+        rows = (self._posts[post_id] for _, post_id in reversed(self._user_posts.get(user_id, [])))
+        return [dict(row) for row in rows if not status or row["status"] == status]
+
+    def get_posts_page(self, user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+        row = self._posts.get(cursor)
+        cursor_key = (row["created_at"], row["id"]) if row else None
+        ids, has_prev, has_next = _page(self._user_posts.get(user_id, []), cursor_key,
+                                        cursor, direction, limit, descending=True)
+        rows = []
+        for post_id in ids:
+            post = self._posts[post_id]
+            content = post["content"][:40] if post["content"] is not None else None
+            rows.append({"id": post_id, "title": post["title"], "content": content})
+        return rows, has_prev, has_next
+
+    def get_post(self, post_id):
+        row = self._posts.get(post_id)
+        return dict(row) if row else None
+
+    def get_post_media(self, post_ids):
+        return {i: list(self._post_media[i]) for i in post_ids if i in self._post_media}
+
+    def delete_post(self, post_id, user_id):
+        row = self._posts.get(post_id)
+        if row and row["user_id"] == user_id:
+            del self._posts[post_id]
+            _discard(self._user_posts[user_id], (row["created_at"], post_id))
+            self._delete_orphaned_media(post_id)
+
+    def _delete_orphaned_media(self, post_id):
+        # Kept while the post exists or a pending schedule still sends from it
+        if post_id in self._post_media and post_id not in self._posts and not any(
+                self._sched[i]["post_id"] == post_id for _, i in self._pending):
+            del self._post_media[post_id]
+
+    # ── Scheduled Posts ──────────────────────────────────────────────────────
+
+    def schedule_post(self, user_id, channel_id, channel_name, scheduled_at, content,
+                      media_file_id=None, media_type=None, post_id=None):
+        sched_id = next(self._ids["scheduled_posts"])
+        self._sched[sched_id] = {
+            "id": sched_id, "user_id": user_id, "post_id": post_id, "channel_id": _text(channel_id),
+            "channel_name": channel_name,
+            "scheduled_time": time.strftime("%Y-%m-%d %H:%M", time.gmtime(scheduled_at)),
+            "content": content, "media_file_id": media_file_id, "media_type": media_type,
+            "status": "pending", "created_at": _stamp(), "scheduled_at": scheduled_at,
+            "leased_by": None, "lease_until": None, "attempts": 0, "last_error": None,
+            "requested_at": scheduled_at,
+        }
+        insort(self._pending, (scheduled_at, sched_id))
+        insort(self._user_pending.setdefault(user_id, []), (scheduled_at, sched_id))
+        return sched_id
+
+    def get_scheduled_posts(self, user_id):
+        return [dict(self._sched[i]) for _, i in self._user_pending.get(user_id, [])]
+
+    def get_scheduled_page(self, user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+        row = self._sched.get(cursor)
+        cursor_key = (row["scheduled_at"], row["id"]) if row else None
+        ids, has_prev, has_next = _page(self._user_pending.get(user_id, []), cursor_key,
+                                        cursor, direction, limit, descending=False)
+        rows = [
+            {key: self._sched[i][key] for key in ("id", "scheduled_time", "channel_id", "channel_name")}
+            for i in ids
+        ]
+        return rows, has_prev, has_next
+
+    def get_scheduled(self, sched_id):
+        row = self._sched.get(sched_id)
+        return dict(row) if row else None
+
+    def get_pending_scheduled(self):
+        return [dict(self._sched[i]) for _, i in self._pending]
+
+    def get_due_scheduled(self, now, limit=100):
+        due = itertools.takewhile(lambda job: job[0] <= now, self._pending)
+        return [dict(self._sched[i]) for _, i in itertools.islice(due, limit)]
+
+    def count_due_scheduled(self, now):
+        return bisect_right(self._pending, (now, float("inf")))
+
+    def get_upcoming_scheduled(self, limit):
+        return [{"id": i, "wake_at": max(at, self._sched[i]["lease_until"] or 0)}
+                for at, i in self._pending[:limit]]
+
+    def claim_due_scheduled(self, worker, now, lease_seconds, limit=100):
+        claimed = []
+        for at, sched_id in self._pending:
+            if at > now or len(claimed) == limit:
+                break
+            row = self._sched[sched_id]
+            if row["lease_until"] is None or row["lease_until"] <= now:
+                row["leased_by"], row["lease_until"] = worker, now + lease_seconds
+                claimed.append(dict(row))
+        return claimed
+
+    def retry_scheduled(self, sched_id, retry_at, error, counted=True):
+        row = self._sched.get(sched_id)
+        if row is None or row["status"] != "pending":
+            return
+        old, new = (row["scheduled_at"], sched_id), (retry_at, sched_id)
+        for keys in (self._pending, self._user_pending[row["user_id"]]):
+            _discard(keys, old)
+            insort(keys, new)
+        row.update(scheduled_at=retry_at, attempts=row["attempts"] + int(counted),
+                   last_error=error, leased_by=None, lease_until=None)
+
+    def retry_scheduled_many(self, retries):
+        for retry in retries:
+            self.retry_scheduled(*retry)
+
+    def mark_scheduled_sent(self, sched_id):
+        self._set_status(sched_id, "sent")
+
+    def mark_scheduled_failed(self, sched_id):
+        self._set_status(sched_id, "failed")
+
+    def mark_scheduled_many(self, outcomes):
+        for sched_id, status in outcomes:
+            self._set_status(sched_id, status)
+
+    def delete_scheduled(self, sched_id, user_id):
+        row = self._sched.get(sched_id)
+        if not row or row["user_id"] != user_id or row["status"] != "pending":
+            return False
+        self._set_status(sched_id, None)
+        del self._sched[sched_id]
+        return True
+
+    def _set_status(self, sched_id, status):
+        row = self._sched.get(sched_id)
+        if row is None:
+            return
+        settled = row["status"] == "pending"
+        if settled:
+            key = (row["scheduled_at"], sched_id)
+            _discard(self._pending, key)
+            _discard(self._user_pending[row["user_id"]], key)
+        row["status"] = status
+        if settled:
+            self._delete_orphaned_media(row["post_id"])
+
+    # ── Delivery Outbox ──────────────────────────────────────────────────────
+
+    def queue_deliveries(self, jobs):
+        now = int(time.time())
+        job_ids = []
+        for kind, user_id, post_id, sched_id, channel_id in jobs:
+            job_id = next(self._ids["deliveries"])  # spent even when the upsert hits a conflict
+            if sched_id is not None and sched_id in self._sched_jobs:
+                job_ids.append(self._sched_jobs[sched_id])
+                continue
+            self._deliveries[job_id] = {
+                "id": job_id, "kind": kind, "user_id": user_id, "post_id": post_id,
+                "sched_id": sched_id, "channel_id": _text(channel_id), "state": "queued",
+                "message_id": None, "error": None, "updated_at": now,
+            }
+            if sched_id is not None:
+                self._sched_jobs[sched_id] = job_id
+            job_ids.append(job_id)
+        return job_ids
+
+    def start_deliveries(self, job_ids):
+        now = int(time.time())
+        before = {job_id: self._deliveries[job_id]["state"]
+                  for job_id in job_ids if job_id in self._deliveries}
+        for job_id, state in before.items():
+            if state == "queued":
+                self._deliveries[job_id].update(state="in_flight", updated_at=now)
+        return before
+
+    def finish_deliveries(self, outcomes):
+        now = int(time.time())
+        for job_id, state, message_id, error in outcomes:
+            job = self._deliveries.get(job_id)
+            if job is not None:
+                job.update(state=state, message_id=message_id, error=error, updated_at=now)
+
+    def recover_deliveries(self, stale_before):
+        # A scan: recovery runs every few minutes, not per update
+        now = int(time.time())
+        interrupted, queued = [], []
+        for job in self._deliveries.values():
+            if job["kind"] == "scheduled" or job["updated_at"] >= stale_before:
+                continue
+            if job["state"] == "in_flight":
+                job.update(state="failed", error="interrupted", updated_at=now)
+                interrupted.append(dict(job))
+            elif job["state"] == "queued":
+                queued.append(dict(job))
+        queued.sort(key=lambda job: (job["updated_at"], job["id"]))
+        return interrupted, queued
+
+    def prune_deliveries(self, cutoff, limit):
+        old = sorted((job["state"], job["updated_at"], job_id)
+                     for job_id, job in self._deliveries.items()
+                     if job["state"] in ("sent", "failed") and job["updated_at"] < cutoff)
+        old = [job_id for _, _, job_id in old[:limit]]
+        for job_id in old:
+            job = self._deliveries.pop(job_id)
+            self._sched_jobs.pop(job["sched_id"], None)
+        return len(old)
+
+    # ── Event Log ────────────────────────────────────────────────────────────
+
+    def log_event(self, user_id, event_type, description, channel_id=None, post_id=None):
+        event_id = next(self._ids["event_log"])
+        self._events[event_id] = {
+            "id": event_id, "user_id": user_id, "event_type": event_type,
+            "description": description, "channel_id": _text(channel_id), "post_id": post_id,
+            "created_at": _stamp(),
+        }
+        self._event_order.append(event_id)
+        self._user_events.setdefault(user_id, {})[event_id] = None
+
+    def get_events(self, user_id, limit=30):
+        ids = reversed(self._user_events.get(user_id, {}))
+        return [dict(self._events[i]) for i in itertools.islice(ids, limit)]
+
+    def clear_events(self, user_id):
+        for event_id in self._user_events.pop(user_id, {}):
+            del self._events[event_id]
+
+    def prune_events(self, cutoff, limit):
+        removed = 0
+        while self._event_order and removed < limit:
+            event = self._events.get(self._event_order[0])
+            if event is not None and event["created_at"] >= cutoff:
+                break
+            self._event_order.popleft()
+            if event is None:
+                continue
+            key = (event["user_id"], event["created_at"][:10], event["event_type"])
+            self._event_daily[key] = self._event_daily.get(key, 0) + 1
+            del self._events[event["id"]]
+            del self._user_events[event["user_id"]][event["id"]]
+            removed += 1
+        return removed
+
+    # ── Callback Tokens ──────────────────────────────────────────────────────
+
+    def save_callback_token(self, token, payload, created_at):
+        self._tokens[token] = {"payload": payload, "created_at": created_at}
+        heapq.heappush(self._token_ages, (created_at, token))
+
+    def get_callback_token(self, token):
+        row = self._tokens.get(token)
+        return dict(row) if row else None
+
+    def prune_callback_tokens(self, cutoff, limit):
+        removed = 0
+        while self._token_ages and self._token_ages[0][0] < cutoff and removed < limit:
+            created_at, token = heapq.heappop(self._token_ages)
+            row = self._tokens.get(token)
+            if row is not None and row["created_at"] == created_at:
+                del self._tokens[token]
+                removed += 1
+        return removed
+
+    # ── User State ───────────────────────────────────────────────────────────
+
+    def get_user_state(self, user_id):
+        return self._user_state.get(user_id)
+
+    def save_user_states(self, states):
+        for user_id, data in states:
+            if data is None:
+                self._user_state.pop(user_id, None)
+            else:
+                self._user_state[user_id] = data
+
+    # ── Maintenance ──────────────────────────────────────────────────────────
+
+    def compact_db(self, pages):
+        return 0
+
+    # ── Settings ─────────────────────────────────────────────────────────────
+
+    def get_settings(self, user_id):
+        row = self._settings.setdefault(user_id, {
+            "user_id": user_id, "timezone": "UTC", "default_channel": None, "notifications": 1,
+        })
+        return dict(row)
+
+    def update_setting(self, user_id, key, value):
+        self.get_settings(user_id)
+        row = self._settings[user_id]
+        if key not in row:
+            raise KeyError(f"No such setting: {key}")
+        row[key] = _text(value) if key == "default_channel" else value
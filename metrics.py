@@ -0,0 +1,191 @@
+"""Prometheus metrics for handlers, DB calls, Bot API calls and the scheduler.
+
+Metrics are kept in memory and served as Prometheus text on
+http://METRICS_LISTEN:METRICS_PORT/metrics. Updates are cheap (a lock and a
+bisect), and safe from the DB worker threads as well as the event loop.
+"""
+import asyncio
+import bisect
+import threading
+import time
+
+from telegram.error import NetworkError
+from telegram.request import HTTPXRequest
+
+from config import METRICS_LISTEN, METRICS_PORT
+
+LATENCY_BUCKETS  = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENESS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name   = name
+        self.help   = help
+        self.labels = labels
+        self._lock  = threading.Lock()
+        self._values = {}       # label values tuple -> value
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = [*zip(self.labels, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._snapshot().items()):
+            lines += self._sample_lines(key, value)
+        return lines
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def _sample_lines(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value read from `read()` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, read):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {self.read()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def _sample_lines(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {counts[-1]}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+    def _snapshot(self):
+        with self._lock:
+            return {key: list(counts) for key, counts in self._values.items()}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# ── Metrics ──────────────────────────────────────────────────────────────────
+
+HANDLER_SECONDS = Histogram(
+    "telebot_handler_seconds", "Time spent handling an update, by route key", ("route",))
+HANDLER_ERRORS = Counter(
+    "telebot_handler_errors_total", "Updates whose handler raised, by route key", ("route",))
+DB_SECONDS = Histogram(
+    "telebot_db_seconds", "Time spent running a storage backend function", ("function",))
+API_SECONDS = Histogram(
+    "telebot_bot_api_seconds", "Bot API request latency, by method", ("method",))
+API_ERRORS = Counter(
+    "telebot_bot_api_errors_total", "Failed Bot API requests, by method and HTTP status",
+    ("method", "status"))
+LATENESS_SECONDS = Histogram(
+    "telebot_scheduled_lateness_seconds", "Scheduled posts: actual send time minus scheduled time",
+    buckets=LATENESS_BUCKETS)
+SCHEDULED_RETRIES = Counter(
+    "telebot_scheduled_retries_total", "Scheduled sends put off for a retry, by reason (flood, network)",
+    ("reason",))
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ── Bot API instrumentation ──────────────────────────────────────────────────
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and failures of every Bot API call."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except NetworkError:
+            API_ERRORS.inc(method=api_method, status="network")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if status >= 400:
+            API_ERRORS.inc(method=api_method, status=status)
+        return status, payload
+
+
+# ── Endpoint ─────────────────────────────────────────────────────────────────
+
+async def serve():
+    """Start the /metrics endpoint; return the server, or None if METRICS_PORT is 0."""
+    if not METRICS_PORT:
+        return None
+    return await asyncio.start_server(_handle, METRICS_LISTEN, METRICS_PORT)
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = (await reader.readuntil(b"\r\n\r\n")).split(b"\r\n", 1)[0].decode("latin-1")
+        path = request_line.split(" ")[1] if " " in request_line else ""
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
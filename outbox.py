@@ -0,0 +1,107 @@
+"""Persistent outbox: a job row for every post the bot sends to a channel.
+
+A job moves queued -> in_flight -> sent (keeping the channel message id) or
+failed; a scheduled send that will be retried goes back to queued. The
+move to in_flight is committed before the send starts, so no job is ever
+sent twice, even across a crash. After one, recover() sends the jobs still
+queued and fails those left in_flight, which may or may not have gone out.
+Transitions are written in bulk, one transaction per batch of sends.
+"""
+import asyncio
+import logging
+import time
+
+import async_db as db
+from config import OUTBOX_STALE_SECONDS
+from dispatch import send_post
+
+logger = logging.getLogger(__name__)
+
+# Event logged when a recovered job is sent, as its handler would have
+SENT_EVENTS = {"publish": "post_published", "multipost": "multipost_sent"}
+
+
+async def queue(kind, user_id, post_id, channel_ids):
+    """Add a queued job per channel for sending post_id; return the job ids."""
+    return await db.queue_deliveries([(kind, user_id, post_id, None, channel_id)
+                                      for channel_id in channel_ids])
+
+
+async def send(bot, post, media, jobs):
+    """Send the post to each (job_id, channel_id) at once and record the outcomes.
+
+    Returns {job_id: error}, None for a sent job. Jobs that were no longer
+    queued (another process got to them first) are skipped and left out.
+    """
+    before = await db.start_deliveries([job_id for job_id, _ in jobs])
+    started = [(job_id, channel_id) for job_id, channel_id in jobs if before.get(job_id) == "queued"]
+    results = await asyncio.gather(*(
+        _send_one(bot, post, media, channel_id) for _, channel_id in started
+    ))
+    await db.finish_deliveries([
+        (job_id, "failed" if error else "sent", message_id, error)
+        for (job_id, _), (message_id, error) in zip(started, results)
+    ])
+    return {job_id: error for (job_id, _), (_, error) in zip(started, results)}
+
+
+async def _send_one(bot, post, media, channel_id):
+    try:
+        sent = await send_post(bot, channel_id, post["content"],
+                               post["media_file_id"], post["media_type"], media)
+    except Exception as e:
+        return None, str(e)
+    return message_id(sent), None
+
+
+def message_id(sent):
+    """The channel message id from what send_post returned (an album's first item)."""
+    return sent[0].message_id if isinstance(sent, (list, tuple)) else sent.message_id
+
+
+async def recover(bot):
+    """Settle publish/multipost jobs a dead process left behind."""
+    interrupted, queued = await db.recover_deliveries(int(time.time()) - OUTBOX_STALE_SECONDS)
+    for job in interrupted:
+        await db.log_event(job["user_id"], "delivery_interrupted",
+                           f"Sending post #{job['post_id']} to {job['channel_id']} was interrupted; "
+                           f"it may or may not have gone out",
+                           channel_id=job["channel_id"], post_id=job["post_id"])
+
+    by_post = {}
+    for job in queued:
+        by_post.setdefault(job["post_id"], []).append(job)
+    for post_id, jobs in by_post.items():
+        post = await db.get_post(post_id)
+        if post is None:
+            await db.finish_deliveries([(job["id"], "failed", None, "post deleted") for job in jobs])
+            continue
+        media = None
+        if post["media_type"] == "album":
+            media = (await db.get_post_media([post_id])).get(post_id)
+        errors = await send(bot, post, media, [(job["id"], job["channel_id"]) for job in jobs])
+        for job in jobs:
+            if job["id"] not in errors:
+                continue
+            error = errors[job["id"]]
+            if error is None:
+                await db.log_event(job["user_id"], SENT_EVENTS[job["kind"]],
+                                   f"Post #{post_id} sent to {job['channel_id']} after a restart",
+                                   channel_id=job["channel_id"], post_id=post_id)
+            else:
+                await db.log_event(job["user_id"], "delivery_failed",
+                                   f"Post #{post_id} to {job['channel_id']} failed: {error}",
+                                   channel_id=job["channel_id"], post_id=post_id)
+
+    if interrupted or queued:
+        logger.info(f"Outbox recovery: {len(interrupted)} interrupted, {len(queued)} resent")
+
+
+async def run_recovery(app):
+    """Background task: recover() at startup and every OUTBOX_STALE_SECONDS."""
+    while True:
+        try:
+            await recover(app.bot)
+        except Exception as e:
+            logger.error(f"Outbox recovery failed: {e}")
+        await asyncio.sleep(OUTBOX_STALE_SECONDS)
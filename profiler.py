@@ -0,0 +1,65 @@
+"""Opt-in slow-operation tracing and cProfile captures.
+
+The Router and the async_db wrappers already time every handler and DB
+call for metrics. While `tracing` is on they also pass the timing to
+trace(), which logs anything slower than PROFILE_SLOW_MS. While it is off
+the only cost is checking the flag.
+
+capture() profiles the event-loop thread for a window and writes a
+.pstats file (open it with `python -m pstats` or snakeviz) plus a text
+summary into PROFILE_DIR.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+
+from config import PROFILE, PROFILE_SLOW_MS, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+tracing   = PROFILE
+capturing = False
+
+
+def trace(kind, name, elapsed, detail=""):
+    if elapsed * 1000 >= PROFILE_SLOW_MS:
+        logger.warning(f"Slow {kind} {name}: {elapsed * 1000:.0f} ms {detail}".rstrip())
+
+
+async def capture(seconds, top=10):
+    """Profile the event loop for `seconds`; return (pstats path, top functions by cumulative time)."""
+    global capturing
+    if capturing:
+        raise RuntimeError("A profile capture is already running")
+    capturing = True
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+    finally:
+        capturing = False
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S.pstats"))
+    profile.dump_stats(path)
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profile, stream=summary).sort_stats("cumulative")
+    stats.print_stats(50)
+    with open(path.removesuffix(".pstats") + ".txt", "w") as f:
+        f.write(summary.getvalue())
+
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top]
+    lines = [
+        f"{cumtime * 1000:8.0f} ms  {name} ({os.path.basename(filename)}:{line})"
+        for (filename, line, name), (_, _, _, cumtime, _) in rows
+    ]
+    logger.info(f"Profile of {seconds} s written to {path}")
+    return path, lines
@@ -0,0 +1,142 @@
+import time
+
+from telegram import Update
+from telegram.ext import BaseHandler, ConversationHandler
+
+import metrics
+import profiler
+import user_state
+
+END = ConversationHandler.END
+
+# Keys for plain (non-command) messages in a flow state
+TEXT  = "text"
+MEDIA = "media"
+
+# user_data key holding the user's current (flow name, state)
+FLOW_KEY = "flow"
+
+
+async def end_flow(update, ctx):
+    return END
+
+
+class Flow:
+    """A multi-step conversation, laid out like a ConversationHandler.
+
+    entry_points, each state and fallbacks map a route key to a callback:
+    a callback-data prefix (the text before the first ":"), a command such
+    as "/skip", or TEXT / MEDIA for plain messages. Callbacks return the
+    next state, END, or None to stay in the current state.
+    """
+
+    def __init__(self, name, entry_points, states, fallbacks=None):
+        self.name         = name
+        self.entry_points = entry_points
+        self.states       = states
+        self.fallbacks    = fallbacks or {}
+
+
+class Router(BaseHandler):
+    """The app's only handler: routes every callback query, command and message.
+
+    The route key is parsed from the update once and resolved with dict
+    lookups, first against the user's current flow state, then flow entry
+    points, then global routes, instead of PTB testing a regex per handler
+    and every ConversationHandler in turn. Flow state lives in
+    ctx.user_data[FLOW_KEY]; user_state loads a user's saved user_data
+    before their first update and persists it afterwards.
+    """
+
+    def __init__(self, callbacks, commands, flows):
+        # PTB calls handle_update, overridden below, rather than the callback;
+        # route() does the same work if anything does call it.
+        super().__init__(self.route)
+        self.globals = {**callbacks, **commands}
+        self.flows   = {flow.name: flow for flow in flows}
+        self.entries = {
+            key: (flow, callback)
+            for flow in flows for key, callback in flow.entry_points.items()
+        }
+        self.keys = set(self.globals) | set(self.entries)
+        for flow in flows:
+            self.keys.update(flow.fallbacks)
+            for routes in flow.states.values():
+                self.keys.update(routes)
+
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        key = route_key(update)
+        return key if key in self.keys else None
+
+    def resolve(self, key, user_data):
+        """(flow, callback) for a route key given the user's flow state;
+        flow is None for a global route, callback None if nothing matches."""
+        flow_name, state = user_data.get(FLOW_KEY, (None, None))
+        flow = self.flows.get(flow_name)
+
+        callback = None
+        if flow is not None:
+            callback = flow.states.get(state, {}).get(key) or flow.fallbacks.get(key)
+        if callback is None and key in self.entries:
+            flow, callback = self.entries[key]
+        if callback is None:
+            flow, callback = None, self.globals.get(key)
+        return flow, callback
+
+    async def route(self, update, context):
+        return await self.handle_update(update, context.application,
+                                        self.check_update(update), context)
+
+    async def handle_update(self, update, application, check_result, context):
+        user = update.effective_user
+        user_data = context.user_data
+        if user is not None:
+            await user_state.load(user.id, user_data)
+        flow, callback = self.resolve(check_result, user_data)
+        if callback is None:
+            return None
+
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(route=check_result)
+            raise
+        finally:
+            if user is not None:
+                user_state.touch(user.id)
+            elapsed = time.perf_counter() - started
+            metrics.HANDLER_SECONDS.observe(elapsed, route=check_result)
+            if profiler.tracing:
+                profiler.trace("handler", check_result, elapsed, _trace_detail(update))
+
+        if result == END:
+            user_data.pop(FLOW_KEY, None)
+        elif result is not None and flow is not None:
+            user_data[FLOW_KEY] = (flow.name, result)
+        return result
+
+
+def _trace_detail(update):
+    # Callback data and user id only; message text may be private
+    if update.callback_query:
+        return f"data={update.callback_query.data!r} user={update.effective_user.id}"
+    return f"user={update.effective_user.id}" if update.effective_user else ""
+
+
+def route_key(update):
+    """The callback-data prefix, "/command", TEXT or MEDIA an update routes on."""
+    if update.callback_query:
+        return (update.callback_query.data or "").partition(":")[0]
+    msg = update.message
+    if msg is None:
+        return None
+    if msg.photo or msg.video or msg.document:
+        return MEDIA
+    if msg.text and msg.text.startswith("/"):
+        return msg.text.split(maxsplit=1)[0].partition("@")[0]
+    if msg.text:
+        return TEXT
+    return None
@@ -1,71 +1,295 @@
 import asyncio
+import heapq
 import logging
-from datetime import datetime, timezone
+import random
+import time
 
-import database as db
+import httpx
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+import async_db as db
+import metrics
+import outbox
+from config import (SCHEDULER_BATCH_SIZE, SCHEDULER_CONCURRENCY, SCHEDULER_WINDOW,
+                    SCHEDULER_WORKER_ID, SCHEDULER_LEASE_SECONDS, SCHEDULER_RESYNC_INTERVAL,
+                    SCHEDULER_MAX_ATTEMPTS, SCHEDULER_RETRY_BASE, SCHEDULER_RETRY_MAX)
+from dispatch import send_post
 
 logger = logging.getLogger(__name__)
 
+# Wake-up queue of (wake_at, sched_id) for the next SCHEDULER_WINDOW pending
+# jobs. It only decides when to wake; due rows are always claimed from the
+# DB, so the queue never has to hold every pending job, and other processes
+# sharing the DB never send the same row. A row leased to someone else wakes
+# us when the lease runs out, not while it is still held.
+_jobs = []
+_wakeup = asyncio.Event()
+_next_resync = 0
+
+# Pending rows already due at the last resync, claimed or not. Unlike the
+# wake-up queue, which never holds more than SCHEDULER_WINDOW jobs, this
+# keeps growing while sends fall behind.
+_due_backlog = 0
+
+# Source of "now" in epoch seconds; tests swap in a fake clock.
+clock = time.time
+
+metrics.Gauge("telebot_scheduler_queue_depth",
+              f"Pending jobs in the scheduler's wake-up queue (at most {SCHEDULER_WINDOW})",
+              lambda: len(_jobs))
+metrics.Gauge("telebot_scheduler_due_backlog",
+              "Pending scheduled posts already due, counted at each resync",
+              lambda: _due_backlog)
+
+
+def add_job(sched_id, scheduled_at):
+    heapq.heappush(_jobs, (scheduled_at, sched_id))
+    _wakeup.set()
+
+
+def remove_job(sched_id):
+    _jobs[:] = [job for job in _jobs if job[1] != sched_id]
+    heapq.heapify(_jobs)
+    _wakeup.set()
+
 
 async def run_scheduler(app):
-    """Background task: every 30 s check for due scheduled posts and send them."""
+    """Background task: sleep until the next job is due, then send everything due."""
+    global _next_resync
     while True:
         try:
-            now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M")
-            pending = db.get_pending_scheduled()
+            if clock() >= _next_resync:
+                await _load_upcoming()
+
+            await _sleep_until_next_job()
+
+            now = int(clock())
+            claimed = 0
+            while True:
+                due = await db.claim_due_scheduled(SCHEDULER_WORKER_ID, now,
+                                                   SCHEDULER_LEASE_SECONDS, SCHEDULER_BATCH_SIZE)
+                claimed += len(due)
+                await _deliver(app, due)
+                if len(due) < SCHEDULER_BATCH_SIZE:
+                    break
+
+            while _jobs and _jobs[0][0] <= now:
+                heapq.heappop(_jobs)
 
-            for row in pending:
-                sched_time = row["scheduled_time"]  # stored as "YYYY-MM-DD HH:MM"
-                if sched_time <= now:
-                    await _send_scheduled(app, row)
+            # Sent the whole window: more jobs may be waiting beyond it. When
+            # nothing could be claimed, the queue waits for the next resync
+            # (or add_job) instead of reloading the same rows at once.
+            if claimed and not _jobs:
+                _next_resync = 0
 
         except Exception as e:
             logger.error(f"Scheduler error: {e}")
+            await asyncio.sleep(1)
+
+
+async def _deliver(app, rows):
+    """Send claimed rows through the outbox, at most SCHEDULER_CONCURRENCY at once.
+
+    Every row's outbox job is started in one transaction before anything is
+    sent. Afterwards the outcomes, then the rows' new statuses and retry
+    times, are written in bulk: a few commits per batch, not one per row.
+    A row whose job was not queued was being sent when a process died; it
+    is settled from the job instead of being sent again.
 
-        await asyncio.sleep(30)
+    Rows for the same channel go out one after another, in scheduled order;
+    different channels proceed in parallel. Once a channel hits a flood wait,
+    its remaining rows are put off until the wait is over instead of being sent.
+    """
+    if not rows:
+        return
+    job_ids = await db.queue_deliveries([
+        ("scheduled", row["user_id"], row["post_id"], row["id"], row["channel_id"]) for row in rows
+    ])
+    jobs   = {row["id"]: job_id for row, job_id in zip(rows, job_ids)}
+    before = await db.start_deliveries(job_ids)
+
+    outcomes   = {}     # sched_id -> {"state", "message_id", "error", ...}
+    by_channel = {}
+    for row in rows:
+        state = before[jobs[row["id"]]]
+        if state == "queued":
+            by_channel.setdefault(row["channel_id"], []).append(row)
+        else:
+            outcomes[row["id"]] = _unsent_outcome(state, row)
+
+    # Items of every album in the batch, in one query
+    album_ids = {row["post_id"] for row in rows if row["media_type"] == "album"}
+    albums = await db.get_post_media(album_ids) if album_ids else {}
+    slots = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+
+    async def drain(channel_rows):
+        for i, row in enumerate(channel_rows):
+            async with slots:
+                outcome = await _send_scheduled(app, row, albums.get(row["post_id"]))
+            outcomes[row["id"]] = outcome
+            if outcome.get("flood"):
+                for later in channel_rows[i + 1:]:
+                    outcomes[later["id"]] = {"state": "queued", "retry_at": outcome["retry_at"],
+                                             "error": "flood wait on the channel", "counted": False}
+                return
+
+    await asyncio.gather(*(drain(channel_rows) for channel_rows in by_channel.values()))
+
+    await db.finish_deliveries([
+        (jobs[sched_id], outcome["state"], outcome.get("message_id"), outcome.get("error"))
+        for sched_id, outcome in outcomes.items() if outcome.get("record", True)
+    ])
+
+    retries = [(row["id"], outcomes[row["id"]]) for row in rows
+               if outcomes[row["id"]]["state"] == "queued"]
+    await db.retry_scheduled_many([
+        (sched_id, outcome["retry_at"], outcome["error"], outcome["counted"])
+        for sched_id, outcome in retries
+    ])
+    await db.mark_scheduled_many([
+        (sched_id, outcome["state"]) for sched_id, outcome in outcomes.items()
+        if outcome["state"] != "queued"
+    ])
+    for sched_id, outcome in retries:
+        add_job(sched_id, outcome["retry_at"])
+
+    async def report(row):
+        async with slots:
+            await _report(app, row, outcomes[row["id"]])
+
+    await asyncio.gather(*(report(row) for row in rows))
+
+
+async def _load_upcoming():
+    global _next_resync, _due_backlog
+    _due_backlog = await db.count_due_scheduled(int(clock()))
+    rows = await db.get_upcoming_scheduled(SCHEDULER_WINDOW)
+    _jobs[:] = [(row["wake_at"], row["id"]) for row in rows]
+    heapq.heapify(_jobs)
+    _next_resync = clock() + SCHEDULER_RESYNC_INTERVAL
+
+
+async def _sleep_until_next_job():
+    """Return once the earliest job or the next resync is due, or early if
+    add_job / remove_job changed the queue."""
+    _wakeup.clear()
+    wake_at = min(_jobs[0][0], _next_resync) if _jobs else _next_resync
+    timeout = wake_at - clock()
+    if timeout <= 0:
+        return
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
 
 
-async def _send_scheduled(app, row):
+async def _send_scheduled(app, row, media=None):
+    """Send one claimed row and return its outcome for the outbox."""
+    try:
+        sent = await send_post(app.bot, row["channel_id"], row["content"] or "",
+                               row["media_file_id"], row["media_type"], media)
+    except Exception as e:
+        if _maybe_sent(e):
+            # Sending again could post it twice; the owner is told instead
+            return {"state": "failed", "error": f"{e}; it may or may not have gone out"}
+        delay = _retry_delay(e, row["attempts"])
+        if delay is None:
+            return {"state": "failed", "error": str(e)}
+        flood = isinstance(e, RetryAfter)
+        metrics.SCHEDULED_RETRIES.inc(reason="flood" if flood else "network")
+        # Flood waits don't count towards SCHEDULER_MAX_ATTEMPTS or the backoff
+        return {"state": "queued", "error": str(e), "retry_at": int(clock() + delay),
+                "delay": delay, "counted": not flood, "flood": flood}
+
+    # From the time the user asked for; retries have moved scheduled_at since
+    metrics.LATENESS_SECONDS.observe(clock() - row["requested_at"])
+    return {"state": "sent", "message_id": outbox.message_id(sent)}
+
+
+def _unsent_outcome(state, row):
+    """The outcome of a claimed row whose outbox job had already been started."""
+    if state == "sent":
+        return {"state": "sent", "record": False}
+    if state == "failed":
+        return {"state": "failed", "error": row["last_error"] or "failed", "record": False}
+    # in_flight: the send may or may not have gone out, so it is not repeated
+    return {"state": "failed", "error": "interrupted while sending; it may or may not have gone out"}
+
+
+async def _report(app, row, outcome):
+    """Log the settled row's outcome and tell the user."""
     sched_id = row["id"]
     user_id  = row["user_id"]
     chan_id  = row["channel_id"]
-    content  = row["content"] or ""
-    mfid     = row["media_file_id"]
-    mtype    = row["media_type"]
 
-    try:
-        if mfid and mtype == "photo":
-            await app.bot.send_photo(chat_id=chan_id, photo=mfid, caption=content)
-        elif mfid and mtype == "video":
-            await app.bot.send_video(chat_id=chan_id, video=mfid, caption=content)
-        elif mfid and mtype == "document":
-            await app.bot.send_document(chat_id=chan_id, document=mfid, caption=content)
-        else:
-            await app.bot.send_message(chat_id=chan_id, text=content)
+    if outcome["state"] == "queued":
+        if "delay" in outcome:     # a send was tried, not just put off
+            await db.log_event(user_id, "scheduled_retry",
+                               f"Send to {row['channel_name'] or chan_id} failed ({outcome['error']}), "
+                               f"retrying in {outcome['delay']:.0f} s",
+                               channel_id=chan_id, post_id=row["post_id"])
+        return
 
-        db.mark_scheduled_sent(sched_id)
-        db.log_event(user_id, "scheduled_sent",
-                     f"Scheduled post sent to {row['channel_name'] or chan_id}",
-                     channel_id=chan_id, post_id=row["post_id"])
+    if outcome["state"] == "failed":
+        await _fail(app, row, outcome["error"])
+        return
 
-        # Notify user
+    await db.log_event(user_id, "scheduled_sent",
+                       f"Scheduled post sent to {row['channel_name'] or chan_id}",
+                       channel_id=chan_id, post_id=row["post_id"])
+
+    # Notify user
+    try:
         await app.bot.send_message(
             chat_id=user_id,
             text=f"✅ Scheduled post sent to <b>{row['channel_name'] or chan_id}</b>",
             parse_mode="HTML"
         )
-
     except Exception as e:
-        db.mark_scheduled_failed(sched_id)
-        db.log_event(user_id, "scheduled_failed",
-                     f"Failed to send scheduled post: {e}",
-                     channel_id=chan_id)
-        logger.error(f"Failed to send scheduled post {sched_id}: {e}")
-        try:
-            await app.bot.send_message(
-                chat_id=user_id,
-                text=f"❌ Failed to send scheduled post to <b>{row['channel_name'] or chan_id}</b>\n<code>{e}</code>",
-                parse_mode="HTML"
-            )
-        except Exception:
-            pass
+        logger.warning(f"Could not notify {user_id} of scheduled post {sched_id}: {e}")
+
+
+def _maybe_sent(error):
+    """True if the request may have reached Telegram before `error`: a timeout
+    or a broken connection after it was written. Only failures to connect
+    (or to get a pooled connection) are known to leave the post unsent."""
+    cause = error.__cause__
+    if isinstance(error, TimedOut):
+        return not isinstance(cause, (httpx.ConnectTimeout, httpx.PoolTimeout))
+    return (isinstance(error, NetworkError) and isinstance(cause, httpx.TransportError)
+            and not isinstance(cause, httpx.ConnectError))
+
+
+def _retry_delay(error, attempts):
+    """Seconds to wait before sending again after `error`, or None if the
+    error is final (bad request, bot removed from the chat, a bug) or the
+    attempts are used up."""
+    if isinstance(error, RetryAfter):
+        return error.retry_after + random.uniform(0, 1)
+    # BadRequest subclasses NetworkError but will fail the same way again
+    if not isinstance(error, NetworkError) or isinstance(error, BadRequest):
+        return None
+    if attempts + 1 >= SCHEDULER_MAX_ATTEMPTS:
+        return None
+    # Exponential backoff with "equal jitter": half fixed, half random
+    ceiling = min(SCHEDULER_RETRY_MAX, SCHEDULER_RETRY_BASE * 2 ** attempts)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+async def _fail(app, row, error):
+    sched_id = row["id"]
+    user_id  = row["user_id"]
+    chan_id  = row["channel_id"]
+
+    await db.log_event(user_id, "scheduled_failed",
+                       f"Failed to send scheduled post after {row['attempts'] + 1} attempt(s): {error}",
+                       channel_id=chan_id)
+    logger.error(f"Failed to send scheduled post {sched_id}: {error}")
+    try:
+        await app.bot.send_message(
+            chat_id=user_id,
+            text=f"❌ Failed to send scheduled post to <b>{row['channel_name'] or chan_id}</b>\n<code>{error}</code>",
+            parse_mode="HTML"
+        )
+    except Exception:
+        pass
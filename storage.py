@@ -0,0 +1,301 @@
+"""The storage interface the rest of the app talks to, and its backends.
+
+Storage lists every operation on channels, posts, scheduled posts, events,
+settings, callback tokens and user state. Rows come back as mappings
+(row["column"]). Two backends implement it:
+
+- SQLiteStorage: database.py, the default and the only one that persists
+- MemoryStorage (memory_storage.py): indexed dicts and sorted lists, for
+  tests, benchmarks and load tests
+
+open_storage() picks one by name (config.STORAGE_BACKEND). async_db wraps
+the chosen backend in coroutines.
+"""
+from abc import ABC, abstractmethod
+
+import database
+from config import PAGE_SIZE
+
+
+class Storage(ABC):
+    # True if calls block on I/O and should run on worker threads
+    blocking = False
+
+    # ── Lifecycle ────────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def init_db(self):
+        """Prepare the store (create or migrate the schema)."""
+
+    @abstractmethod
+    def close_db(self):
+        """Write out anything queued and release resources."""
+
+    @abstractmethod
+    def flush_writes(self):
+        """Write out queued log_event / save_callback_token rows now."""
+
+    # ── Channels ─────────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def add_channel(self, user_id, channel_id, channel_name):
+        """Add a channel for the user unless already there; return True unless it failed."""
+
+    @abstractmethod
+    def get_channels(self, user_id):
+        """The user's channels, most recently added first."""
+
+    @abstractmethod
+    def delete_channel(self, user_id, channel_id):
+        """Remove one of the user's channels."""
+
+    # ── Posts ────────────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def save_post(self, user_id, title, content, media_file_id=None, media_type=None, media=None):
+        """Store a draft post, with the (media_type, file_id) items of an album; return its id."""
+
+    @abstractmethod
+    def get_posts(self, user_id, status=None):
+        """The user's posts (optionally only those with `status`), newest first."""
+
+    @abstractmethod
+    def get_posts_page(self, user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+        """(rows, has_prev, has_next): a newest-first page of id, title and
+        the first 40 characters of content, before or after post `cursor`."""
+
+    @abstractmethod
+    def get_post(self, post_id):
+        """The post, or None."""
+
+    @abstractmethod
+    def get_post_media(self, post_ids):
+        """Album items of the given posts as {post_id: [(media_type, file_id), ...]}."""
+
+    @abstractmethod
+    def delete_post(self, post_id, user_id):
+        """Delete the post if the user owns it (album items stay while a pending
+        scheduled post still needs them)."""
+
+    # ── Scheduled Posts ──────────────────────────────────────────────────────
+
+    @abstractmethod
+    def schedule_post(self, user_id, channel_id, channel_name, scheduled_at, content,
+                      media_file_id=None, media_type=None, post_id=None):
+        """Store a pending scheduled post due at `scheduled_at` (epoch s); return its id."""
+
+    @abstractmethod
+    def get_scheduled_posts(self, user_id):
+        """The user's pending scheduled posts, soonest first."""
+
+    @abstractmethod
+    def get_scheduled_page(self, user_id, cursor=None, direction="next", limit=PAGE_SIZE):
+        """(rows, has_prev, has_next): a soonest-first page of the user's
+        pending schedules (id, scheduled_time, channel_id, channel_name)."""
+
+    @abstractmethod
+    def get_scheduled(self, sched_id):
+        """The scheduled post, or None."""
+
+    @abstractmethod
+    def get_pending_scheduled(self):
+        """Every pending scheduled post, soonest first."""
+
+    @abstractmethod
+    def get_due_scheduled(self, now, limit=100):
+        """Up to `limit` pending posts with scheduled_at <= now, soonest first."""
+
+    @abstractmethod
+    def count_due_scheduled(self, now):
+        """How many pending posts have scheduled_at <= now: the scheduler's backlog."""
+
+    @abstractmethod
+    def get_upcoming_scheduled(self, limit):
+        """(id, wake_at) of the next `limit` pending posts, wake_at being when
+        each can next be claimed (scheduled_at, or the end of its lease)."""
+
+    @abstractmethod
+    def claim_due_scheduled(self, worker, now, lease_seconds, limit=100):
+        """Lease up to `limit` due, unleased (or lease-expired) pending posts to
+        `worker` until now + lease_seconds; return them soonest first."""
+
+    @abstractmethod
+    def retry_scheduled(self, sched_id, retry_at, error, counted=True):
+        """Release the claimed pending post to be claimed again at `retry_at`,
+        recording `error` and (if `counted`) one more attempt towards the limit."""
+
+    @abstractmethod
+    def retry_scheduled_many(self, retries):
+        """retry_scheduled() for each (sched_id, retry_at, error, counted), all at once."""
+
+    @abstractmethod
+    def mark_scheduled_sent(self, sched_id):
+        """Set the scheduled post's status to sent."""
+
+    @abstractmethod
+    def mark_scheduled_failed(self, sched_id):
+        """Set the scheduled post's status to failed."""
+
+    @abstractmethod
+    def mark_scheduled_many(self, outcomes):
+        """Set the status of each (sched_id, "sent" | "failed") pair, all at once;
+        a deleted album post's items go with its last pending schedule."""
+
+    @abstractmethod
+    def delete_scheduled(self, sched_id, user_id):
+        """Delete the user's pending scheduled post; return whether one was deleted.
+        A deleted album post's items go with its last pending schedule."""
+
+    # ── Delivery Outbox ──────────────────────────────────────────────────────
+
+    @abstractmethod
+    def queue_deliveries(self, jobs):
+        """Add queued jobs from (kind, user_id, post_id, sched_id, channel_id)
+        tuples; return their ids (a scheduled post's existing job is reused)."""
+
+    @abstractmethod
+    def start_deliveries(self, job_ids):
+        """Move the queued ones to in_flight; return {job_id: state before}."""
+
+    @abstractmethod
+    def finish_deliveries(self, outcomes):
+        """Record (job_id, state, message_id, error) outcomes."""
+
+    @abstractmethod
+    def recover_deliveries(self, stale_before):
+        """Fail publish/multipost jobs left in_flight since before `stale_before`
+        (epoch s); return (those jobs, the queued ones equally stale, oldest first)."""
+
+    @abstractmethod
+    def prune_deliveries(self, cutoff, limit):
+        """Delete at most `limit` sent/failed jobs last updated before `cutoff`,
+        failed before sent and oldest first; return how many."""
+
+    # ── Event Log ────────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def log_event(self, user_id, event_type, description, channel_id=None, post_id=None):
+        """Record an event; cheap enough to call from the event loop."""
+
+    @abstractmethod
+    def get_events(self, user_id, limit=30):
+        """The user's latest `limit` events, newest first."""
+
+    @abstractmethod
+    def clear_events(self, user_id):
+        """Delete all of the user's events."""
+
+    @abstractmethod
+    def prune_events(self, cutoff, limit):
+        """Roll up into daily counts and delete at most `limit` events created
+        before `cutoff` ("YYYY-MM-DD HH:MM:SS"); return how many."""
+
+    # ── Callback Tokens ──────────────────────────────────────────────────────
+
+    @abstractmethod
+    def save_callback_token(self, token, payload, created_at):
+        """Store (or refresh) a callback token; cheap enough to call from the event loop."""
+
+    @abstractmethod
+    def get_callback_token(self, token):
+        """The token's row (payload, created_at), or None."""
+
+    @abstractmethod
+    def prune_callback_tokens(self, cutoff, limit):
+        """Delete at most `limit` tokens created before `cutoff` (epoch s); return how many."""
+
+    # ── User State ───────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def get_user_state(self, user_id):
+        """The user's saved state JSON, or None."""
+
+    @abstractmethod
+    def save_user_states(self, states):
+        """Save (user_id, json) pairs; a None json deletes the user's state."""
+
+    # ── Maintenance ──────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def compact_db(self, pages):
+        """Release up to `pages` free pages; return how many remain free."""
+
+    # ── Settings ─────────────────────────────────────────────────────────────
+
+    @abstractmethod
+    def get_settings(self, user_id):
+        """The user's settings row, created with defaults on first use."""
+
+    @abstractmethod
+    def update_setting(self, user_id, key, value):
+        """Set one settings column for the user."""
+
+
+class SQLiteStorage(Storage):
+    """Storage backed by the SQLite database in database.py."""
+
+    blocking = True
+
+    init_db                = staticmethod(database.init_db)
+    close_db               = staticmethod(database.close_db)
+    flush_writes           = staticmethod(database.flush_writes)
+
+    add_channel            = staticmethod(database.add_channel)
+    get_channels           = staticmethod(database.get_channels)
+    delete_channel         = staticmethod(database.delete_channel)
+
+    save_post              = staticmethod(database.save_post)
+    get_posts              = staticmethod(database.get_posts)
+    get_posts_page         = staticmethod(database.get_posts_page)
+    get_post               = staticmethod(database.get_post)
+    get_post_media         = staticmethod(database.get_post_media)
+    delete_post            = staticmethod(database.delete_post)
+
+    schedule_post          = staticmethod(database.schedule_post)
+    get_scheduled_posts    = staticmethod(database.get_scheduled_posts)
+    get_scheduled_page     = staticmethod(database.get_scheduled_page)
+    get_scheduled          = staticmethod(database.get_scheduled)
+    get_pending_scheduled  = staticmethod(database.get_pending_scheduled)
+    get_due_scheduled      = staticmethod(database.get_due_scheduled)
+    count_due_scheduled    = staticmethod(database.count_due_scheduled)
+    get_upcoming_scheduled = staticmethod(database.get_upcoming_scheduled)
+    claim_due_scheduled    = staticmethod(database.claim_due_scheduled)
+    retry_scheduled        = staticmethod(database.retry_scheduled)
+    retry_scheduled_many   = staticmethod(database.retry_scheduled_many)
+    mark_scheduled_sent    = staticmethod(database.mark_scheduled_sent)
+    mark_scheduled_failed  = staticmethod(database.mark_scheduled_failed)
+    mark_scheduled_many    = staticmethod(database.mark_scheduled_many)
+    delete_scheduled       = staticmethod(database.delete_scheduled)
+
+    queue_deliveries       = staticmethod(database.queue_deliveries)
+    start_deliveries       = staticmethod(database.start_deliveries)
+    finish_deliveries      = staticmethod(database.finish_deliveries)
+    recover_deliveries     = staticmethod(database.recover_deliveries)
+    prune_deliveries       = staticmethod(database.prune_deliveries)
+
+    log_event              = staticmethod(database.log_event)
+    get_events             = staticmethod(database.get_events)
+    clear_events           = staticmethod(database.clear_events)
+    prune_events           = staticmethod(database.prune_events)
+
+    save_callback_token    = staticmethod(database.save_callback_token)
+    get_callback_token     = staticmethod(database.get_callback_token)
+    prune_callback_tokens  = staticmethod(database.prune_callback_tokens)
+
+    get_user_state         = staticmethod(database.get_user_state)
+    save_user_states       = staticmethod(database.save_user_states)
+
+    compact_db             = staticmethod(database.compact_db)
+
+    get_settings           = staticmethod(database.get_settings)
+    update_setting         = staticmethod(database.update_setting)
+
+
+def open_storage(backend):
+    """Return the Storage named by `backend`: "sqlite" or "memory"."""
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend!r}; expected 'sqlite' or 'memory'")
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+
+# config reads the environment at import: point everything at throwaway
+# locations before any app module is imported. Code that goes through
+# async_db (the scheduler, handlers) runs on the memory backend; SQLite is
+# exercised directly through database.py / SQLiteStorage.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "telebot-test.db")
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import pytest
+
+import database
+from memory_storage import MemoryStorage
+from storage import open_storage
+
+
+@pytest.fixture
+def sqlite_path(tmp_path, monkeypatch):
+    """database.py pointed at a fresh file for one test."""
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "telebot.db"))
+    yield database.DATABASE_PATH
+    database.close_db()
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request):
+    """Each Storage backend in turn, initialised and empty."""
+    if request.param == "sqlite":
+        request.getfixturevalue("sqlite_path")
+    backend = open_storage(request.param)
+    backend.init_db()
+    yield backend
+    backend.close_db()
+
+
+@pytest.fixture
+def memory_db():
+    """async_db's (memory) backend, emptied for the test."""
+    import async_db
+    assert isinstance(async_db._store, MemoryStorage)
+    async_db._store.__init__()
+    return async_db
@@ -0,0 +1,62 @@
+"""Run the real scheduler for a while and print what it did as JSON.
+
+    python tests/scheduler_worker.py SECONDS [--leased-row]
+
+test_multiprocess.py starts several of these against one database, with
+DATABASE_PATH, STORAGE_BACKEND and SCHEDULER_WORKER_ID set per process.
+Channel sends go to a MemoryTransport, and claims and wake-up queue loads
+are counted, so a test can tell a scheduler that sleeps from one that spins.
+--leased-row first schedules a due post leased to another worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_db as db
+import scheduler
+from dispatch import MemoryTransport
+
+
+async def run(seconds, leased_row):
+    db.init_db()
+    if leased_row:
+        now = int(time.time())
+        await db.schedule_post(1, -100, "Channel", now - 10, "leased elsewhere")
+        await db.claim_due_scheduled("other-proc", now, 300, 1)
+
+    calls = {"claims": 0, "loads": 0}
+    claim, load = db.claim_due_scheduled, db.get_upcoming_scheduled
+
+    async def counted_claim(*args):
+        calls["claims"] += 1
+        return await claim(*args)
+
+    async def counted_load(*args):
+        calls["loads"] += 1
+        return await load(*args)
+
+    db.claim_due_scheduled, db.get_upcoming_scheduled = counted_claim, counted_load
+
+    bot  = MemoryTransport()
+    task = asyncio.create_task(scheduler.run_scheduler(SimpleNamespace(bot=bot)))
+    await asyncio.sleep(seconds)
+    task.cancel()
+
+    # Channel ids are negative; the rest are notifications to the user
+    sent = [payload["text"] for _, chat_id, payload in bot.sent if int(chat_id) < 0]
+    print(json.dumps({"sent": sent, **calls}))
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("seconds", type=float)
+    parser.add_argument("--leased-row", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.seconds, args.leased_row))
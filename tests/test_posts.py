@@ -0,0 +1,54 @@
+"""Collecting an album in the create-post flow."""
+import asyncio
+from types import SimpleNamespace
+
+from handlers.posts import ALBUM_MAX_ITEMS, WAIT_POST_MEDIA, recv_post_media
+
+
+class Chat:
+    """Stands in for the update and context of one user's messages."""
+
+    def __init__(self):
+        self.ctx = SimpleNamespace(user_data={"new_post": {"title": "T", "content": "C"}})
+        self.replies = []
+
+    def send(self, kind, file_id, group="album-1"):
+        async def reply_text(text, **kwargs):
+            self.replies.append(text)
+
+        message = SimpleNamespace(photo=None, video=None, document=None, media_group_id=group,
+                                  reply_text=reply_text)
+        if kind == "photo":
+            message.photo = [SimpleNamespace(file_id=file_id)]
+        else:
+            setattr(message, kind, SimpleNamespace(file_id=file_id))
+        update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=1))
+        return asyncio.run(recv_post_media(update, self.ctx))
+
+    @property
+    def media(self):
+        return self.ctx.user_data["new_post"]["media"]
+
+
+def test_items_past_the_limit_are_refused_once():
+    chat = Chat()
+    for i in range(ALBUM_MAX_ITEMS + 3):
+        assert chat.send("photo", f"p{i}") == WAIT_POST_MEDIA
+    assert chat.media == [["photo", f"p{i}"] for i in range(ALBUM_MAX_ITEMS)]
+    assert len(chat.replies) == 2       # album started, then one warning
+    assert "were not added" in chat.replies[1]
+
+
+def test_documents_and_photos_do_not_mix():
+    chat = Chat()
+    chat.send("photo", "p1")
+    chat.send("video", "v1")
+    chat.send("document", "d1")
+    assert chat.media == [["photo", "p1"], ["video", "v1"]]
+    assert "all documents or all photos and videos" in chat.replies[-1]
+
+    chat = Chat()
+    chat.send("document", "d1")
+    chat.send("photo", "p1")
+    chat.send("document", "d2")
+    assert chat.media == [["document", "d1"], ["document", "d2"]]
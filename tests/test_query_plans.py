@@ -0,0 +1,70 @@
+"""The hot queries are index searches: no table scan and no sort.
+
+Each function's SQL is captured as it runs against a small database and
+put through EXPLAIN QUERY PLAN.
+"""
+import time
+
+import pytest
+
+import database
+
+NOW = int(time.time())
+
+
+@pytest.fixture
+def statements(sqlite_path, monkeypatch):
+    """The SQL statements run since the last clear(), with parameters filled in."""
+    seen = []
+    connect = database._connect
+
+    def traced(readonly=False):
+        conn = connect(readonly)
+        conn.set_trace_callback(seen.append)
+        return conn
+
+    monkeypatch.setattr(database, "_connect", traced)
+    database.init_db()
+    database.add_channel(1, -100, "Channel")
+    post_id = database.save_post(1, "Title", "Body")
+    database.schedule_post(1, -100, "Channel", NOW - 10, "Body", post_id=post_id)
+    database.log_event(1, "start", "Started")
+    database.flush_writes()
+    jobs = database.queue_deliveries([("publish", 1, post_id, None, -100)])
+    database.start_deliveries(jobs)
+    seen.clear()
+    return seen
+
+
+def plan(sql):
+    with database._read_conn() as conn:
+        return [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+CALLS = {
+    "get_channels":          lambda: database.get_channels(1),
+    "get_posts":             lambda: database.get_posts(1),
+    "get_posts by status":   lambda: database.get_posts(1, "draft"),
+    "get_scheduled_posts":   lambda: database.get_scheduled_posts(1),
+    "get_pending_scheduled": lambda: database.get_pending_scheduled(),
+    "get_due_scheduled":     lambda: database.get_due_scheduled(NOW),
+    "get_upcoming":          lambda: database.get_upcoming_scheduled(100),
+    "count_due_scheduled":   lambda: database.count_due_scheduled(NOW),
+    "claim_due_scheduled":   lambda: database.claim_due_scheduled("worker", NOW, 300),
+    "get_events":            lambda: database.get_events(1),
+    "recover_deliveries":    lambda: database.recover_deliveries(NOW + 3600),
+    "prune_deliveries":      lambda: database.prune_deliveries(NOW + 3600, 100),
+}
+
+
+@pytest.mark.parametrize("call", CALLS.values(), ids=CALLS.keys())
+def test_uses_an_index(statements, call):
+    call()
+    queries = [sql for sql in statements
+               if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+    assert queries
+    for sql in queries:
+        details = plan(sql)
+        assert any(detail.startswith("SEARCH") for detail in details), (sql, details)
+        assert not any(detail.startswith("SCAN") for detail in details), (sql, details)
+        assert not any("TEMP B-TREE" in detail for detail in details), (sql, details)
@@ -0,0 +1,226 @@
+"""The scheduler loop on a fake clock and the memory backend.
+
+The fake clock runs with the event loop from T0, and a test can jump it
+forward without waking the scheduler. After a jump, the scheduler still
+sleeps towards the old deadline, so a job that goes out on time shows
+that add_job woke it.
+
+The last tests check which failed sends are retried: only those that
+never reached Telegram.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from telegram.error import NetworkError, TimedOut
+
+import metrics
+import scheduler
+from config import SCHEDULER_CONCURRENCY, SCHEDULER_WINDOW
+from dispatch import MemoryTransport
+
+T0        = 1_800_000_000
+TOLERANCE = 0.5     # seconds after scheduled_at a job may go out
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.offset = None
+
+    def __call__(self):
+        loop_time = asyncio.get_running_loop().time()
+        if self.offset is None:
+            self.offset = T0 - loop_time
+        return loop_time + self.offset
+
+    def jump(self, seconds):
+        self.offset += seconds
+
+    async def sleep_until(self, when):
+        await asyncio.sleep(max(0, when - self()))
+
+
+class ClockedTransport(MemoryTransport):
+    """Records (chat_id, text, fake time) of every message sent."""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.channel_sends = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if int(chat_id) < 0:
+            self.channel_sends.append((chat_id, text, self.clock()))
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+@pytest.fixture
+def clock(memory_db, monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(scheduler, "clock", fake)
+    monkeypatch.setattr(scheduler, "_jobs", [])
+    monkeypatch.setattr(scheduler, "_next_resync", 0)
+    monkeypatch.setattr(scheduler, "_due_backlog", 0)
+    monkeypatch.setattr(scheduler, "_wakeup", asyncio.Event())
+    return fake
+
+
+async def running(clock, body):
+    """Run the scheduler (idle on an empty queue) around body(bot)."""
+    bot  = ClockedTransport(clock)
+    task = asyncio.create_task(scheduler.run_scheduler(SimpleNamespace(bot=bot)))
+    await asyncio.sleep(0.01)
+    try:
+        await body(bot)
+    finally:
+        task.cancel()
+    return bot
+
+
+def test_added_job_fires_on_time(clock, memory_db):
+    async def body(bot):
+        # The idle scheduler sleeps until its resync at T0 + 60
+        clock.jump(29)
+        due = T0 + 30
+        sched_id = await memory_db.schedule_post(1, -100, "Channel", due, "On time")
+        scheduler.add_job(sched_id, due)
+        await clock.sleep_until(due - 0.2)
+        assert bot.channel_sends == []
+        await clock.sleep_until(due + TOLERANCE)
+
+    bot = asyncio.run(running(clock, body))
+    [(chat_id, text, sent_at)] = bot.channel_sends
+    assert text == "On time"
+    assert T0 + 30 <= sent_at <= T0 + 30 + TOLERANCE
+
+
+def test_removed_job_is_skipped(clock, memory_db):
+    async def body(bot):
+        clock.jump(29)
+        due = T0 + 30
+        sched_id = await memory_db.schedule_post(1, -100, "Channel", due, "Deleted")
+        scheduler.add_job(sched_id, due)
+        await clock.sleep_until(due - 1)
+        # What the delete button does
+        assert await memory_db.delete_scheduled(sched_id, 1)
+        scheduler.remove_job(sched_id)
+        assert scheduler._jobs == []
+        await clock.sleep_until(due + 1)
+
+    bot = asyncio.run(running(clock, body))
+    assert bot.channel_sends == []
+
+
+def test_due_backlog_gauge_grows_past_the_window(clock, memory_db):
+    def gauge(name):
+        [line] = [line for line in metrics.render().splitlines() if line.startswith(f"{name} ")]
+        return int(line.split()[1])
+
+    async def schedule_and_resync(count):
+        for i in range(count):
+            await memory_db.schedule_post(1, -100, "Channel", T0 - 60, f"Due {i}")
+        await memory_db.schedule_post(1, -100, "Channel", T0 + 60, "Not due yet")
+        await scheduler._load_upcoming()
+
+    asyncio.run(schedule_and_resync(5))
+    assert gauge("telebot_scheduler_due_backlog") == 5
+
+    # Falling further behind: the wake-up queue is full, the backlog keeps growing
+    asyncio.run(schedule_and_resync(SCHEDULER_WINDOW))
+    assert gauge("telebot_scheduler_queue_depth") == SCHEDULER_WINDOW
+    assert gauge("telebot_scheduler_due_backlog") == SCHEDULER_WINDOW + 5
+
+
+class SlowTransport(MemoryTransport):
+    """Every send takes `latency` s; records channel sends and the most at once."""
+
+    def __init__(self, latency):
+        super().__init__(latency=latency)
+        self.channel_sends = []
+        self.running = self.peak = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if int(chat_id) > 0:        # the owner's notification
+            return await super().send_message(chat_id, text, **kwargs)
+        self.channel_sends.append((chat_id, text))
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            return await super().send_message(chat_id, text, **kwargs)
+        finally:
+            self.running -= 1
+
+
+def test_deliver_keeps_channel_order_and_runs_channels_in_parallel(clock, memory_db):
+    channels = 2 * SCHEDULER_CONCURRENCY
+
+    async def deliver():
+        # Three rows per channel; the later a row is added, the earlier it is due
+        for i in range(3 * channels):
+            await memory_db.schedule_post(1, -100 - i % channels, "Channel", T0 - i,
+                                          f"{i // channels}")
+        rows = await memory_db.claim_due_scheduled("worker", T0, 300, 1000)
+        bot = SlowTransport(0.02)
+        started = time.perf_counter()
+        await scheduler._deliver(SimpleNamespace(bot=bot), rows)
+        return bot, time.perf_counter() - started
+
+    bot, elapsed = asyncio.run(deliver())
+    by_channel = {}
+    for chat_id, text in bot.channel_sends:
+        by_channel.setdefault(chat_id, []).append(text)
+    assert len(by_channel) == channels
+    assert all(texts == ["2", "1", "0"] for texts in by_channel.values())
+    assert bot.peak == SCHEDULER_CONCURRENCY
+    # One at a time, the sends alone would take 3 * channels * 20 ms = 1.9 s
+    assert elapsed < 1
+
+
+class FailingTransport(MemoryTransport):
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    async def send_message(self, chat_id, text, **kwargs):
+        raise self.error
+
+
+def failure(error, cause):
+    try:
+        raise error from cause
+    except Exception as e:
+        return e
+
+
+ROW = {"id": 1, "channel_id": "-100", "content": "Hello", "media_file_id": None,
+       "media_type": None, "attempts": 0, "requested_at": 0}
+
+
+@pytest.mark.parametrize("error", [
+    failure(TimedOut(), httpx.ReadTimeout("read")),
+    failure(TimedOut(), httpx.WriteTimeout("write")),
+    failure(NetworkError("httpx.ReadError"), httpx.ReadError("reset")),
+    TimedOut(),
+], ids=["read timeout", "write timeout", "read error", "timeout"])
+def test_send_that_may_have_gone_out_is_not_retried(error):
+    app = SimpleNamespace(bot=FailingTransport(error))
+    outcome = asyncio.run(scheduler._send_scheduled(app, ROW))
+    assert outcome["state"] == "failed"
+    assert "may or may not have gone out" in outcome["error"]
+
+
+@pytest.mark.parametrize("error", [
+    failure(TimedOut(), httpx.ConnectTimeout("connect")),
+    failure(TimedOut(), httpx.PoolTimeout("pool")),
+    failure(NetworkError("httpx.ConnectError"), httpx.ConnectError("refused")),
+    NetworkError("Bad Gateway"),
+], ids=["connect timeout", "pool timeout", "connect error", "bad gateway"])
+def test_send_that_never_went_out_is_retried(error):
+    app = SimpleNamespace(bot=FailingTransport(error))
+    outcome = asyncio.run(scheduler._send_scheduled(app, ROW))
+    assert outcome["state"] == "queued"
+    assert outcome["counted"]
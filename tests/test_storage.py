@@ -0,0 +1,512 @@
+"""The conformance suite every Storage backend has to pass.
+
+Each test runs once per backend (the `store` fixture). The random test at
+the end also drives SQLite and memory side by side through the same
+operations and compares every result.
+"""
+import random
+import time
+
+import pytest
+
+from storage import SQLiteStorage, Storage, open_storage
+from memory_storage import MemoryStorage
+
+NOW = int(time.time())
+
+
+def ids(rows):
+    return [row["id"] for row in rows]
+
+
+# ── Lifecycle ────────────────────────────────────────────────────────────────
+
+def test_open_storage():
+    assert isinstance(open_storage("memory"), MemoryStorage)
+    assert isinstance(open_storage("sqlite"), SQLiteStorage)
+    with pytest.raises(ValueError):
+        open_storage("redis")
+
+
+def test_init_db_keeps_data(store):
+    post_id = store.save_post(1, "Kept", "x")
+    store.init_db()
+    assert store.get_post(post_id)["title"] == "Kept"
+
+
+def test_close_db_writes_out_queued_rows(store):
+    store.log_event(1, "start", "Queued")
+    store.close_db()
+    assert [event["description"] for event in store.get_events(1)] == ["Queued"]
+
+
+def test_compact_db(store):
+    for i in range(200):
+        store.save_post(1, "Big", "x" * 4000)
+    for post in store.get_posts(1):
+        store.delete_post(post["id"], 1)
+    assert store.compact_db(10 ** 6) == 0
+
+
+# ── Channels ─────────────────────────────────────────────────────────────────
+
+def test_channels(store):
+    assert store.add_channel(1, -100, "A")
+    assert store.add_channel(1, -101, "B")
+    assert store.add_channel(1, -100, "A again")      # already there: kept as is
+    store.add_channel(2, -100, "Other user")
+
+    rows = store.get_channels(1)
+    assert [(row["channel_id"], row["channel_name"]) for row in rows] == [("-101", "B"), ("-100", "A")]
+
+    store.delete_channel(1, -100)
+    assert [row["channel_id"] for row in store.get_channels(1)] == ["-101"]
+    assert [row["channel_id"] for row in store.get_channels(2)] == ["-100"]
+
+
+# ── Posts ────────────────────────────────────────────────────────────────────
+
+def test_posts(store):
+    first  = store.save_post(1, "First", "x" * 60)
+    second = store.save_post(1, "Second", "short", "file1", "photo")
+    store.save_post(2, "Other user", "z")
+
+    assert ids(store.get_posts(1)) == [second, first]
+    assert ids(store.get_posts(1, "draft")) == [second, first]
+    assert store.get_posts(1, "published") == []
+
+    post = store.get_post(second)
+    assert (post["user_id"], post["title"], post["content"], post["media_file_id"],
+            post["media_type"], post["status"]) == (1, "Second", "short", "file1", "photo", "draft")
+    assert store.get_post(10 ** 6) is None
+
+    store.delete_post(first, 2)                       # not the owner
+    assert store.get_post(first) is not None
+    store.delete_post(first, 1)
+    assert store.get_post(first) is None
+
+
+def test_posts_page(store):
+    newest = [store.save_post(1, f"Post {i}", "c" * 50) for i in range(7)][::-1]
+
+    rows, has_prev, has_next = store.get_posts_page(1, limit=3)
+    assert (ids(rows), has_prev, has_next) == (newest[:3], False, True)
+    assert len(rows[0]["content"]) == 40
+
+    rows, has_prev, has_next = store.get_posts_page(1, rows[-1]["id"], "next", 3)
+    assert (ids(rows), has_prev, has_next) == (newest[3:6], True, True)
+
+    rows, has_prev, has_next = store.get_posts_page(1, rows[-1]["id"], "next", 3)
+    assert (ids(rows), has_prev, has_next) == (newest[6:], True, False)
+
+    rows, has_prev, has_next = store.get_posts_page(1, rows[0]["id"], "prev", 3)
+    assert (ids(rows), has_prev, has_next) == (newest[3:6], True, True)
+
+    assert store.get_posts_page(2) == ([], False, False)
+
+
+def test_album_media(store):
+    items  = [("photo", "a"), ("video", "b"), ("photo", "c")]
+    album  = store.save_post(1, "Album", "Caption", None, "album", items)
+    single = store.save_post(1, "Single", "x")
+    gone   = store.save_post(1, "Unscheduled album", "y", None, "album", items[:2])
+
+    assert store.get_post_media([album, single, gone]) == {album: items, gone: items[:2]}
+    assert store.get_post_media([]) == {}
+
+    # A pending scheduled copy still sends from the items after the post is deleted
+    store.schedule_post(1, -100, "A", NOW + 60, "Caption", None, "album", album)
+    store.delete_post(album, 1)
+    store.delete_post(gone, 1)
+    assert store.get_post_media([album, gone]) == {album: items}
+
+
+@pytest.mark.parametrize("settle", ["sent", "failed", "deleted"])
+def test_album_media_goes_with_the_last_schedule(store, settle):
+    items = [("photo", "a"), ("video", "b")]
+    album = store.save_post(1, "Album", "Caption", None, "album", items)
+    first, last = (store.schedule_post(1, -100 - i, "A", NOW + 60, "Caption", None, "album", album)
+                   for i in range(2))
+    kept = store.save_post(1, "Kept", "Caption", None, "album", items)
+    store.schedule_post(1, -100, "A", NOW + 60, "Caption", None, "album", kept)
+    store.delete_post(album, 1)
+
+    def settle_one(sched_id):
+        if settle == "deleted":
+            assert store.delete_scheduled(sched_id, 1)
+        else:
+            store.mark_scheduled_many([(sched_id, settle)])
+
+    settle_one(first)
+    assert store.get_post_media([album]) == {album: items}      # `last` still sends from them
+    settle_one(last)
+    assert store.get_post_media([album, kept]) == {kept: items}
+
+
+# ── Scheduled posts ──────────────────────────────────────────────────────────
+
+def test_scheduled_posts(store):
+    later  = store.schedule_post(1, -100, "A", NOW + 120, "later")
+    sooner = store.schedule_post(1, -101, "B", NOW + 60, "sooner", "file1", "photo", 7)
+    other  = store.schedule_post(2, -100, "A", NOW + 30, "other user")
+
+    assert ids(store.get_scheduled_posts(1)) == [sooner, later]
+    assert ids(store.get_pending_scheduled()) == [other, sooner, later]
+
+    row = store.get_scheduled(sooner)
+    assert (row["user_id"], row["post_id"], row["channel_id"], row["channel_name"], row["content"],
+            row["media_file_id"], row["media_type"]) == (1, 7, "-101", "B", "sooner", "file1", "photo")
+    assert (row["status"], row["scheduled_at"], row["requested_at"], row["attempts"],
+            row["last_error"]) == ("pending", NOW + 60, NOW + 60, 0, None)
+    assert row["scheduled_time"] == time.strftime("%Y-%m-%d %H:%M", time.gmtime(NOW + 60))
+
+    assert not store.delete_scheduled(sooner, 2)      # not the owner
+    assert store.delete_scheduled(sooner, 1)
+    assert not store.delete_scheduled(sooner, 1)
+    assert store.get_scheduled(sooner) is None
+    assert ids(store.get_scheduled_posts(1)) == [later]
+
+
+def test_scheduled_page(store):
+    soonest = [store.schedule_post(1, -100, "A", NOW + 60 * i, f"#{i}") for i in range(5)]
+
+    rows, has_prev, has_next = store.get_scheduled_page(1, limit=2)
+    assert (ids(rows), has_prev, has_next) == (soonest[:2], False, True)
+    assert set(rows[0].keys()) >= {"id", "scheduled_time", "channel_id", "channel_name"}
+
+    rows, has_prev, has_next = store.get_scheduled_page(1, rows[-1]["id"], "next", 2)
+    assert (ids(rows), has_prev, has_next) == (soonest[2:4], True, True)
+
+    rows, has_prev, has_next = store.get_scheduled_page(1, rows[0]["id"], "prev", 2)
+    assert (ids(rows), has_prev, has_next) == (soonest[:2], False, True)
+
+    store.mark_scheduled_sent(soonest[0])
+    rows, _, _ = store.get_scheduled_page(1, limit=2)
+    assert ids(rows) == soonest[1:3]
+
+
+def test_due_and_upcoming(store):
+    due    = [store.schedule_post(1, -100, "A", NOW - 10 + i, f"due {i}") for i in range(3)]
+    future = store.schedule_post(1, -100, "A", NOW + 600, "future")
+
+    assert ids(store.get_due_scheduled(NOW, 2)) == due[:2]
+    assert ids(store.get_due_scheduled(NOW)) == due
+    assert [(row["id"], row["wake_at"]) for row in store.get_upcoming_scheduled(10)] == \
+        [(due[0], NOW - 10), (due[1], NOW - 9), (due[2], NOW - 8), (future, NOW + 600)]
+    assert len(store.get_upcoming_scheduled(2)) == 2
+
+    # A leased row wakes the scheduler when its lease runs out
+    store.claim_due_scheduled("other", NOW, 300, 1)
+    upcoming = {row["id"]: row["wake_at"] for row in store.get_upcoming_scheduled(10)}
+    assert upcoming[due[0]] == NOW + 300
+    assert upcoming[due[1]] == NOW - 9
+
+
+def test_count_due(store):
+    due = [store.schedule_post(1, -100, "A", NOW - 10 + i, f"due {i}") for i in range(3)]
+    store.schedule_post(1, -100, "A", NOW + 600, "future")
+    assert store.count_due_scheduled(NOW) == 3
+    assert store.count_due_scheduled(NOW - 10) == 1
+    assert store.count_due_scheduled(NOW + 600) == 4
+
+    # Leased rows are still waiting; settled and deleted ones are not
+    store.claim_due_scheduled("other", NOW, 300, 1)
+    store.mark_scheduled_many([(due[1], "sent")])
+    store.delete_scheduled(due[2], 1)
+    assert store.count_due_scheduled(NOW) == 1
+
+
+def test_claims_lease_rows(store):
+    due = [store.schedule_post(1, -100, "A", NOW - 5, f"due {i}") for i in range(3)]
+    store.schedule_post(1, -100, "A", NOW + 600, "not due")
+
+    first = store.claim_due_scheduled("a", NOW, 300, 2)
+    assert ids(first) == due[:2]
+    assert all((row["leased_by"], row["lease_until"]) == ("a", NOW + 300) for row in first)
+
+    assert ids(store.claim_due_scheduled("b", NOW, 300, 10)) == due[2:]
+    assert store.claim_due_scheduled("b", NOW + 299, 300, 10) == []
+
+    # Once the leases run out (the claimer died), the rows can be claimed again
+    assert ids(store.claim_due_scheduled("b", NOW + 300, 300, 10)) == due
+
+
+def test_retries(store):
+    sched = store.schedule_post(1, -100, "A", NOW - 5, "x")
+    store.claim_due_scheduled("a", NOW, 300)
+
+    store.retry_scheduled(sched, NOW + 60, "Timed out")
+    row = store.get_scheduled(sched)
+    assert (row["scheduled_at"], row["requested_at"], row["attempts"], row["last_error"],
+            row["leased_by"], row["lease_until"]) == (NOW + 60, NOW - 5, 1, "Timed out", None, None)
+
+    store.retry_scheduled(sched, NOW + 90, "Flood control exceeded", counted=False)
+    row = store.get_scheduled(sched)
+    assert (row["scheduled_at"], row["attempts"], row["last_error"]) == \
+        (NOW + 90, 1, "Flood control exceeded")
+    assert store.claim_due_scheduled("a", NOW + 60, 300) == []
+    assert ids(store.claim_due_scheduled("a", NOW + 90, 300)) == [sched]
+
+    other = store.schedule_post(1, -101, "B", NOW - 5, "y")
+    store.retry_scheduled_many([(sched, NOW + 200, "e1", True), (other, NOW + 100, "e2", False)])
+    assert [(row["id"], row["attempts"], row["last_error"]) for row in store.get_pending_scheduled()] == \
+        [(other, 0, "e2"), (sched, 2, "e1")]
+    store.retry_scheduled_many([])
+
+    # Only pending rows are put back
+    store.mark_scheduled_sent(sched)
+    store.retry_scheduled(sched, NOW + 500, "late")
+    row = store.get_scheduled(sched)
+    assert (row["status"], row["scheduled_at"]) == ("sent", NOW + 200)
+
+
+def test_status_marks(store):
+    a, b, c, d = [store.schedule_post(1, -100, "A", NOW + i, "x") for i in range(4)]
+    store.mark_scheduled_sent(a)
+    store.mark_scheduled_failed(b)
+    store.mark_scheduled_many([(c, "sent"), (d, "failed")])
+    store.mark_scheduled_many([])
+
+    assert [store.get_scheduled(i)["status"] for i in (a, b, c, d)] == ["sent", "failed", "sent", "failed"]
+    assert store.get_scheduled_posts(1) == []
+    assert store.get_pending_scheduled() == []
+    assert store.get_upcoming_scheduled(10) == []
+    assert store.claim_due_scheduled("a", NOW + 10, 300) == []
+
+
+# ── Delivery outbox ──────────────────────────────────────────────────────────
+
+def test_outbox_lifecycle(store):
+    jobs = store.queue_deliveries([("multipost", 1, 7, None, -100), ("multipost", 1, 7, None, -101)])
+    assert len(set(jobs)) == 2
+
+    assert store.start_deliveries(jobs + [10 ** 6]) == {jobs[0]: "queued", jobs[1]: "queued"}
+    # Started jobs are never started again
+    assert store.start_deliveries(jobs) == {jobs[0]: "in_flight", jobs[1]: "in_flight"}
+
+    store.finish_deliveries([(jobs[0], "sent", 42, None), (jobs[1], "failed", None, "Forbidden")])
+    assert store.start_deliveries(jobs) == {jobs[0]: "sent", jobs[1]: "failed"}
+    assert store.start_deliveries([]) == {}
+
+
+def test_outbox_reuses_a_scheduled_posts_job(store):
+    [job] = store.queue_deliveries([("scheduled", 1, 7, 5, -100)])
+    store.start_deliveries([job])
+    assert store.queue_deliveries([("scheduled", 1, 7, 5, -100)]) == [job]
+    assert store.start_deliveries([job]) == {job: "in_flight"}
+
+    # Put back for a retry, then started again
+    store.finish_deliveries([(job, "queued", None, "Timed out")])
+    assert store.start_deliveries([job]) == {job: "queued"}
+
+
+def test_outbox_recovery(store):
+    queued, in_flight, sent = store.queue_deliveries([
+        ("publish", 1, 7, None, -100), ("multipost", 2, 7, None, -101), ("publish", 1, 7, None, -102),
+    ])
+    [scheduled] = store.queue_deliveries([("scheduled", 1, 7, 5, -103)])
+    store.start_deliveries([in_flight, sent, scheduled])
+    store.finish_deliveries([(sent, "sent", 1, None)])
+
+    assert store.recover_deliveries(NOW - 3600) == ([], [])     # nothing stale yet
+
+    interrupted, stale = store.recover_deliveries(NOW + 3600)
+    assert [(job["id"], job["user_id"], job["state"], job["error"]) for job in interrupted] == \
+        [(in_flight, 2, "failed", "interrupted")]
+    assert [(job["id"], job["kind"], job["post_id"], job["channel_id"]) for job in stale] == \
+        [(queued, "publish", 7, "-100")]
+    assert store.recover_deliveries(NOW + 3600)[0] == []
+
+    # Scheduled posts' jobs are settled by the scheduler, not by recovery
+    assert store.start_deliveries([scheduled]) == {scheduled: "in_flight"}
+
+
+def test_prune_deliveries(store):
+    jobs = store.queue_deliveries([("publish", 1, 7, None, -100 - i) for i in range(4)])
+    store.start_deliveries(jobs)
+    store.finish_deliveries([(jobs[0], "sent", 1, None), (jobs[1], "failed", None, "e"),
+                             (jobs[2], "sent", 2, None)])
+
+    assert store.prune_deliveries(NOW - 3600, 10) == 0
+    assert store.prune_deliveries(NOW + 3600, 2) == 2
+    # Failed jobs go first, then the oldest sent ones
+    assert store.start_deliveries(jobs[:3]) == {jobs[2]: "sent"}
+    assert store.prune_deliveries(NOW + 3600, 10) == 1
+    # The job still in flight is kept
+    assert store.start_deliveries(jobs) == {jobs[3]: "in_flight"}
+
+
+# ── Event log ────────────────────────────────────────────────────────────────
+
+def test_events(store):
+    for i in range(5):
+        store.log_event(1, "post_created", f"Event {i}", -100, i)
+    store.log_event(2, "start", "Other user")
+
+    events = store.get_events(1, 3)
+    assert [event["description"] for event in events] == ["Event 4", "Event 3", "Event 2"]
+    assert (events[0]["user_id"], events[0]["event_type"], events[0]["channel_id"],
+            events[0]["post_id"]) == (1, "post_created", "-100", 4)
+
+    store.clear_events(1)
+    assert store.get_events(1) == []
+    assert [event["description"] for event in store.get_events(2)] == ["Other user"]
+
+
+def test_prune_events(store):
+    for i in range(5):
+        store.log_event(1, "start", f"Event {i}")
+    store.flush_writes()
+
+    assert store.prune_events("2000-01-01 00:00:00", 10) == 0
+    assert store.prune_events("9999-01-01 00:00:00", 3) == 3
+    assert [event["description"] for event in store.get_events(1)] == ["Event 4", "Event 3"]
+
+
+# ── Callback tokens ──────────────────────────────────────────────────────────
+
+def test_callback_tokens(store):
+    store.save_callback_token("old", "[1]", 100)
+    store.save_callback_token("new", "[2]", 200)
+    store.save_callback_token("old", "[3]", 150)      # refreshed
+
+    row = store.get_callback_token("old")
+    assert (row["payload"], row["created_at"]) == ("[3]", 150)
+    assert store.get_callback_token("missing") is None
+
+    assert store.prune_callback_tokens(160, 10) == 1
+    assert store.get_callback_token("old") is None
+    assert store.get_callback_token("new")["payload"] == "[2]"
+
+
+# ── User state ───────────────────────────────────────────────────────────────
+
+def test_user_state(store):
+    assert store.get_user_state(1) is None
+    store.save_user_states([(1, '{"a": 1}'), (2, '{"b": 2}')])
+    store.save_user_states([(1, '{"a": 3}'), (2, None), (3, None)])
+    assert store.get_user_state(1) == '{"a": 3}'
+    assert store.get_user_state(2) is None
+
+
+# ── Settings ─────────────────────────────────────────────────────────────────
+
+def test_settings(store):
+    row = store.get_settings(1)
+    assert (row["user_id"], row["timezone"], row["default_channel"], row["notifications"]) == \
+        (1, "UTC", None, 1)
+
+    store.update_setting(1, "notifications", 0)
+    store.update_setting(2, "timezone", "Europe/Berlin")     # no row yet
+    assert store.get_settings(1)["notifications"] == 0
+    assert store.get_settings(2)["timezone"] == "Europe/Berlin"
+
+
+# ── Both backends side by side ───────────────────────────────────────────────
+
+def _comparable(value):
+    """Results with rows turned into dicts, minus the wall-clock timestamps."""
+    if isinstance(value, (list, tuple)):
+        return type(value)(_comparable(item) for item in value)
+    if value is not None and hasattr(value, "keys"):
+        return {key: _comparable(value[key]) for key in value.keys()
+                if key not in ("created_at", "added_at", "updated_at")}
+    return value
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_random_operations_match(sqlite_path, seed):
+    sqlite, memory = open_storage("sqlite"), open_storage("memory")
+    sqlite.init_db()
+    rnd = random.Random(seed)
+    times = rnd.sample(range(1000, 100000), 2000)
+    posts, schedules, jobs = [], [], []
+
+    def both(name, *args):
+        expected = getattr(sqlite, name)(*args)
+        sqlite.flush_writes()
+        assert _comparable(getattr(memory, name)(*args)) == _comparable(expected), (name, args)
+        return expected
+
+    for _ in range(1500):
+        user = rnd.randint(1, 5)
+        channel = rnd.randrange(-1005, -1000)
+        op = rnd.randrange(14)
+        if op == 0:
+            both("add_channel", user, channel, f"ch{rnd.randrange(9)}")
+            both("get_channels", user)
+        elif op == 1:
+            both("delete_channel", user, channel)
+        elif op == 2:
+            posts.append(both("save_post", user, "t", rnd.choice(["x" * 60, "short", None])))
+            both("get_posts", user, rnd.choice([None, "draft"]))
+        elif op == 3:
+            cursor = rnd.choice([None, 10 ** 6] + posts[-20:])
+            both("get_posts_page", user, cursor, rnd.choice(["next", "prev"]), rnd.randint(1, 5))
+        elif op == 4 and posts:
+            both("get_post", rnd.choice(posts))
+            both("delete_post", rnd.choice(posts), user)
+        elif op == 5:
+            schedules.append(both("schedule_post", user, channel, "c", times.pop(), "hi"))
+            both("get_scheduled_posts", user)
+        elif op == 6:
+            cursor = rnd.choice([None, 10 ** 6] + schedules[-20:])
+            both("get_scheduled_page", user, cursor, rnd.choice(["next", "prev"]), rnd.randint(1, 5))
+        elif op == 7:
+            both("get_due_scheduled", rnd.randrange(100000), rnd.randint(1, 20))
+            both("get_upcoming_scheduled", 7)
+            both("count_due_scheduled", rnd.randrange(100000))
+            both("get_pending_scheduled")
+        elif op == 8:
+            both("claim_due_scheduled", rnd.choice("ab"), rnd.randrange(100000), 300, rnd.randint(1, 10))
+        elif op == 9 and schedules:
+            picked = [rnd.choice(schedules) for _ in range(3)]
+            choice = rnd.randrange(4)
+            if choice == 0:
+                both("retry_scheduled", picked[0], times.pop(), "err", rnd.random() < 0.5)
+            elif choice == 1:
+                both("retry_scheduled_many", [(i, times.pop(), "err", True) for i in picked])
+            elif choice == 2:
+                both(rnd.choice(["mark_scheduled_sent", "mark_scheduled_failed"]), picked[0])
+            else:
+                both("mark_scheduled_many", [(i, rnd.choice(["sent", "failed"])) for i in picked])
+            both("get_scheduled", picked[0])
+        elif op == 10 and schedules:
+            both("delete_scheduled", rnd.choice(schedules), user)
+        elif op == 11:
+            kind = rnd.choice(["publish", "multipost", "scheduled"])
+            jobs.extend(both("queue_deliveries", [
+                (kind, user, rnd.choice(posts or [1]),
+                 rnd.choice(schedules or [None]) if kind == "scheduled" else None, channel)
+                for _ in range(rnd.randint(1, 3))
+            ]))
+        elif op == 12 and jobs:
+            picked = rnd.sample(jobs, min(len(jobs), 3))
+            choice = rnd.random()
+            if choice < 0.4:
+                both("start_deliveries", picked)
+            elif choice < 0.8:
+                both("finish_deliveries", [(job, rnd.choice(["sent", "failed", "queued"]),
+                                            rnd.choice([None, 5]), rnd.choice([None, "e"]))
+                                           for job in picked])
+            elif choice < 0.9:
+                both("recover_deliveries", rnd.choice([0, 10 ** 12]))
+            else:
+                both("prune_deliveries", rnd.choice([0, 10 ** 12]), rnd.randint(1, 4))
+        elif op == 13:
+            both("log_event", user, "post", "d")
+            both("get_events", user, rnd.randint(1, 40))
+            both("save_callback_token", f"tok{rnd.randrange(50)}", "[1]", rnd.randrange(100))
+            both("get_callback_token", f"tok{rnd.randrange(50)}")
+            both("save_user_states", [(user, rnd.choice([None, '{"a": 1}']))])
+            both("get_user_state", user)
+            both("update_setting", user, "notifications", rnd.randint(0, 1))
+            both("get_settings", user)
+
+
+def test_every_storage_method_is_covered():
+    """Keep this suite in step with the interface: every Storage method is used above."""
+    with open(__file__) as f:
+        source = f.read()
+    missing = [name for name in sorted(Storage.__abstractmethods__) if name not in source]
+    assert missing == []
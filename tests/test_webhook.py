@@ -0,0 +1,138 @@
+"""Webhook mode end to end, against a FakeBotAPI.
+
+Recorded updates (the JSON Telegram would send) are posted to the bot's
+local webhook server, and the bot's replies are compared with the same
+updates fetched by long polling.
+"""
+import asyncio
+import json
+import re
+import socket
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+import main
+from fake_bot_api import FakeBotAPI
+
+SECRET  = "webhook-test-secret"
+UPDATES = 300
+USERS   = range(100000, 100000 + UPDATES)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def webhook_mode(monkeypatch):
+    """main configured for webhook mode; returns the local URL to post updates to."""
+    port = free_port()
+    monkeypatch.setattr(main, "UPDATE_MODE", "webhook")
+    monkeypatch.setattr(main, "WEBHOOK_URL", f"https://bot.example.com/{main.WEBHOOK_PATH}")
+    monkeypatch.setattr(main, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(main, "WEBHOOK_LISTEN", "127.0.0.1")
+    monkeypatch.setattr(main, "WEBHOOK_PORT", port)
+    return f"http://127.0.0.1:{port}/{main.WEBHOOK_PATH}"
+
+
+async def run_bot(api, monkeypatch, deliver):
+    """Start the bot in the configured mode, send /start from every user
+    through `deliver` and return updates answered per second."""
+    monkeypatch.setattr(main, "BOT_API_BASE_URL", await api.start())
+    app = main.build_app()
+    async with app:
+        await app.start()
+        await main.start_updates(app)
+        try:
+            started = time.perf_counter()
+            for user_id in USERS:
+                api.send_text(user_id, "/start")
+            await deliver()
+            await asyncio.gather(*(api.wait_for(user_id) for user_id in USERS))
+            return UPDATES / (time.perf_counter() - started)
+        finally:
+            await app.updater.stop()
+            await app.stop()
+            await api.stop()
+
+
+async def post_updates(url, updates, secret=SECRET):
+    """POST each update as Telegram would; return the HTTP status codes.
+
+    Plain HTTP/1.1 over WEBHOOK_MAX_CONNECTIONS keep-alive connections (as
+    many as Telegram opens), so the client costs the event loop little
+    next to the bot it is measuring.
+    """
+    host, port, path = urlsplit(url).hostname, urlsplit(url).port, urlsplit(url).path
+    pending = list(enumerate(updates))
+    statuses = [None] * len(updates)
+
+    async def connection():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while pending:
+                index, update = pending.pop()
+                body = json.dumps(update).encode()
+                writer.write(
+                    f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n".encode() + body
+                )
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+                statuses[index] = int(head.split(" ", 2)[1])
+                length = re.search(r"(?i)content-length: *(\d+)", head)
+                await reader.readexactly(int(length.group(1)) if length else 0)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(connection() for _ in range(min(len(updates), main.WEBHOOK_MAX_CONNECTIONS))))
+    return statuses
+
+
+@pytest.mark.parametrize("url, secret", [("", SECRET), ("https://bot.example.com/telegram", ""), ("", "")])
+def test_webhook_mode_needs_url_and_secret(webhook_mode, monkeypatch, url, secret):
+    monkeypatch.setattr(main, "WEBHOOK_URL", url)
+    monkeypatch.setattr(main, "WEBHOOK_SECRET", secret)
+    with pytest.raises(RuntimeError, match="WEBHOOK_URL and WEBHOOK_SECRET"):
+        asyncio.run(main.start_updates(None))
+
+
+def test_webhook_keeps_up_with_polling(webhook_mode, memory_db, monkeypatch):
+    polling_api = FakeBotAPI()
+    with monkeypatch.context() as polling:
+        polling.setattr(main, "UPDATE_MODE", "polling")
+        polling_rate = asyncio.run(run_bot(polling_api, polling, lambda: asyncio.sleep(0)))
+
+    webhook_api = FakeBotAPI()
+
+    async def deliver():
+        assert set(await post_updates(webhook_mode, webhook_api.take_updates())) == {200}
+
+    webhook_rate = asyncio.run(run_bot(webhook_api, monkeypatch, deliver))
+
+    print(f"\n/start answered: polling {polling_rate:.0f}/s, webhook {webhook_rate:.0f}/s")
+    assert webhook_api.webhook["url"] == main.WEBHOOK_URL
+    assert webhook_api.webhook["secret_token"] == SECRET
+    assert webhook_api.calls["getUpdates"] == 0
+    for api in (polling_api, webhook_api):
+        assert all(len(api.outbox[user_id]) == 1 for user_id in USERS)
+    # Generous, for noisy machines: the two usually land within 20%
+    assert webhook_rate > polling_rate / 2
+
+
+def test_webhook_rejects_a_wrong_secret(webhook_mode, memory_db, monkeypatch):
+    api = FakeBotAPI()
+
+    async def deliver():
+        updates = api.take_updates()
+        assert set(await post_updates(webhook_mode, updates, secret="wrong")) == {403}
+        assert set(await post_updates(webhook_mode, updates[:1], secret="")) == {403}
+        await asyncio.sleep(0.2)
+        assert sum(len(api.outbox[user_id]) for user_id in USERS) == 0
+        assert set(await post_updates(webhook_mode, updates)) == {200}
+
+    asyncio.run(run_bot(api, monkeypatch, deliver))
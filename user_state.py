@@ -0,0 +1,70 @@
+"""Persist users' ctx.user_data (flow state and drafts) in the SQLite DB.
+
+A user's saved state is loaded the first time the Router sees them after a
+start, so startup cost does not grow with the user count. Changed state is
+written in one batch every USER_STATE_FLUSH_INTERVAL seconds and on
+shutdown, not on every update.
+"""
+import asyncio
+import json
+import logging
+
+import async_db as db
+from config import USER_STATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_loaded = set()     # users whose saved state has been read this run
+_dirty  = set()     # users handled since the last flush
+_saved  = {}        # user_id -> JSON last read from or written to the DB
+
+
+async def load(user_id, user_data):
+    """Merge the user's saved state into user_data, once per run."""
+    if user_id in _loaded:
+        return
+    _loaded.add(user_id)
+    saved = await db.get_user_state(user_id)
+    if saved is not None:
+        _saved[user_id] = saved
+        # Anything set while the read was in flight wins over the saved copy
+        user_data.update({**json.loads(saved), **user_data})
+
+
+def touch(user_id):
+    """Note that the user's state may have changed and should be flushed."""
+    _dirty.add(user_id)
+
+
+async def flush(app):
+    """Write the state of every touched user whose JSON changed since it was last saved."""
+    global _dirty
+    touched, _dirty = _dirty, set()
+    states = []
+    for user_id in touched:
+        data = app.user_data.get(user_id)
+        payload = json.dumps(data, separators=(",", ":"), default=str) if data else None
+        if payload != _saved.get(user_id):
+            states.append((user_id, payload))
+    if not states:
+        return
+    try:
+        await db.save_user_states(states)
+    except Exception:
+        _dirty |= touched
+        raise
+    for user_id, payload in states:
+        if payload is None:
+            _saved.pop(user_id, None)
+        else:
+            _saved[user_id] = payload
+
+
+async def run_flusher(app):
+    """Background task: flush changed user state every USER_STATE_FLUSH_INTERVAL s."""
+    while True:
+        await asyncio.sleep(USER_STATE_FLUSH_INTERVAL)
+        try:
+            await flush(app)
+        except Exception as e:
+            logger.error(f"User state flush failed: {e}")